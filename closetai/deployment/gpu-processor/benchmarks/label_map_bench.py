@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark label-map upsampling modes in segmentation.label_map.
+
+Builds SegFormer-shaped logits (18 classes at 128x128) for a synthetic
+outfit photo - background, hair, upper clothes, pants, shoes, bag - and
+times each quality mode at common upload sizes, reporting agreement with
+the exact (full-logit bilinear) mask.
+
+Usage:
+    python benchmarks/label_map_bench.py
+    python benchmarks/label_map_bench.py --sizes 4000x3000 --repeats 5
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from segmentation import MASK_QUALITIES, label_map  # noqa: E402
+
+
+def synthetic_logits(num_classes: int = 18, size: int = 128, seed: int = 0) -> torch.Tensor:
+    """Smoothed one-hot logits for a person-shaped layout plus mild noise."""
+    yy, xx = np.mgrid[0:size, 0:size] / size
+    labels = np.zeros((size, size), dtype=np.int64)
+    labels[((yy - 0.12) ** 2 + (xx - 0.5) ** 2) < 0.008] = 2          # hair
+    labels[(yy > 0.2) & (yy < 0.55) & (np.abs(xx - 0.5) < 0.2)] = 4   # upper clothes
+    labels[(yy >= 0.55) & (yy < 0.9) & (np.abs(xx - 0.5) < 0.15)] = 6  # pants
+    labels[(yy >= 0.9) & (np.abs(xx - 0.42) < 0.05)] = 9              # left shoe
+    labels[(yy >= 0.9) & (np.abs(xx - 0.58) < 0.05)] = 10             # right shoe
+    labels[(yy > 0.45) & (yy < 0.65) & (np.abs(xx - 0.78) < 0.07)] = 11  # bag
+
+    one_hot = F.one_hot(torch.from_numpy(labels), num_classes).permute(2, 0, 1).float()[None]
+    smooth = F.avg_pool2d(one_hot, 5, stride=1, padding=2) * 8
+    rng = torch.Generator().manual_seed(seed)
+    return smooth + 0.5 * torch.randn(smooth.shape, generator=rng)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark label_map quality modes")
+    parser.add_argument("--sizes", nargs="+", default=["640x480", "1920x1440", "4032x3024"],
+                        help="Output sizes as WIDTHxHEIGHT")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    logits = synthetic_logits()
+    print(f"{'size':>10}  {'mode':>6}  {'ms':>9}  {'agreement':>9}")
+    for spec in args.sizes:
+        size = tuple(int(v) for v in spec.split("x"))
+        reference = label_map(logits, size, quality="exact")
+        for quality in MASK_QUALITIES:
+            times = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                labels = label_map(logits, size, quality=quality)
+                times.append(time.perf_counter() - start)
+            agreement = float((labels == reference).mean())
+            print(f"{spec:>10}  {quality:>6}  {min(times) * 1000:9.1f}  {agreement:9.5f}")
+
+
+if __name__ == "__main__":
+    main()
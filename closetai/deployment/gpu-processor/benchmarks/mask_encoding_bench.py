@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark mask storage: the previous full-resolution 8-bit garment mask
+plus one 8-bit mask per item, against a single palette PNG label map at
+working resolution (and multi-class RLE for comparison).
+
+The synthetic label map has blob-shaped garments with ragged borders,
+roughly what SegFormer produces on a full-body photo.
+
+Usage:
+    python benchmarks/mask_encoding_bench.py
+    python benchmarks/mask_encoding_bench.py --working 1024 --original 3024x4032
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from garments import GARMENT_CLASSES, class_boxes  # noqa: E402
+from masks import decode_label_png, encode_label_png, rle_encode  # noqa: E402
+
+
+def synthetic_labels(width: int, height: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    labels = np.zeros((height, width), dtype=np.uint8)
+    for class_id, (cy, cx, ry, rx) in {
+        2: (0.08, 0.5, 0.06, 0.08), 11: (0.14, 0.5, 0.05, 0.05), 4: (0.35, 0.5, 0.17, 0.2),
+        6: (0.68, 0.5, 0.2, 0.13), 9: (0.93, 0.44, 0.03, 0.05), 10: (0.93, 0.56, 0.03, 0.05),
+        16: (0.5, 0.8, 0.08, 0.06),
+    }.items():
+        noise = rng.normal(0, 0.04, (height, width))
+        blob = ((yy / height - cy) / ry) ** 2 + ((xx / width - cx) / rx) ** 2 < 1 + noise
+        labels[blob] = class_id
+    return labels
+
+
+def old_encoding(labels: np.ndarray, original_size) -> int:
+    garment = np.isin(labels, list(GARMENT_CLASSES)).astype(np.uint8) * 255
+    buf = io.BytesIO()
+    Image.fromarray(garment).resize(original_size, Image.NEAREST).save(buf, format="PNG")
+    total = buf.tell()
+    areas, boxes = class_boxes(labels, 18)
+    for class_id in GARMENT_CLASSES:
+        if areas[class_id]:
+            x0, y0, x1, y1 = boxes[class_id]
+            buf = io.BytesIO()
+            Image.fromarray(labels[y0:y1, x0:x1] == class_id).save(buf, format="PNG")
+            total += buf.tell()
+    return total
+
+
+def best_of(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark label map encodings")
+    parser.add_argument("--working", type=int, default=1024, help="longer side of the label map")
+    parser.add_argument("--original", default="3024x4032", help="WIDTHxHEIGHT of the upload")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    original = tuple(int(v) for v in args.original.split("x"))
+    scale = args.working / max(original)
+    labels = synthetic_labels(round(original[0] * scale), round(original[1] * scale))
+
+    old_ms, old_bytes = best_of(lambda: old_encoding(labels, original), args.repeats)
+    png_ms, png = best_of(lambda: encode_label_png(labels, original), args.repeats)
+    dec_ms, _ = best_of(lambda: decode_label_png(png), args.repeats)
+    rle_ms, rle = best_of(lambda: json.dumps(rle_encode(labels)), args.repeats)
+
+    print(f"label map {labels.shape[1]}x{labels.shape[0]}, upload {original[0]}x{original[1]}")
+    print(f"{'8-bit PNG masks (before)':28s} {old_ms:8.1f} ms {old_bytes / 1024:9.1f} KiB")
+    print(f"{'palette PNG label map':28s} {png_ms:8.1f} ms {len(png) / 1024:9.1f} KiB  (decode {dec_ms:.1f} ms)")
+    print(f"{'multi-class RLE (JSON)':28s} {rle_ms:8.1f} ms {len(rle) / 1024:9.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Benchmark /generate-outfit's engine on a synthetic closet.
+
+Items get a two-color palette and a random embedding (the size of the
+embedding service's CLIP vectors); the category mix roughly follows a
+real wardrobe.
+
+Usage:
+    python benchmarks/outfit_bench.py
+    python benchmarks/outfit_bench.py --items 300 1000 --beam-width 128
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from outfits import generate_outfits  # noqa: E402
+
+CATEGORY_MIX = {"top": 0.33, "bottom": 0.27, "dress": 0.1, "shoes": 0.17, "outerwear": 0.13}
+
+
+def synthetic_closet(n: int, embedding_dim: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    categories = rng.choice(list(CATEGORY_MIX), size=n, p=list(CATEGORY_MIX.values()))
+    return [
+        {
+            "id": f"item-{i}",
+            "category": str(category),
+            "palette": [
+                {"rgb": rng.integers(0, 255, 3).tolist(), "coverage": 0.7},
+                {"rgb": rng.integers(0, 255, 3).tolist(), "coverage": 0.3},
+            ],
+            "embedding": rng.normal(size=embedding_dim).tolist(),
+        }
+        for i, category in enumerate(categories)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark outfit generation")
+    parser.add_argument("--items", type=int, nargs="+", default=[100, 300, 1000])
+    parser.add_argument("--embedding-dim", type=int, default=512)
+    parser.add_argument("--beam-width", type=int, default=64)
+    parser.add_argument("--top-n", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    for n in args.items:
+        closet = synthetic_closet(n, args.embedding_dim)
+        generate_outfits(closet, args.top_n, args.beam_width)
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            outfits = generate_outfits(closet, args.top_n, args.beam_width)
+            times.append(time.perf_counter() - start)
+        print(f"{n:5d} items  p50 {np.median(times) * 1000:7.2f} ms  max {max(times) * 1000:7.2f} ms  "
+              f"best score {outfits[0]['score']:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+End-to-end throughput benchmark for processor.py without network access.
+
+Runs the FastAPI app in-process with the in-memory storage backend and
+the dedup cache disabled, posting synthetic JPEGs to /process-clothing
+(with the given client concurrency) and to /process-clothing/batch.
+Point SEGFORMER_MODEL at a local copy of the model on air-gapped hosts.
+
+Usage:
+    SEGFORMER_MODEL=/models/segformer_b2_clothes python benchmarks/pipeline_bench.py
+    python benchmarks/pipeline_bench.py --images 64 --concurrency 8 --size 3024x4032
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("PROCESSOR_DEDUP_CACHE_PATH", "")
+os.environ.setdefault("PROCESSOR_DEDUP_MAX_DISTANCE", "-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def synthetic_jpeg(width: int, height: int, seed: int) -> bytes:
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (16, 12, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(small).resize((width, height), Image.BILINEAR).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+async def run(args):
+    import httpx
+    import processor
+
+    width, height = (int(v) for v in args.size.split("x"))
+    images = [synthetic_jpeg(width, height, seed) for seed in range(args.images)]
+    transport = httpx.ASGITransport(app=processor.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await client.post("/process-clothing", files={"file": ("warmup.jpg", synthetic_jpeg(width, height, 999_999))})
+
+        queue = list(enumerate(images))
+        latencies = []
+
+        async def worker():
+            while queue:
+                i, data = queue.pop()
+                start = time.perf_counter()
+                r = await client.post("/process-clothing", files={"file": (f"{i}.jpg", data, "image/jpeg")})
+                r.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        single = time.perf_counter() - start
+        print(f"/process-clothing       {args.images / single:7.2f} img/s  "
+              f"p50 {np.percentile(latencies, 50) * 1000:.0f} ms  p95 {np.percentile(latencies, 95) * 1000:.0f} ms")
+
+        # Fresh bytes so nothing is served from the dedup cache
+        images = [synthetic_jpeg(width, height, 10_000 + seed) for seed in range(args.images)]
+        start = time.perf_counter()
+        r = await client.post(
+            "/process-clothing/batch",
+            files=[("files", (f"{i}.jpg", data, "image/jpeg")) for i, data in enumerate(images)],
+        )
+        r.raise_for_status()
+        batch = time.perf_counter() - start
+        print(f"/process-clothing/batch {args.images / batch:7.2f} img/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark processor.py end to end")
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--size", default="1536x2048", help="WIDTHxHEIGHT of the synthetic uploads")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark SegFormer inference precision and memory layout.
+
+For each mode (fp32, bf16, fp16 on CUDA; each with and without
+channels-last) reports forward-pass throughput and the worst per-image
+label agreement with fp32 on a fixture set of real photos, which is the
+same check processor.py runs at startup before enabling a reduced
+precision.
+
+Usage:
+    python benchmarks/precision_bench.py
+    SEGFORMER_MODEL=/models/segformer_b2_clothes python benchmarks/precision_bench.py \\
+        --fixtures public/images/wardrobe --batch-size 8
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from segmentation import IMAGE_EXTENSIONS, decode_image, mask_agreement, segment_batch  # noqa: E402
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(__file__), "..", "..", "..", "public", "images", "wardrobe")
+
+
+def load_fixtures(directory: str, max_side: int):
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, name), "rb") as f:
+                images.append(decode_image(f.read(), max_side)[0])
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SegFormer precision modes")
+    parser.add_argument("--model", default=os.environ.get("SEGFORMER_MODEL", "mattmdjaga/segformer_b2_clothes"))
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-side", type=int, default=1024)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    from transformers import AutoImageProcessor, AutoModelForSemanticSegmentation
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    image_processor = AutoImageProcessor.from_pretrained(args.model)
+    model = AutoModelForSemanticSegmentation.from_pretrained(args.model).to(device).eval()
+    images = load_fixtures(args.fixtures, args.max_side)
+    batch = (images * args.batch_size)[:args.batch_size]
+    print(f"{len(images)} fixture images, batch {args.batch_size}, device {device}")
+
+    precisions = ["fp32", "bf16"] + (["fp16"] if device.type == "cuda" else [])
+    for channels_last in (False, True):
+        model.to(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+        for precision in precisions:
+            segment_batch(model, image_processor, batch, device, precision, channels_last)
+            times = []
+            for _ in range(args.repeats):
+                if device.type == "cuda":
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+                segment_batch(model, image_processor, batch, device, precision, channels_last)
+                if device.type == "cuda":
+                    torch.cuda.synchronize()
+                times.append(time.perf_counter() - start)
+            agreement = mask_agreement(model, image_processor, images, device, precision, channels_last)
+            layout = "channels-last" if channels_last else "contiguous"
+            print(f"{precision:5s} {layout:14s} {args.batch_size / min(times):8.2f} img/s   "
+                  f"min agreement vs fp32 {agreement:.4f}")
+
+
+if __name__ == "__main__":
+    main()
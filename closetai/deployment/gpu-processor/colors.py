@@ -0,0 +1,124 @@
+"""
+Dominant color palettes for segmented garments.
+
+Pixels are subsampled, quantized into a 32x32x32 RGB histogram and the
+occupied bins clustered with a small weighted k-means in CIE Lab, so the
+cost depends on the number of distinct colors rather than the number of
+pixels in the mask.
+"""
+from typing import Dict, List
+
+import numpy as np
+
+# Upper bound on pixels looked at per palette
+MAX_SAMPLES = 20000
+# Bits kept per channel when quantizing (5 -> 32 levels, 32768 bins)
+QUANT_BITS = 5
+KMEANS_ITERS = 10
+
+# sRGB (D65) -> XYZ
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+], dtype=np.float32)
+_WHITE_D65 = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+
+_levels = np.arange(256, dtype=np.float32) / 255.0
+_SRGB_TO_LINEAR = np.where(
+    _levels <= 0.04045, _levels / 12.92, ((_levels + 0.055) / 1.055) ** 2.4
+).astype(np.float32)
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """Convert an (N, 3) array of 0-255 sRGB values to CIE Lab."""
+    rgb = np.asarray(rgb, dtype=np.float32)
+    # Interpolate the 256-entry linearization table (exact at integer inputs)
+    linear = np.interp(rgb, np.arange(256), _SRGB_TO_LINEAR).astype(np.float32)
+    xyz = linear @ _RGB_TO_XYZ.T / _WHITE_D65
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([
+        116 * f[:, 1] - 16,
+        500 * (f[:, 0] - f[:, 1]),
+        200 * (f[:, 1] - f[:, 2]),
+    ], axis=1)
+
+
+def _weighted_kmeans(points: np.ndarray, weights: np.ndarray, k: int, iters: int) -> np.ndarray:
+    """Cluster assignments for weighted points; deterministic farthest-first init."""
+    centers = [points[np.argmax(weights)]]
+    dist = ((points - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        centers.append(points[np.argmax(dist * weights)])
+        dist = np.minimum(dist, ((points - centers[-1]) ** 2).sum(axis=1))
+    centers = np.stack(centers)
+
+    for _ in range(iters):
+        d = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        assign = d.argmin(axis=1)
+        totals = np.bincount(assign, weights=weights, minlength=k)
+        moved = np.stack([
+            np.bincount(assign, weights=weights * points[:, c], minlength=k)
+            for c in range(points.shape[1])
+        ], axis=1)
+        nonempty = totals > 0
+        new_centers = centers.copy()
+        new_centers[nonempty] = moved[nonempty] / totals[nonempty, None]
+        if np.allclose(new_centers, centers):
+            break
+        centers = new_centers
+
+    d = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+    return d.argmin(axis=1)
+
+
+def extract_palette(
+    pixels: np.ndarray,
+    k: int = 3,
+    max_samples: int = MAX_SAMPLES,
+    seed: int = 0,
+) -> List[Dict]:
+    """
+    Top-``k`` colors of an (N, 3) uint8 pixel array.
+
+    Returns a list of ``{"rgb": [r, g, b], "hex": "#rrggbb", "coverage": f}``
+    sorted by coverage (fraction of pixels assigned to that color).
+    """
+    pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1, 3)
+    if len(pixels) == 0:
+        return []
+    if len(pixels) > max_samples:
+        rng = np.random.default_rng(seed)
+        pixels = pixels[rng.choice(len(pixels), max_samples, replace=False)]
+
+    # Histogram over quantized colors; bin colors are the mean of their members
+    shift = 8 - QUANT_BITS
+    q = (pixels >> shift).astype(np.int32)
+    index = (q[:, 0] << (2 * QUANT_BITS)) | (q[:, 1] << QUANT_BITS) | q[:, 2]
+    bins, inverse, counts = np.unique(index, return_inverse=True, return_counts=True)
+    bin_rgb = np.stack([
+        np.bincount(inverse, weights=pixels[:, c], minlength=len(bins))
+        for c in range(3)
+    ], axis=1) / counts[:, None]
+
+    k = min(k, len(bins))
+    assign = _weighted_kmeans(rgb_to_lab(bin_rgb), counts.astype(np.float64), k, KMEANS_ITERS)
+
+    cluster_counts = np.bincount(assign, weights=counts, minlength=k)
+    cluster_rgb = np.stack([
+        np.bincount(assign, weights=counts * bin_rgb[:, c], minlength=k)
+        for c in range(3)
+    ], axis=1)
+
+    palette = []
+    for cluster in np.argsort(-cluster_counts):
+        if cluster_counts[cluster] == 0:
+            continue
+        r, g, b = np.clip(np.round(cluster_rgb[cluster] / cluster_counts[cluster]), 0, 255).astype(int)
+        palette.append({
+            "rgb": [int(r), int(g), int(b)],
+            "hex": f"#{r:02x}{g:02x}{b:02x}",
+            "coverage": round(float(cluster_counts[cluster] / counts.sum()), 4),
+        })
+    return palette
+
@@ -0,0 +1,127 @@
+"""
+Result cache for repeated uploads.
+
+Uploads are keyed by the SHA-256 of their bytes (exact re-uploads) and a
+64-bit difference hash of the decoded image (re-encoded or resized copies).
+Results live in a bounded in-memory LRU mirrored to a small SQLite file so
+they survive restarts.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """64-bit dHash: sign of horizontal gradients on a 9x8 grayscale thumbnail."""
+    small = np.asarray(image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def _popcount64(values: np.ndarray) -> np.ndarray:
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def _to_signed(value: int) -> int:
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class ResultCache:
+    """
+    Thread-safe LRU of processing results keyed by content hash, with
+    near-duplicate lookup by perceptual hash Hamming distance.
+
+    ``path`` is the SQLite file backing the cache (``None`` or ``""`` keeps
+    it in memory only). ``max_distance`` < 0 disables near-duplicate hits.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 10000, max_distance: int = 3):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._hash_index = None  # (digests, phashes) snapshot for near-dup scans
+
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "digest TEXT PRIMARY KEY, phash INTEGER, result TEXT, last_used REAL)"
+            )
+            rows = self._db.execute(
+                "SELECT digest, phash, result FROM results ORDER BY last_used DESC LIMIT ?",
+                (max_entries,),
+            ).fetchall()
+            for digest, phash, result in reversed(rows):
+                self._entries[digest] = (phash & ((1 << 64) - 1), json.loads(result))
+            self._db.execute(
+                "DELETE FROM results WHERE digest NOT IN "
+                "(SELECT digest FROM results ORDER BY last_used DESC LIMIT ?)",
+                (max_entries,),
+            )
+            self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _touch(self, digest: str) -> Dict:
+        self._entries.move_to_end(digest)
+        if self._db is not None:
+            self._db.execute("UPDATE results SET last_used = ? WHERE digest = ?", (time.time(), digest))
+            self._db.commit()
+        return self._entries[digest][1]
+
+    def get_exact(self, digest: str) -> Optional[Dict]:
+        with self._lock:
+            if digest in self._entries:
+                return self._touch(digest)
+        return None
+
+    def get_similar(self, phash: int) -> Optional[Dict]:
+        """Closest cached result within ``max_distance`` bits, if any."""
+        if self.max_distance < 0:
+            return None
+        with self._lock:
+            if not self._entries:
+                return None
+            if self._hash_index is None:
+                digests = list(self._entries)
+                phashes = np.array([self._entries[d][0] for d in digests], dtype=np.uint64)
+                self._hash_index = (digests, phashes)
+            digests, phashes = self._hash_index
+            distances = _popcount64(phashes ^ np.uint64(phash))
+            best = int(distances.argmin())
+            if distances[best] <= self.max_distance:
+                return self._touch(digests[best])
+        return None
+
+    def put(self, digest: str, phash: int, result: Dict) -> None:
+        with self._lock:
+            self._entries[digest] = (phash, result)
+            self._entries.move_to_end(digest)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+            self._hash_index = None
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                    (digest, _to_signed(phash), json.dumps(result), time.time()),
+                )
+                self._db.executemany("DELETE FROM results WHERE digest = ?", [(d,) for d in evicted])
+                self._db.commit()
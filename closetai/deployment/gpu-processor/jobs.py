@@ -0,0 +1,247 @@
+"""
+In-process job queue for the GPU processor.
+
+Clients submit uploads and get a job id back at once; a single worker task
+drains the queue in batches (waiting briefly so concurrent submissions
+share a forward pass) and hands each batch to the processor. Jobs are
+polled by id and, if a webhook URL was given, POSTed there when finished.
+Webhook targets are restricted (see check_webhook_url) and delivered on a
+small executor of their own, so retries never hold up inference threads.
+
+Everything lives in process memory: no broker is needed, and queued or
+finished jobs do not survive a restart.
+"""
+import asyncio
+import ipaddress
+import json
+import logging
+import socket
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (filename, bytes)
+Upload = Tuple[str, bytes]
+
+
+class QueueFull(Exception):
+    """Raised when a submission would exceed the queue's ``max_queued`` uploads."""
+
+
+class Job:
+    def __init__(self, uploads: List[Upload], webhook_url: Optional[str] = None):
+        self.id = str(uuid.uuid4())
+        self.status = "queued"
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.webhook_url = webhook_url
+        self.results: List[Optional[Dict]] = [None] * len(uploads)
+        self.remaining = len(uploads)
+
+    def to_dict(self) -> Dict:
+        body = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "total": len(self.results),
+            "completed": len(self.results) - self.remaining,
+        }
+        if self.finished_at is not None:
+            body["results"] = self.results
+        return body
+
+
+def _public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_webhook_url(url: str, allowed_hosts: Sequence[str] = ()) -> None:
+    """
+    Raise ValueError unless ``url`` is http(s) and its host may receive
+    webhooks (blocking: resolves the host).
+
+    With ``allowed_hosts``, the host must equal an entry, or end with an
+    entry that starts with "." (a domain and its subdomains). Without, every
+    address the host resolves to must be public, which refuses private,
+    loopback, link-local (cloud metadata) and reserved ranges.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("webhook_url must be an http(s) URL")
+    host = parsed.hostname.lower().rstrip(".")
+    if allowed_hosts:
+        if not any(
+            host == allowed or (allowed.startswith(".") and host.endswith(allowed)) for allowed in allowed_hosts
+        ):
+            raise ValueError(f"webhook host {host} is not allowed")
+        return
+
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except socket.gaierror as e:
+        raise ValueError(f"webhook host {host} does not resolve: {e}")
+    if not all(_public_address(address) for address in addresses):
+        raise ValueError(f"webhook host {host} resolves to a non-public address")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Redirects would bypass the target check; treat them as failures."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_webhook_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def post_webhook(
+    url: str,
+    payload: Dict,
+    timeout: float = 10,
+    retries: int = 3,
+    allowed_hosts: Sequence[str] = (),
+) -> bool:
+    """
+    POST ``payload`` as JSON, retrying with exponential backoff (blocking).
+    The target is checked again first, so a host that now resolves to a
+    private address is not contacted.
+    """
+    try:
+        check_webhook_url(url, allowed_hosts)
+    except ValueError as e:
+        logger.warning("Webhook %s refused: %s", url, str(e))
+        return False
+    data = json.dumps(payload).encode()
+    for attempt in range(retries):
+        request = urllib.request.Request(
+            url, data=data, headers={"Content-Type": "application/json"}, method="POST"
+        )
+        try:
+            with _webhook_opener.open(request, timeout=timeout):
+                return True
+        except Exception as e:
+            logger.warning("Webhook %s failed (attempt %d/%d): %s", url, attempt + 1, retries, str(e))
+            if attempt < retries - 1:
+                time.sleep(2 ** attempt)
+    return False
+
+
+class JobQueue:
+    """
+    ``handler`` is an async callable taking a list of uploads and returning
+    one result dict per upload, in order. It receives at most
+    ``batch_size`` uploads, gathered across jobs; after the first upload
+    arrives the worker waits up to ``max_wait`` seconds for the batch to fill.
+    Finished jobs are forgotten ``ttl`` seconds after completion. Webhooks
+    go only to ``webhook_allowed_hosts`` (any public host when empty) and
+    are sent by ``webhook_workers`` threads of their own.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Upload]], Awaitable[List[Dict]]],
+        batch_size: int = 32,
+        max_wait: float = 0.05,
+        max_queued: int = 1000,
+        ttl: float = 3600,
+        webhook_timeout: float = 10,
+        webhook_allowed_hosts: Sequence[str] = (),
+        webhook_workers: int = 2,
+    ):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.webhook_timeout = webhook_timeout
+        self.webhook_allowed_hosts = tuple(webhook_allowed_hosts)
+        self._webhook_executor = ThreadPoolExecutor(max_workers=webhook_workers, thread_name_prefix="webhook")
+        self._pending: "deque[tuple]" = deque()  # (job, index, filename, bytes)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+
+    def __len__(self) -> int:
+        """Uploads waiting for the worker."""
+        return len(self._pending)
+
+    def submit(self, uploads: List[Upload], webhook_url: Optional[str] = None) -> Job:
+        """Queue uploads as one job (must be called from the event loop)."""
+        self._expire()
+        if len(self._pending) + len(uploads) > self.max_queued:
+            raise QueueFull()
+        job = Job(uploads, webhook_url)
+        self._jobs[job.id] = job
+        if not uploads:
+            self._finish(job)
+            return job
+        for index, (filename, data) in enumerate(uploads):
+            self._pending.append((job, index, filename, data))
+        self._ensure_worker()
+        self._wakeup.set()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._expire()
+        return self._jobs.get(job_id)
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.ttl
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and job.finished_at < cutoff:
+                del self._jobs[job_id]
+
+    def _ensure_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    async def _next_batch(self) -> List[tuple]:
+        while not self._pending:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        # Let concurrent submissions join so the forward pass runs full
+        if len(self._pending) < self.batch_size and self.max_wait > 0:
+            await asyncio.sleep(self.max_wait)
+        return [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+
+    async def _run(self) -> None:
+        while True:
+            entries = await self._next_batch()
+            for job, _, _, _ in entries:
+                job.status = "running"
+            try:
+                results = await self.handler([(filename, data) for _, _, filename, data in entries])
+            except Exception as e:
+                logger.exception("Job batch failed: %s", str(e))
+                results = [{"success": False, "filename": filename, "error": str(e)} for _, _, filename, _ in entries]
+
+            for (job, index, _, _), result in zip(entries, results):
+                job.results[index] = result
+                job.remaining -= 1
+                if job.remaining == 0:
+                    self._finish(job)
+
+    def _finish(self, job: Job) -> None:
+        job.finished_at = time.time()
+        failed = job.results and not any(result.get("success") for result in job.results)
+        job.status = "failed" if failed else "done"
+        if job.webhook_url:
+            self._webhook_executor.submit(
+                post_webhook, job.webhook_url, job.to_dict(), self.webhook_timeout,
+                allowed_hosts=self.webhook_allowed_hosts,
+            )
@@ -0,0 +1,134 @@
+"""
+Compact, lossless encodings for SegFormer label maps.
+
+One palette-mode PNG holds every class label (8-bit indices plus a small
+color table, so it also previews as a color overlay); COCO-style run-length
+encodings serve single-class masks as JSON. Binary masks for a class are
+cut from the decoded label map on demand instead of being stored.
+"""
+import io
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image, PngImagePlugin
+
+# zlib level for label PNGs; long runs of equal indices compress well even
+# at the fastest setting
+PNG_COMPRESS_LEVEL = 1
+
+# tEXt key carrying the upload's (width, height) when the label map was
+# computed at a smaller working resolution
+ORIGINAL_SIZE_KEY = "closetai:original_size"
+
+# Distinct preview colors for the 18 ATR classes; unused indices are black
+_CLASS_COLORS = [
+    (0, 0, 0), (128, 0, 0), (255, 200, 150), (0, 0, 128),
+    (230, 25, 75), (60, 180, 75), (0, 130, 200), (145, 30, 180),
+    (245, 130, 48), (70, 240, 240), (240, 50, 230), (255, 225, 180),
+    (210, 245, 60), (250, 190, 212), (0, 128, 128), (220, 190, 255),
+    (170, 110, 40), (255, 250, 200),
+]
+LABEL_PALETTE = [channel for color in _CLASS_COLORS for channel in color]
+LABEL_PALETTE += [0] * (768 - len(LABEL_PALETTE))
+
+
+def encode_label_png(
+    labels: np.ndarray,
+    original_size: Optional[Tuple[int, int]] = None,
+    compress_level: int = PNG_COMPRESS_LEVEL,
+) -> bytes:
+    """Palette PNG of a uint8 label map, optionally tagged with ``original_size``."""
+    image = Image.fromarray(np.ascontiguousarray(labels, dtype=np.uint8), "P")
+    image.putpalette(LABEL_PALETTE)
+    info = None
+    if original_size is not None:
+        info = PngImagePlugin.PngInfo()
+        info.add_text(ORIGINAL_SIZE_KEY, "%dx%d" % tuple(original_size))
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", compress_level=compress_level, pnginfo=info)
+    return buf.getvalue()
+
+
+def decode_label_png(data: bytes) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """Label map and original (width, height) from ``encode_label_png`` output."""
+    image = Image.open(io.BytesIO(data))
+    if image.mode != "P":
+        raise ValueError(f"Expected a palette PNG, got mode {image.mode}")
+    labels = np.asarray(image, dtype=np.uint8)
+    size = image.info.get(ORIGINAL_SIZE_KEY)
+    if size:
+        width, height = (int(v) for v in size.split("x"))
+        return labels, (width, height)
+    return labels, (labels.shape[1], labels.shape[0])
+
+
+def _runs(flat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(run starts, run lengths) of a 1-D array."""
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    return starts, np.diff(np.append(starts, flat.size))
+
+
+def rle_encode(labels: np.ndarray) -> Dict:
+    """
+    Multi-class RLE in COCO's column-major order:
+    ``{"size": [h, w], "counts": [...], "values": [...]}``.
+    """
+    flat = np.asarray(labels).ravel(order="F")
+    if flat.size == 0:
+        return {"size": list(labels.shape), "counts": [], "values": []}
+    starts, counts = _runs(flat)
+    return {"size": list(labels.shape), "counts": counts.tolist(), "values": flat[starts].tolist()}
+
+
+def rle_decode(rle: Dict) -> np.ndarray:
+    h, w = rle["size"]
+    flat = np.repeat(np.asarray(rle["values"], dtype=np.uint8), rle["counts"])
+    return flat.reshape((h, w), order="F")
+
+
+def mask_rle_encode(mask: np.ndarray) -> Dict:
+    """
+    Uncompressed COCO RLE of a binary mask: column-major run lengths
+    starting with a (possibly empty) run of zeros.
+    """
+    flat = np.asarray(mask, dtype=bool).ravel(order="F")
+    if flat.size == 0:
+        return {"size": list(mask.shape), "counts": []}
+    starts, counts = _runs(flat)
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+    return {"size": list(mask.shape), "counts": counts.tolist()}
+
+
+def mask_rle_decode(rle: Dict) -> np.ndarray:
+    h, w = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    values = np.arange(len(counts)) % 2 == 1
+    return np.repeat(values, counts).reshape((h, w), order="F")
+
+
+def class_mask(
+    labels: np.ndarray, class_ids, size: Optional[Tuple[int, int]] = None
+) -> np.ndarray:
+    """
+    Boolean mask of the pixels labelled with any of ``class_ids``,
+    nearest-upscaled to a PIL (width, height) ``size`` if given.
+    """
+    lut = np.zeros(256, dtype=bool)
+    lut[list(np.atleast_1d(class_ids))] = True
+    h, w = labels.shape
+    if size is not None and size != (w, h):
+        out_w, out_h = size
+        # Pixel-center sampling, as Image.resize(..., Image.NEAREST)
+        rows = (2 * np.arange(out_h) + 1) * h // (2 * out_h)
+        cols = (2 * np.arange(out_w) + 1) * w // (2 * out_w)
+        # Select on the small map, then expand
+        return lut[labels][np.ix_(rows, cols)]
+    return lut[labels]
+
+
+def encode_mask_png(mask: np.ndarray) -> bytes:
+    """1-bit PNG of a boolean mask."""
+    buf = io.BytesIO()
+    Image.fromarray(np.asarray(mask, dtype=bool)).save(buf, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return buf.getvalue()
@@ -0,0 +1,259 @@
+"""
+Outfit generation for /generate-outfit.
+
+Items are split into slot candidate sets (top, bottom, dress, shoes,
+outer). Every pair of items gets one score up front: color harmony in
+LCh space (coverage-weighted over each item's palette) blended with
+embedding cosine compatibility, as one (n, n) matrix. Outfits are then
+built slot by slot with a beam search whose expansions are single
+gathers from that matrix, so a few-hundred-item closet stays in the low
+milliseconds.
+"""
+import re
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from colors import rgb_to_lab
+
+# Category names from the segmenter and the backend, mapped to slots
+CATEGORY_SLOTS = {
+    "top": "top", "upper_clothes": "top", "shirt": "top", "t-shirt": "top", "tee": "top",
+    "blouse": "top", "sweater": "top", "hoodie": "top",
+    "bottom": "bottom", "pants": "bottom", "skirt": "bottom", "jeans": "bottom",
+    "shorts": "bottom", "trousers": "bottom", "chinos": "bottom",
+    "dress": "dress", "jumpsuit": "dress",
+    "shoes": "shoes", "shoe": "shoes", "left_shoe": "shoes", "right_shoe": "shoes",
+    "sneakers": "shoes", "boots": "shoes", "heels": "shoes",
+    "outer": "outer", "outerwear": "outer", "jacket": "outer", "coat": "outer", "blazer": "outer",
+}
+
+# Color names used by the backend's color rules
+NAMED_COLORS = {
+    "black": (20, 20, 20), "white": (245, 245, 245), "gray": (128, 128, 128), "grey": (128, 128, 128),
+    "beige": (220, 200, 170), "cream": (250, 240, 215), "brown": (110, 70, 40), "navy": (25, 35, 80),
+    "red": (200, 30, 40), "green": (40, 140, 60), "blue": (40, 90, 200), "orange": (240, 130, 30),
+    "yellow": (240, 210, 40), "purple": (120, 50, 150), "violet": (140, 90, 200), "pink": (240, 150, 180),
+    "teal": (0, 128, 128), "coral": (250, 120, 100), "mint": (170, 230, 200), "olive": (110, 110, 40),
+    "burgundy": (120, 20, 40), "gold": (210, 170, 50), "terracotta": (200, 100, 70), "khaki": (190, 170, 120),
+}
+
+# Most palette colors considered per item
+MAX_COLORS = 3
+# Chroma at and above which a color counts as fully chromatic; grays,
+# blacks, whites and beiges (low chroma) go with anything
+NEUTRAL_CHROMA = 25.0
+# Lightness ramp over which dark colors (navy, charcoal) become neutral
+DARK_LIGHTNESS = (20.0, 40.0)
+# Hue templates: (center in degrees, width, peak score)
+HUE_TEMPLATES = ((0.0, 35.0, 1.0), (180.0, 40.0, 0.85), (120.0, 25.0, 0.7))
+CLASH_SCORE = 0.2
+# Hue histogram resolution (2 degree bins)
+HUE_BINS = 180
+
+
+def _hue_discord() -> np.ndarray:
+    """(HUE_BINS, HUE_BINS) 1 - template score for every pair of hue bins."""
+    centers = (np.arange(HUE_BINS) + 0.5) * 360 / HUE_BINS
+    diff = np.abs(centers[:, None] - centers[None, :])
+    diff = np.minimum(diff, 360 - diff)
+    template = np.full(diff.shape, CLASH_SCORE)
+    for center, width, peak in HUE_TEMPLATES:
+        template = np.maximum(template, peak * np.exp(-((diff - center) / width) ** 2))
+    return (1 - template).astype(np.float32)
+
+
+_HUE_DISCORD = _hue_discord()
+
+_RGB_PATTERN = re.compile(r"rgb\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\)")
+
+
+def parse_color(value) -> Optional[tuple]:
+    """``"rgb(r, g, b)"``, ``"#rrggbb"``, a color name or an [r, g, b] list."""
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)) and len(value) == 3:
+        return tuple(int(v) for v in value)
+    text = str(value).strip().lower()
+    match = _RGB_PATTERN.fullmatch(text)
+    if match:
+        return tuple(int(v) for v in match.groups())
+    if text.startswith("#") and len(text) == 7:
+        return tuple(int(text[i:i + 2], 16) for i in (1, 3, 5))
+    return NAMED_COLORS.get(text)
+
+
+def item_colors(item: Dict) -> List[tuple]:
+    """(rgb, weight) pairs from an item's ``palette``, else its ``color``."""
+    colors = []
+    for entry in (item.get("palette") or [])[:MAX_COLORS]:
+        rgb = parse_color(entry.get("rgb") or entry.get("hex"))
+        if rgb is not None:
+            colors.append((rgb, float(entry.get("coverage", 1.0))))
+    if not colors:
+        rgb = parse_color(item.get("color") or item.get("dominant_color"))
+        if rgb is not None:
+            colors.append((rgb, 1.0))
+    return colors
+
+
+def color_harmony_matrix(items: Sequence[Dict]) -> np.ndarray:
+    """
+    (n, n) harmony in [0, 1]. Two colors clash by how far their hue
+    difference is from the analogous, complementary and triadic templates,
+    scaled by how chromatic each is (neutrals and very dark colors never
+    clash); an item pair's
+    harmony is 1 minus the coverage-weighted clash over their palettes.
+
+    Each item is reduced to a chroma-weighted hue histogram ``P``, so the
+    whole matrix is ``1 - P @ D @ P.T`` with ``D`` the fixed hue-bin
+    discord table. Items without colors score 1.
+    """
+    n = len(items)
+    rgb = np.zeros((n, MAX_COLORS, 3), dtype=np.float32)
+    weights = np.zeros((n, MAX_COLORS), dtype=np.float32)
+    for i, item in enumerate(items):
+        for k, (color, weight) in enumerate(item_colors(item)):
+            rgb[i, k] = color
+            weights[i, k] = weight
+    totals = weights.sum(axis=1, keepdims=True)
+    weights /= np.where(totals > 0, totals, 1)
+
+    lab = rgb_to_lab(rgb.reshape(-1, 3))
+    chromatic = np.clip(np.hypot(lab[:, 1], lab[:, 2]) / NEUTRAL_CHROMA, 0, 1)
+    low, high = DARK_LIGHTNESS
+    chromatic *= np.clip((lab[:, 0] - low) / (high - low), 0, 1)
+    hue = np.degrees(np.arctan2(lab[:, 2], lab[:, 1])) % 360
+    bins = np.minimum((hue * HUE_BINS / 360).astype(np.int64), HUE_BINS - 1)
+
+    profile = np.zeros((n, HUE_BINS), dtype=np.float32)
+    np.add.at(profile, (np.repeat(np.arange(n), MAX_COLORS), bins), chromatic * weights.ravel())
+    return 1 - profile @ _HUE_DISCORD @ profile.T
+
+
+def compatibility_matrix(items: Sequence[Dict]):
+    """
+    (n, n) embedding compatibility ``(1 + cos) / 2`` and an (n, n) mask of
+    pairs where both items have an embedding.
+    """
+    n = len(items)
+    embeddings = [item.get("embedding") for item in items]
+    dims = {len(e) for e in embeddings if e}
+    if len(dims) != 1:
+        return np.full((n, n), 0.5, dtype=np.float32), np.zeros((n, n), dtype=bool)
+    dim = dims.pop()
+    present = np.array([bool(e) and len(e) == dim for e in embeddings])
+    matrix = np.zeros((n, dim), dtype=np.float32)
+    matrix[present] = np.asarray([e for e, p in zip(embeddings, present) if p], dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms > 0, norms, 1)
+    compat = (1 + matrix @ matrix.T) / 2
+    return compat, np.outer(present, present)
+
+
+def _expand(members, sums, counts, candidates, pair_scores):
+    """All (state, candidate) extensions with their new pair-score sums."""
+    valid = members >= 0
+    gains = pair_scores[np.where(valid, members, 0)][:, :, candidates]  # (B, S, m)
+    gains = (gains * valid[:, :, None]).sum(axis=1)
+    b, m = gains.shape
+    new_members = np.repeat(members, m, axis=0)
+    new_members[np.arange(b * m), np.repeat(counts, m)] = np.tile(candidates, b)
+    return new_members, (sums[:, None] + gains).ravel(), np.repeat(counts + 1, m)
+
+
+def _mean_scores(sums, counts):
+    """Mean pair score per outfit; a lone item (a dress) counts as neutral."""
+    pairs = counts * (counts - 1) / 2
+    return np.where(pairs > 0, sums / np.maximum(pairs, 1), 0.5)
+
+
+def _prune(members, sums, counts, beam_width):
+    scores = _mean_scores(sums, counts)
+    if len(scores) > beam_width:
+        keep = np.argpartition(-scores, beam_width - 1)[:beam_width]
+        return members[keep], sums[keep], counts[keep]
+    return members, sums, counts
+
+
+def generate_outfits(
+    items: Sequence[Dict],
+    top_n: int = 5,
+    beam_width: int = 64,
+    color_weight: float = 0.6,
+) -> List[Dict]:
+    """
+    Top-``top_n`` outfits from ``items`` (dicts with ``id``, ``category``
+    and optionally ``palette``/``color`` and ``embedding``).
+
+    An outfit is a top and a bottom, or a dress, plus shoes when the
+    closet has any and an optional outer layer. Its score is the mean pair
+    score over its items, where a pair scores
+    ``color_weight * harmony + (1 - color_weight) * compatibility`` if both
+    items have embeddings and ``harmony`` otherwise. Outfits with a new
+    top or dress are preferred before repeating one.
+    """
+    slots: Dict[str, List[int]] = {"top": [], "bottom": [], "dress": [], "shoes": [], "outer": []}
+    for i, item in enumerate(items):
+        slot = CATEGORY_SLOTS.get(str(item.get("category", "")).strip().lower())
+        if slot:
+            slots[slot].append(i)
+    # A top needs a bottom; without any bottoms only dresses can start an outfit
+    bases = (slots["top"] if slots["bottom"] else []) + slots["dress"]
+    if not bases:
+        return []
+
+    harmony = color_harmony_matrix(items)
+    compat, has_embedding = compatibility_matrix(items)
+    pair_scores = np.where(has_embedding, color_weight * harmony + (1 - color_weight) * compat, harmony)
+    pair_scores = pair_scores.astype(np.float32)
+
+    members = np.full((len(bases), 4), -1, dtype=np.int64)
+    members[:, 0] = bases
+    sums = np.zeros(len(bases), dtype=np.float32)
+    counts = np.ones(len(bases), dtype=np.int64)
+
+    for slot in ("bottom", "shoes", "outer"):
+        candidates = np.asarray(slots[slot], dtype=np.int64)
+        if not len(candidates):
+            continue
+        # Bottoms only extend tops; shoes are required; outer layers are optional
+        if slot == "bottom":
+            expand = np.isin(members[:, 0], slots["top"])
+        else:
+            expand = np.ones(len(members), dtype=bool)
+        keep = np.ones(len(members), dtype=bool) if slot == "outer" else ~expand
+        grown = _expand(members[expand], sums[expand], counts[expand], candidates, pair_scores)
+        members = np.concatenate([members[keep], grown[0]])
+        sums = np.concatenate([sums[keep], grown[1]])
+        counts = np.concatenate([counts[keep], grown[2]])
+        members, sums, counts = _prune(members, sums, counts, beam_width)
+
+    scores = _mean_scores(sums, counts)
+    order = np.argsort(-scores, kind="stable")
+
+    chosen, seen_bases = [], set()
+    for repeat in (False, True):
+        for index in order:
+            if len(chosen) >= top_n:
+                break
+            base = int(members[index, 0])
+            if index in chosen or (not repeat and base in seen_bases):
+                continue
+            chosen.append(index)
+            seen_bases.add(base)
+
+    outfits = []
+    for index in chosen:
+        outfit = [int(i) for i in members[index] if i >= 0]
+        rows, cols = np.triu_indices(len(outfit), k=1)
+        a, b = np.asarray(outfit)[rows], np.asarray(outfit)[cols]
+        embedded = has_embedding[a, b]
+        outfits.append({
+            "items": [items[i].get("id", i) for i in outfit],
+            "slots": {CATEGORY_SLOTS[str(items[i]["category"]).strip().lower()]: items[i].get("id", i) for i in outfit},
+            "score": round(float(scores[index]), 4),
+            "color_harmony": round(float(harmony[a, b].mean()), 4) if len(a) else 1.0,
+            "compatibility": round(float(compat[a, b][embedded].mean()), 4) if embedded.any() else None,
+        })
+    return outfits
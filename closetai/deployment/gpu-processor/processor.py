@@ -1,20 +1,52 @@
 """
 GPU-accelerated clothing segmentation and feature extraction for ClosetAI.
 Uses SegFormer for semantic segmentation of clothing items.
+
+Model inference and image post-processing run on a dedicated executor,
+object storage writes on the storage backend's thread pool and result-cache
+(SQLite) lookups and writes on worker threads, so the event loop (and the
+Kubernetes /health probe) stays responsive while requests are in flight.
+The storage backend is chosen with STORAGE_BACKEND (see storage.py), so
+the service also runs without network credentials.
 """
+import asyncio
+import functools
 import io
+import json
 import logging
 import os
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Optional, Union
 
-import boto3
 import numpy as np
 import torch
-from fastapi import File, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi import Body, File, Form, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from PIL import Image
 from transformers import AutoImageProcessor, AutoModelForSemanticSegmentation
 
+from colors import extract_palette
+from dedup import ResultCache, content_hash, perceptual_hash
+from garments import GARMENT_CLASSES, MIN_AREA_FRACTION, extract_garments
+from jobs import JobQueue, QueueFull, check_webhook_url
+from masks import class_mask, decode_label_png, encode_label_png, encode_mask_png, mask_rle_encode
+from outfits import generate_outfits
+from runtime import check_precision, compile_model, configure_threads, parse_sizes
+from segmentation import (
+    CLOTHING_CLASSES,
+    IMAGE_EXTENSIONS,
+    decode_image,
+    expand_upload,
+    iter_batches,
+    label_map,
+    mask_agreement,
+    segment_batch,
+)
+from storage import create_storage
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -30,138 +62,423 @@ logger.info("Using device: %s", device)
 if torch.cuda.is_available():
     logger.info("GPU: %s", torch.cuda.get_device_name(0))
 
+# Torch thread pools, by default the container's CPU quota split across the
+# inference workers so several workers on one node do not oversubscribe
+INFERENCE_WORKERS = int(os.environ.get("PROCESSOR_INFERENCE_WORKERS", "1"))
+intra_op_threads, inter_op_threads = configure_threads(
+    int(os.environ.get("PROCESSOR_INTRA_OP_THREADS", "0")),
+    int(os.environ.get("PROCESSOR_INTER_OP_THREADS", "0")),
+    INFERENCE_WORKERS,
+)
+logger.info("Torch threads: %d intra-op, %d inter-op", intra_op_threads, inter_op_threads)
+
 # Load model
 logger.info("Loading clothing segmentation model...")
-processor = AutoImageProcessor.from_pretrained("mattmdjaga/segformer_b2_clothes")
-model = AutoModelForSemanticSegmentation.from_pretrained("mattmdjaga/segformer_b2_clothes")
+# Hub id or a local directory (for air-gapped hosts)
+MODEL_NAME = os.environ.get("SEGFORMER_MODEL", "mattmdjaga/segformer_b2_clothes")
+processor = AutoImageProcessor.from_pretrained(MODEL_NAME)
+model = AutoModelForSemanticSegmentation.from_pretrained(MODEL_NAME)
 model.to(device)
 model.eval()
 logger.info("Model loaded successfully")
 
-# Initialize S3 client for object storage
-endpoint = os.environ.get("OBJECT_STORAGE_ENDPOINT", "us-sea-1.linodeobjects.com")
-s3_client = boto3.client(
-    "s3",
-    endpoint_url=f"https://{endpoint}",
-    aws_access_key_id=os.environ.get("OBJECT_STORAGE_ACCESS_KEY"),
-    aws_secret_access_key=os.environ.get("OBJECT_STORAGE_SECRET_KEY"),
-    region_name="us-east-1",
+# fp32 | bf16 (autocast; CPU or recent GPUs) | fp16 (autocast; CUDA only).
+# A reduced precision is checked against fp32 on PROCESSOR_PRECISION_FIXTURES
+# at startup and dropped if masks agree on less than MIN_MASK_AGREEMENT
+PRECISION = check_precision(os.environ.get("PROCESSOR_PRECISION", "fp32"), device)
+PRECISION_FIXTURES = os.environ.get("PROCESSOR_PRECISION_FIXTURES", "")
+MIN_MASK_AGREEMENT = float(os.environ.get("PROCESSOR_MIN_MASK_AGREEMENT", "0.99"))
+# NHWC activations; usually faster for the conv layers on CPU and tensor cores
+CHANNELS_LAST = os.environ.get("PROCESSOR_CHANNELS_LAST", "0") == "1"
+if CHANNELS_LAST:
+    model.to(memory_format=torch.channels_last)
+
+# none | compile; a compiled model falls back to eager if warmup fails
+COMPILE = os.environ.get("PROCESSOR_COMPILE", "none")
+eager_model = model
+model = compile_model(model, COMPILE, os.environ.get("PROCESSOR_COMPILE_MODE"))
+
+BATCH_SIZE = int(os.environ.get("PROCESSOR_BATCH_SIZE", "8"))
+# exact | refine | fast, see segmentation.label_map
+MASK_QUALITY = os.environ.get("PROCESSOR_MASK_QUALITY", "refine")
+# Segmentation and color extraction run with the longer side capped here;
+# only the stored mask is scaled back to the upload's size
+WORKING_MAX_SIDE = int(os.environ.get("PROCESSOR_WORKING_MAX_SIDE", "1024"))
+# Uploads that would decode to more pixels than this are rejected
+MAX_INPUT_PIXELS = int(os.environ.get("PROCESSOR_MAX_INPUT_PIXELS", str(64 * 1024 * 1024)))
+# Colors reported per garment item
+PALETTE_SIZE = int(os.environ.get("PROCESSOR_PALETTE_SIZE", "3"))
+# Garment classes covering less of the image than this are not reported
+MIN_ITEM_AREA_FRACTION = float(os.environ.get("PROCESSOR_MIN_ITEM_AREA_FRACTION", str(MIN_AREA_FRACTION)))
+
+# Working-resolution (width, height) sizes pre-run at startup, once at
+# batch size 1 and once at BATCH_SIZE; empty disables warmup
+WARMUP_SIZES = parse_sizes(os.environ.get("PROCESSOR_WARMUP_SIZES", "768x1024,1024x768"))
+
+# /generate-outfit defaults
+OUTFIT_TOP_N = int(os.environ.get("PROCESSOR_OUTFIT_TOP_N", "5"))
+OUTFIT_BEAM_WIDTH = int(os.environ.get("PROCESSOR_OUTFIT_BEAM_WIDTH", "64"))
+
+# Concurrency limits
+MAX_IN_FLIGHT = int(os.environ.get("PROCESSOR_MAX_IN_FLIGHT", "4"))
+QUEUE_TIMEOUT = float(os.environ.get("PROCESSOR_QUEUE_TIMEOUT_SECONDS", "30"))
+
+# Forward passes, decoding, mask encoding and color extraction
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+# Requests admitted past the queue; others wait up to QUEUE_TIMEOUT, then get a 503
+in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+# Object storage (S3, local filesystem or in-memory)
+storage = create_storage()
+
+# Re-uploads (same bytes, or a perceptual hash within MAX_DISTANCE bits)
+# return the stored result without inference or uploads
+result_cache = ResultCache(
+    os.environ.get("PROCESSOR_DEDUP_CACHE_PATH", "/tmp/closetai-processor/dedup.sqlite3"),
+    max_entries=int(os.environ.get("PROCESSOR_DEDUP_CACHE_SIZE", "10000")),
+    max_distance=int(os.environ.get("PROCESSOR_DEDUP_MAX_DISTANCE", "3")),
 )
 
-BUCKET = os.environ.get("OBJECT_STORAGE_BUCKET", "wardrobe-stylist-media")
-
-# Clothing class mapping for SegFormer B2 Clothes
-CLOTHING_CLASSES = {
-    1: "hat",
-    2: "hair",
-    3: "sunglasses",
-    4: "upper_clothes",
-    5: "skirt",
-    6: "pants",
-    7: "dress",
-    8: "belt",
-    9: "left_shoe",
-    10: "right_shoe",
-    11: "bag",
-    12: "scarf",
-}
+
+class ProcessorBusy(Exception):
+    """Raised when no in-flight slot frees up within QUEUE_TIMEOUT."""
+
+
+async def acquire_slot() -> None:
+    """Wait up to QUEUE_TIMEOUT for one of MAX_IN_FLIGHT processing slots."""
+    try:
+        await asyncio.wait_for(in_flight.acquire(), timeout=QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise ProcessorBusy()
+
+
+@asynccontextmanager
+async def in_flight_slot():
+    """Hold a processing slot for the duration of the block."""
+    await acquire_slot()
+    try:
+        yield
+    finally:
+        in_flight.release()
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that returns the caller's in-flight slot however the
+    response ends: finished, failed to send, or abandoned by a client that
+    disconnected before (or while) the stream started.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            in_flight.release()
+
+
+def busy_response() -> JSONResponse:
+    return JSONResponse(
+        {"success": False, "error": "processor busy, retry later"},
+        status_code=503,
+        headers={"Retry-After": "1"},
+    )
+
+
+async def run_inference(fn, *args):
+    """Run CPU/GPU-bound work on the inference executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_executor, fn, *args)
 
 
 @app.get("/health")
 async def health():
-    """Health check endpoint for Kubernetes probes."""
-    return {"status": "healthy", "gpu_available": torch.cuda.is_available()}
+    """Readiness probe: 503 until the startup warmup has finished."""
+    body = {
+        "status": "healthy",
+        "gpu_available": torch.cuda.is_available(),
+        "precision": PRECISION,
+        "queued_uploads": len(job_queue),
+    }
+    if not warmup_future.done():
+        return JSONResponse(dict(body, status="warming_up"), status_code=503)
+    if warmup_future.exception() is not None:
+        return JSONResponse(dict(body, status="warmup_failed", error=str(warmup_future.exception())), status_code=503)
+    return body
+
+
+@app.get("/health/live")
+async def live():
+    """Liveness probe: the event loop is responsive (warmup may still be running)."""
+    return {"status": "alive"}
+
+
+def encode_png(image: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def extract_features(image: Image.Image, pred_seg: np.ndarray, original_size: tuple) -> dict:
+    """
+    Garment items, category, dominant color and the encoded label map for
+    one label map computed at the working resolution. Boxes and areas are
+    reported in the upload's pixel coordinates; the label map is stored at
+    the working resolution, tagged with ``original_size``.
+    """
+    image_np = np.array(image)
+    garments = extract_garments(image_np, pred_seg, PALETTE_SIZE, MIN_ITEM_AREA_FRACTION)
+    present = {garment["class_id"]: garment for garment in garments}
+
+    # Find main clothing item
+    main_clothing_id = 4  # upper_clothes default
+    for class_id in (7, 6, 5):  # dress, pants, skirt
+        if class_id in present:
+            main_clothing_id = class_id
+            break
+
+    # All garment pixels (no hair, face or skin)
+    garment_mask = class_mask(pred_seg, list(GARMENT_CLASSES))
+
+    # Dominant color of the main item, falling back to all garment pixels
+    if main_clothing_id in present and present[main_clothing_id]["palette"]:
+        dominant = present[main_clothing_id]["palette"]
+    else:
+        pixels = image_np[garment_mask] if garment_mask.any() else image_np.reshape(-1, 3)
+        dominant = extract_palette(pixels, 1)
+    r, g, b = dominant[0]["rgb"]
+
+    # Per-item crops (RGBA, alpha = class mask), cut to the box
+    scale_x = original_size[0] / image.width
+    scale_y = original_size[1] / image.height
+    items = []
+    for garment in garments:
+        x0, y0, x1, y1 = garment["bbox"]
+        rgba = np.dstack([garment["crop"], garment["mask"].astype(np.uint8) * 255])
+        items.append({
+            "category": garment["category"],
+            "class_id": garment["class_id"],
+            "area": int(round(garment["area"] * scale_x * scale_y)),
+            "area_fraction": garment["area_fraction"],
+            "bbox": [round(x0 * scale_x), round(y0 * scale_y), round(x1 * scale_x), round(y1 * scale_y)],
+            "palette": garment["palette"],
+            "crop_png": encode_png(Image.fromarray(rgba, "RGBA")),
+        })
+
+    return {
+        "category": CLOTHING_CLASSES.get(main_clothing_id, "clothing"),
+        "dominant_color": f"rgb({r}, {g}, {b})",
+        "items": items,
+        "labels_png": encode_label_png(pred_seg, original_size),
+        "labels_size": [image.width, image.height],
+        "original_size": list(original_size),
+    }
+
+
+def segment_images(images: List[Image.Image], original_sizes: List[tuple]) -> List[dict]:
+    """Segment a batch of images and extract features for each (blocking)."""
+    logits = segment_batch(model, processor, images, device, PRECISION, CHANNELS_LAST)
+    return [
+        extract_features(image, label_map(image_logits, image.size, MASK_QUALITY), original_size)
+        for image, image_logits, original_size in zip(images, logits, original_sizes)
+    ]
+
+
+def run_warmup() -> None:
+    """
+    Full segmentation path on a synthetic image at each warmup size, plus a
+    forward pass at BATCH_SIZE (post-processing is per image, so it is not
+    repeated for the batch).
+    """
+    rng = np.random.default_rng(0)
+    for width, height in WARMUP_SIZES:
+        image = Image.fromarray(rng.integers(0, 255, (height, width, 3), dtype=np.uint8))
+        segment_images([image], [image.size])
+        if BATCH_SIZE > 1:
+            segment_batch(model, processor, [image] * BATCH_SIZE, device, PRECISION, CHANNELS_LAST)
+
+
+def precision_guard() -> None:
+    """Fall back to fp32 if reduced-precision masks drift on the fixture images."""
+    global PRECISION
+    if PRECISION == "fp32":
+        return
+    paths = sorted(
+        os.path.join(PRECISION_FIXTURES, name)
+        for name in (os.listdir(PRECISION_FIXTURES) if os.path.isdir(PRECISION_FIXTURES) else [])
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if not paths:
+        logger.warning("%s masks not checked against fp32: no PROCESSOR_PRECISION_FIXTURES images", PRECISION)
+        return
+
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(load_image(f.read())[0])
+    agreement = mask_agreement(eager_model, processor, images, device, PRECISION, CHANNELS_LAST)
+    if agreement < MIN_MASK_AGREEMENT:
+        logger.warning(
+            "%s masks agree with fp32 on %.4f of pixels (< %.4f); using fp32",
+            PRECISION, agreement, MIN_MASK_AGREEMENT,
+        )
+        PRECISION = "fp32"
+    else:
+        logger.info("%s masks agree with fp32 on %.4f of pixels", PRECISION, agreement)
+
+
+def warmup() -> None:
+    """
+    Check the configured precision, then run the warmup passes so kernel
+    selection, allocator growth and (when enabled) compilation happen
+    before the first real request.
+    """
+    global model
+    start = time.perf_counter()
+    precision_guard()
+    try:
+        run_warmup()
+    except Exception:
+        if model is eager_model:
+            raise
+        logger.exception("Compiled model failed during warmup; falling back to eager mode")
+        model = eager_model
+        run_warmup()
+    logger.info("Warmup finished in %.1fs (%d sizes)", time.perf_counter() - start, len(WARMUP_SIZES))
+
+
+# Queued first on the inference executor, so requests that arrive early
+# wait for it rather than paying for a cold model
+warmup_future = inference_executor.submit(warmup)
+
+
+def load_image(image_bytes: bytes):
+    """Decode an upload at the working resolution."""
+    return decode_image(image_bytes, WORKING_MAX_SIDE, MAX_INPUT_PIXELS)
+
+
+def prepare_upload(image_bytes: bytes) -> dict:
+    """Decode an upload and compute its cache keys (blocking)."""
+    image, original_size = load_image(image_bytes)
+    return {
+        "bytes": image_bytes,
+        "image": image,
+        "original_size": original_size,
+        "digest": content_hash(image_bytes),
+        "phash": perceptual_hash(image),
+    }
+
+
+def lookup_results(items: List[dict]) -> List[Optional[dict]]:
+    """Stored result for each exact or near-duplicate upload, if any (blocking: SQLite)."""
+    results = []
+    for item in items:
+        result = result_cache.get_exact(item["digest"]) or result_cache.get_similar(item["phash"])
+        results.append(dict(result, cached=True) if result else None)
+    return results
+
+
+def store_cached(entries: List[tuple]) -> None:
+    """Cache (digest, phash, result) entries (blocking: SQLite)."""
+    for digest, phash, result in entries:
+        result_cache.put(digest, phash, result)
+
+
+async def cached_results(items: List[dict]) -> List[Optional[dict]]:
+    """lookup_results off the event loop; cache hits and LRU touches write to SQLite."""
+    return await asyncio.to_thread(lookup_results, items)
+
+
+def labels_key(image_id: str) -> str:
+    return f"labels/{image_id}.png"
+
+
+async def write_objects(objects: List[tuple]) -> None:
+    """Write (key, bytes, content type) objects as one batch off the event loop."""
+    await asyncio.to_thread(storage.put_many, objects)
+
+
+def plan_result(image_bytes: bytes, features: dict):
+    """
+    Object keys for the original, label map and per-item crops, plus the
+    response body that refers to them. Returns ``(objects, result)``.
+
+    Binary masks are not stored: ``mask_url`` fields point at this
+    service's /masks endpoints, which cut them from the label map.
+    """
+    # Generate unique ID for this image
+    image_id = str(uuid.uuid4())
+    original_key = f"originals/{image_id}.png"
+
+    objects = [
+        (original_key, image_bytes, "image/png"),
+        (labels_key(image_id), features["labels_png"], "image/png"),
+    ]
+    items = []
+    for item in features["items"]:
+        crop_key = f"items/{image_id}/{item['category']}.png"
+        objects.append((crop_key, item["crop_png"], "image/png"))
+        items.append({
+            "category": item["category"],
+            "class_id": item["class_id"],
+            "area": item["area"],
+            "area_fraction": item["area_fraction"],
+            "bbox": item["bbox"],
+            "palette": item["palette"],
+            "crop_url": storage.url(crop_key),
+            "mask_url": f"/masks/{image_id}/{item['category']}",
+        })
+
+    result = {
+        "success": True,
+        "image_id": image_id,
+        "category": features["category"],
+        "original_url": storage.url(original_key),
+        "labels_url": storage.url(labels_key(image_id)),
+        "labels_size": features["labels_size"],
+        "original_size": features["original_size"],
+        "mask_url": f"/masks/{image_id}",
+        "dominant_color": features["dominant_color"],
+        "items": items,
+        "palettes": {item["category"]: item["palette"] for item in items},
+        "gpu_used": torch.cuda.is_available(),
+    }
+    return objects, result
+
+
+async def store_result(image_bytes: bytes, features: dict) -> dict:
+    """Write all objects for one image in a single batch and return the response body."""
+    objects, result = plan_result(image_bytes, features)
+    await write_objects(objects)
+    return result
 
 
 @app.post("/process-clothing")
 async def process_clothing(file: UploadFile = File(...)):
     """
     Process uploaded clothing image:
-    1. Segment clothing item using GPU
-    2. Extract features (category, dominant color)
-    3. Upload processed image to object storage
+    1. Segment clothing items using GPU
+    2. Extract features (category, dominant color, per-item box/area/palette)
+    3. Upload processed image, masks and item crops to object storage
     """
     try:
-        # Read image
         image_bytes = await file.read()
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-
-        # Process with GPU
-        with torch.no_grad():
-            inputs = processor(images=image, return_tensors="pt").to(device)
-            outputs = model(**inputs)
-            logits = outputs.logits
-
-        # Get segmentation mask
-        upsampled_logits = torch.nn.functional.interpolate(
-            logits,
-            size=image.size[::-1],
-            mode="bilinear",
-            align_corners=False,
-        )
-        pred_seg = upsampled_logits.argmax(dim=1)[0].cpu().numpy()
-
-        # Find main clothing item
-        main_clothing_id = 4  # upper_clothes default
-        unique_classes = np.unique(pred_seg)
-        if 7 in unique_classes:  # dress present
-            main_clothing_id = 7
-        elif 6 in unique_classes:  # pants present
-            main_clothing_id = 6
-        elif 5 in unique_classes:  # skirt present
-            main_clothing_id = 5
-
-        # Generate unique ID for this image
-        image_id = str(uuid.uuid4())
-        original_key = f"originals/{image_id}.png"
-
-        # Save original to object storage
-        image_bytes_io = io.BytesIO(image_bytes)
-        s3_client.upload_fileobj(
-            image_bytes_io,
-            BUCKET,
-            original_key,
-            ExtraArgs={"ContentType": "image/png"},
-        )
+        digest = await asyncio.to_thread(content_hash, image_bytes)
+        result = await asyncio.to_thread(result_cache.get_exact, digest)
+        if result:
+            return JSONResponse(dict(result, cached=True))
 
-        # Save mask to object storage
-        mask_img = Image.fromarray((pred_seg > 0).astype(np.uint8) * 255)
-        mask_bytes = io.BytesIO()
-        mask_img.save(mask_bytes, format="PNG")
-        mask_bytes.seek(0)
-        s3_client.upload_fileobj(
-            mask_bytes,
-            BUCKET,
-            f"masks/{image_id}.png",
-            ExtraArgs={"ContentType": "image/png"},
-        )
-
-        # Generate URLs (Linode Object Storage public URL format)
-        base_url = f"https://{BUCKET}.{endpoint}"
-        original_url = f"{base_url}/{original_key}"
-        mask_url = f"{base_url}/masks/{image_id}.png"
-
-        # Extract dominant color (simplified - from non-background pixels)
-        image_np = np.array(image)
-        mask_bool = pred_seg > 0
-        if mask_bool.any():
-            masked_pixels = image_np[mask_bool]
-            dominant_colors = np.median(masked_pixels, axis=0).astype(int)
-        else:
-            dominant_colors = np.mean(image_np.reshape(-1, 3), axis=0).astype(int)
-
-        result = {
-            "success": True,
-            "image_id": image_id,
-            "category": CLOTHING_CLASSES.get(main_clothing_id, "clothing"),
-            "original_url": original_url,
-            "mask_url": mask_url,
-            "dominant_color": f"rgb({dominant_colors[0]}, {dominant_colors[1]}, {dominant_colors[2]})",
-            "gpu_used": torch.cuda.is_available(),
-        }
+        async with in_flight_slot():
+            item = await run_inference(prepare_upload, image_bytes)
+            (result,) = await cached_results([item])
+            if result is None:
+                features = await run_inference(segment_images, [item["image"]], [item["original_size"]])
+                result = await store_result(image_bytes, features[0])
+                await asyncio.to_thread(store_cached, [(item["digest"], item["phash"], result)])
 
         return JSONResponse(result)
 
+    except ProcessorBusy:
+        return busy_response()
     except Exception as e:
         logger.exception("Processing failed: %s", str(e))
         return JSONResponse(
@@ -170,19 +487,252 @@ async def process_clothing(file: UploadFile = File(...)):
         )
 
 
+def decode_uploads(uploads: List[tuple]):
+    """
+    Decode (filename, bytes) uploads; returns (items, errors) where errors
+    are (upload index, error body) pairs. Items carry their upload index.
+    """
+    items, errors = [], []
+    for index, (filename, data) in enumerate(uploads):
+        try:
+            item = prepare_upload(data)
+        except Exception as e:
+            errors.append((index, {"success": False, "filename": filename, "error": str(e)}))
+            continue
+        item["filename"] = filename
+        item["index"] = index
+        items.append(item)
+    return items, errors
+
+
+async def run_batch(batch: List[dict]) -> List[dict]:
+    """Segment, store and cache one size bucket of decoded uploads; one result per item."""
+    try:
+        features = await run_inference(
+            segment_images,
+            [item["image"] for item in batch],
+            [item["original_size"] for item in batch],
+        )
+        # One storage batch for every object produced by this batch
+        planned = [plan_result(item["bytes"], f) for item, f in zip(batch, features)]
+        await write_objects([obj for objects, _ in planned for obj in objects])
+    except Exception as e:
+        logger.exception("Batch processing failed: %s", str(e))
+        return [{"success": False, "filename": item["filename"], "error": str(e)} for item in batch]
+
+    await asyncio.to_thread(
+        store_cached, [(item["digest"], item["phash"], result) for item, (_, result) in zip(batch, planned)]
+    )
+    return [dict(result, filename=item["filename"]) for item, (_, result) in zip(batch, planned)]
+
+
+async def process_batch(uploads: List[tuple]):
+    """
+    Segment (filename, bytes) uploads in size-bucketed batches, yielding one
+    NDJSON line per image as soon as its batch has been processed. The
+    caller's in-flight slot is released by SlotStreamingResponse.
+    """
+    items, errors = await run_inference(decode_uploads, uploads)
+    for _, error in errors:
+        yield json.dumps(error) + "\n"
+
+    pending = []
+    for item, result in zip(items, await cached_results(items)):
+        if result:
+            yield json.dumps(dict(result, filename=item["filename"])) + "\n"
+        else:
+            pending.append(item)
+
+    for batch in iter_batches(pending, BATCH_SIZE):
+        for result in await run_batch(batch):
+            yield json.dumps(result) + "\n"
+
+
+async def process_uploads(uploads: List[tuple]) -> List[dict]:
+    """Job queue handler: one result per (filename, bytes) upload, in order."""
+    results: List[Optional[dict]] = [None] * len(uploads)
+    items, errors = await run_inference(decode_uploads, uploads)
+    for index, error in errors:
+        results[index] = error
+
+    pending = []
+    for item, result in zip(items, await cached_results(items)):
+        if result:
+            results[item["index"]] = dict(result, filename=item["filename"])
+        else:
+            pending.append(item)
+
+    for batch in iter_batches(pending, BATCH_SIZE):
+        for item, result in zip(batch, await run_batch(batch)):
+            results[item["index"]] = result
+    return results
+
+
+# Hosts job webhooks may be POSTed to: exact names, or ".example.com" for a
+# domain and its subdomains. Empty allows any host that resolves to public
+# addresses only (no private, loopback or link-local/metadata targets)
+WEBHOOK_ALLOWED_HOSTS = tuple(
+    host.strip().lower() for host in os.environ.get("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()
+)
+
+# Async jobs: uploads from concurrent submissions are drained together (up
+# to JOB_DRAIN_SIZE, so several full size buckets can form) and processed
+# off the request path
+job_queue = JobQueue(
+    process_uploads,
+    batch_size=int(os.environ.get("PROCESSOR_JOB_DRAIN_SIZE", str(BATCH_SIZE * 4))),
+    max_wait=float(os.environ.get("PROCESSOR_JOB_BATCH_WAIT_MS", "50")) / 1000,
+    max_queued=int(os.environ.get("PROCESSOR_JOB_MAX_QUEUED", "1000")),
+    ttl=float(os.environ.get("PROCESSOR_JOB_TTL_SECONDS", "3600")),
+    webhook_allowed_hosts=WEBHOOK_ALLOWED_HOSTS,
+)
+
+
+async def read_uploads(files: List[UploadFile]) -> List[tuple]:
+    """(filename, bytes) for every image in the request, unpacking archives."""
+    uploads = []
+    for file in files:
+        data = await file.read()
+        try:
+            uploads.extend(expand_upload(file.filename, data))
+        except Exception as e:
+            raise ValueError(f"Could not read upload {file.filename}: {e}") from e
+    return uploads
+
+
+@app.post("/process-clothing/batch")
+async def process_clothing_batch(files: List[UploadFile] = File(...)):
+    """
+    Process many clothing images in one request. Each upload may be an image
+    or a zip/tar archive of images. Results are streamed back as NDJSON, one
+    line per image, in batch completion order. Falls back to CPU when no GPU
+    is available. A batch request holds a single in-flight slot.
+    """
+    try:
+        uploads = await read_uploads(files)
+    except ValueError as e:
+        logger.exception(str(e))
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+
+    try:
+        await acquire_slot()
+    except ProcessorBusy:
+        return busy_response()
+
+    return SlotStreamingResponse(process_batch(uploads), media_type="application/x-ndjson")
+
+
+@app.post("/jobs")
+async def submit_job(files: List[UploadFile] = File(...), webhook_url: Optional[str] = Form(None)):
+    """
+    Queue images (or zip/tar archives of images) for processing and return
+    a job id immediately. Poll GET /jobs/{job_id} for the results, or pass
+    ``webhook_url`` to have the finished job POSTed there.
+    """
+    if webhook_url:
+        try:
+            await asyncio.to_thread(check_webhook_url, webhook_url, WEBHOOK_ALLOWED_HOSTS)
+        except ValueError as e:
+            return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+    try:
+        uploads = await read_uploads(files)
+    except ValueError as e:
+        logger.exception(str(e))
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+
+    try:
+        job = job_queue.submit(uploads, webhook_url)
+    except QueueFull:
+        return busy_response()
+    return JSONResponse(
+        {"success": True, "job_id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}"},
+        status_code=202,
+    )
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Status of a submitted job; includes per-image results once finished."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return JSONResponse({"success": False, "error": "unknown job id"}, status_code=404)
+    return JSONResponse(job.to_dict())
+
+
+@functools.lru_cache(maxsize=int(os.environ.get("PROCESSOR_LABEL_CACHE_SIZE", "64")))
+def load_labels(image_id: str):
+    """Decoded (labels, original_size) for a processed image (blocking, cached)."""
+    return decode_label_png(storage.get(labels_key(image_id)))
+
+
+async def mask_response(image_id: str, class_ids: List[int], fmt: str, size: str):
+    try:
+        image_id = str(uuid.UUID(image_id))
+    except ValueError:
+        return JSONResponse({"success": False, "error": "invalid image id"}, status_code=400)
+    if fmt not in ("png", "rle") or size not in ("original", "labels"):
+        return JSONResponse({"success": False, "error": "format must be png|rle, size original|labels"}, status_code=400)
+
+    try:
+        labels, original_size = await asyncio.to_thread(load_labels, image_id)
+    except Exception as e:
+        logger.info("Label map for %s not available: %s", image_id, str(e))
+        return JSONResponse({"success": False, "error": "unknown image id"}, status_code=404)
+
+    mask = class_mask(labels, class_ids, tuple(original_size) if size == "original" else None)
+    if fmt == "rle":
+        return JSONResponse(await asyncio.to_thread(mask_rle_encode, mask))
+    return Response(await asyncio.to_thread(encode_mask_png, mask), media_type="image/png")
+
+
+@app.get("/masks/{image_id}")
+async def garment_mask(image_id: str, format: str = "png", size: str = "original"):
+    """
+    Binary mask of all garment pixels, decoded on demand from the stored
+    label map. ``format=rle`` returns COCO-style uncompressed RLE JSON;
+    ``size=labels`` skips upscaling to the upload's size.
+    """
+    return await mask_response(image_id, list(GARMENT_CLASSES), format, size)
+
+
+@app.get("/masks/{image_id}/{category}")
+async def category_mask(image_id: str, category: str, format: str = "png", size: str = "original"):
+    """Binary mask of one class (e.g. ``pants``), decoded on demand."""
+    class_ids = [class_id for class_id, name in CLOTHING_CLASSES.items() if name == category]
+    if not class_ids:
+        return JSONResponse({"success": False, "error": f"unknown category {category}"}, status_code=404)
+    return await mask_response(image_id, class_ids, format, size)
+
+
 @app.post("/generate-outfit")
-async def generate_outfit(items: list):
+async def generate_outfit(payload: Union[List[dict], dict] = Body(...)):
     """
-    Generate outfit combination using GPU-accelerated reasoning.
-    Placeholder for production outfit generation model.
+    Generate the best outfits from a user's items (see outfits.py).
+
+    The body is either a list of items or ``{"items": [...], "top_n": 5,
+    "beam_width": 64, "color_weight": 0.6}``. Items carry ``id``,
+    ``category`` and optionally ``palette``/``color`` and ``embedding``.
+    ``outfit_id`` and ``confidence`` describe the best outfit.
     """
     try:
+        options = {"items": payload} if isinstance(payload, list) else dict(payload)
+        items = options.get("items") or []
+        outfits = await asyncio.to_thread(
+            generate_outfits,
+            items,
+            int(options.get("top_n", OUTFIT_TOP_N)),
+            int(options.get("beam_width", OUTFIT_BEAM_WIDTH)),
+            float(options.get("color_weight", 0.6)),
+        )
+        for outfit in outfits:
+            outfit["outfit_id"] = str(uuid.uuid4())
         return JSONResponse(
             {
                 "success": True,
-                "outfit_id": str(uuid.uuid4()),
-                "confidence": 0.85,
-                "gpu_used": torch.cuda.is_available(),
+                "outfit_id": outfits[0]["outfit_id"] if outfits else None,
+                "confidence": outfits[0]["score"] if outfits else 0.0,
+                "outfits": outfits,
+                "gpu_used": False,
             }
         )
     except Exception as e:
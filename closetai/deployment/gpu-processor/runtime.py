@@ -0,0 +1,101 @@
+"""
+Torch runtime setup for the GPU processor: thread pools sized to the
+container's CPU quota, inference precision, optional ``torch.compile``,
+and warmup input sizes.
+"""
+import logging
+import math
+import os
+from typing import List, Optional, Tuple
+
+import torch
+
+from segmentation import PRECISIONS
+
+logger = logging.getLogger(__name__)
+
+COMPILE_MODES = ("none", "compile")
+
+
+def available_cpus() -> int:
+    """
+    CPUs this process may use: the affinity mask, further capped by a
+    cgroup v2 (``cpu.max``) or v1 (``cpu.cfs_quota_us``) quota. torch's
+    default thread count ignores quotas, so a 4-CPU pod on a 64-core node
+    would otherwise start 64 threads per pool.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            limit, period = f.read().split()
+            if limit != "max":
+                quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                limit = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+
+    if quota:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+
+def configure_threads(intra_op: int = 0, inter_op: int = 0, workers: int = 1) -> Tuple[int, int]:
+    """
+    Set torch's intra-/inter-op thread counts. Zero means "derive": the
+    CPU budget split across ``workers`` concurrent inference threads for
+    intra-op, and 1 for inter-op (SegFormer has no parallel branches).
+    Must run before the first forward pass. Returns the counts applied.
+    """
+    intra_op = intra_op or max(1, available_cpus() // max(1, workers))
+    inter_op = inter_op or 1
+    torch.set_num_threads(intra_op)
+    try:
+        torch.set_num_interop_threads(inter_op)
+    except RuntimeError:
+        # Already fixed by earlier parallel work in this process
+        inter_op = torch.get_num_interop_threads()
+    return intra_op, inter_op
+
+
+def check_precision(precision: str, device) -> str:
+    """Validate ``precision`` for ``device``: fp16 autocast is CUDA-only."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision} (expected one of {', '.join(PRECISIONS)})")
+    device_type = torch.device(device).type
+    if precision == "fp16" and device_type != "cuda":
+        raise ValueError("fp16 inference needs a CUDA device; use bf16 on CPU")
+    if precision == "bf16" and device_type == "cuda" and not torch.cuda.is_bf16_supported():
+        raise ValueError("This GPU does not support bf16; use fp16")
+    return precision
+
+
+def compile_model(model, mode: str = "none", compile_mode: Optional[str] = None):
+    """``model`` itself, or a ``torch.compile`` wrapper compiled lazily on first call."""
+    if mode not in COMPILE_MODES:
+        raise ValueError(f"Unknown compile mode: {mode}")
+    if mode == "none":
+        return model
+    return torch.compile(model, mode=compile_mode or None)
+
+
+def parse_sizes(spec: str) -> List[Tuple[int, int]]:
+    """``"768x1024,1024x768"`` -> ``[(768, 1024), (1024, 768)]`` (width, height)."""
+    sizes = []
+    for part in spec.split(","):
+        part = part.strip()
+        if part:
+            width, height = part.lower().split("x")
+            sizes.append((int(width), int(height)))
+    return sizes
@@ -0,0 +1,294 @@
+"""
+Batched SegFormer inference helpers for the ClosetAI GPU processor.
+
+Kept free of FastAPI/boto3 so the batching logic can be exercised on CPU
+with a small randomly initialised SegFormer.
+"""
+import contextlib
+import io
+import tarfile
+import zipfile
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+# Clothing class mapping for SegFormer B2 Clothes (ATR labels; 11-15 are
+# face, legs and arms)
+CLOTHING_CLASSES = {
+    1: "hat",
+    2: "hair",
+    3: "sunglasses",
+    4: "upper_clothes",
+    5: "skirt",
+    6: "pants",
+    7: "dress",
+    8: "belt",
+    9: "left_shoe",
+    10: "right_shoe",
+    16: "bag",
+    17: "scarf",
+}
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+
+# Inference precisions: autocast dtype (None runs plain fp32)
+PRECISIONS = {"fp32": None, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+# Images whose sides fall in the same BUCKET_STEP band share a batch, so
+# padding inside a batch never exceeds one step per side.
+BUCKET_STEP = 256
+
+
+def expand_upload(filename: str, data: bytes) -> Iterator[Tuple[str, bytes]]:
+    """Yield (name, bytes) for an upload, unpacking zip/tar archives."""
+    lower = (filename or "").lower()
+    if lower.endswith(".zip"):
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    yield info.filename, archive.read(info)
+    elif lower.endswith(ARCHIVE_EXTENSIONS):
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r:*") as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield member.name, archive.extractfile(member).read()
+    else:
+        yield filename, data
+
+
+def decode_image(
+    data: bytes, max_side: int = 0, max_pixels: int = 0
+) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    Decode upload bytes to an RGB image no larger than ``max_side`` on its
+    longer edge, returning ``(image, original_size)``.
+
+    JPEGs are downscaled inside the decoder via ``draft`` (1/2, 1/4 or 1/8
+    DCT scaling), so a huge phone photo is never materialised at full size.
+    Other formats decode fully and are then reduced; ``max_pixels`` caps
+    the decoded pixel count to keep per-request memory bounded.
+    """
+    image = Image.open(io.BytesIO(data))
+    original_size = image.size
+    target = None
+    if max_side and max(original_size) > max_side:
+        scale = max_side / max(original_size)
+        target = (max(1, round(original_size[0] * scale)), max(1, round(original_size[1] * scale)))
+        if image.format == "JPEG":
+            image.draft("RGB", target)
+
+    decoded_w, decoded_h = image.size
+    if max_pixels and decoded_w * decoded_h > max_pixels:
+        raise ValueError(
+            f"Image too large to decode: {original_size[0]}x{original_size[1]} "
+            f"exceeds {max_pixels} pixels"
+        )
+
+    image = image.convert("RGB")
+    if target and image.size != target:
+        image = image.resize(target, Image.BILINEAR, reducing_gap=2.0)
+    return image, original_size
+
+
+def size_bucket(size: Tuple[int, int], step: int = BUCKET_STEP) -> Tuple[int, int]:
+    """Bucket key for a PIL (width, height) size."""
+    width, height = size
+    return (-(-height // step), -(-width // step))
+
+
+def iter_batches(
+    items: Iterable[Dict], batch_size: int, step: int = BUCKET_STEP
+) -> Iterator[List[Dict]]:
+    """
+    Group items (dicts with an ``image`` key) into batches of at most
+    ``batch_size`` images from the same size bucket. Full buckets are
+    emitted as soon as they fill; partial buckets are flushed at the end.
+    """
+    buckets: Dict[Tuple[int, int], List[Dict]] = {}
+    for item in items:
+        key = size_bucket(item["image"].size, step)
+        bucket = buckets.setdefault(key, [])
+        bucket.append(item)
+        if len(bucket) >= batch_size:
+            yield buckets.pop(key)
+    for bucket in buckets.values():
+        yield bucket
+
+
+def autocast(device, precision: str = "fp32"):
+    """Autocast context for ``precision`` on ``device`` (no-op for fp32)."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}")
+    dtype = PRECISIONS[precision]
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=torch.device(device).type, dtype=dtype)
+
+
+def segment_batch(
+    model,
+    image_processor,
+    images: List[Image.Image],
+    device,
+    precision: str = "fp32",
+    channels_last: bool = False,
+) -> List[torch.Tensor]:
+    """
+    Run a single forward pass over ``images``.
+
+    Each image is preprocessed on its own and zero-padded to the largest
+    input in the batch (a no-op when the processor resizes to a fixed
+    size). Returns one fp32 ``(1, num_classes, h, w)`` logits tensor per
+    image at model resolution, with the padded border cropped away.
+    ``precision`` runs the forward pass under autocast; ``channels_last``
+    feeds NHWC input (the model should be converted the same way).
+    """
+    pixel_values = [
+        image_processor(images=image, return_tensors="pt")["pixel_values"][0]
+        for image in images
+    ]
+    max_h = max(p.shape[1] for p in pixel_values)
+    max_w = max(p.shape[2] for p in pixel_values)
+    inputs = {
+        "pixel_values": torch.stack([
+            F.pad(p, (0, max_w - p.shape[2], 0, max_h - p.shape[1]))
+            for p in pixel_values
+        ]).to(device)
+    }
+
+    if channels_last:
+        inputs["pixel_values"] = inputs["pixel_values"].contiguous(memory_format=torch.channels_last)
+
+    with torch.no_grad(), autocast(device, precision):
+        logits = model(**inputs).logits.float()
+
+    out_h, out_w = logits.shape[-2:]
+    results = []
+    for p, image_logits in zip(pixel_values, logits):
+        h = -(-p.shape[1] * out_h // max_h)
+        w = -(-p.shape[2] * out_w // max_w)
+        results.append(image_logits[:, :h, :w].unsqueeze(0))
+    return results
+
+
+def mask_agreement(
+    model,
+    image_processor,
+    images: List[Image.Image],
+    device,
+    precision: str,
+    channels_last: bool = False,
+) -> float:
+    """
+    Lowest per-image fraction of model-resolution labels that match an
+    fp32 pass over the same ``images``. Used to check that a reduced
+    precision keeps masks close enough to fp32 before enabling it.
+    """
+    worst = 1.0
+    for image in images:
+        reference = segment_batch(model, image_processor, [image], device, "fp32", channels_last)[0]
+        candidate = segment_batch(model, image_processor, [image], device, precision, channels_last)[0]
+        agreement = (reference.argmax(dim=1) == candidate.argmax(dim=1)).float().mean().item()
+        worst = min(worst, agreement)
+    return worst
+
+
+MASK_QUALITIES = ("exact", "refine", "fast")
+
+# Output pixels re-blended per step in refine mode (bounds temporary memory)
+REFINE_CHUNK = 65536
+
+
+def _source_index(out_size: int, in_size: int):
+    """
+    Per-output-pixel (lo, hi, weight) source indices matching
+    F.interpolate(mode="bilinear", align_corners=False).
+    """
+    scale = np.float32(in_size / out_size)
+    src = (np.arange(out_size, dtype=np.float32) + 0.5) * scale - 0.5
+    src = np.maximum(src, 0)
+    lo = src.astype(np.int64)
+    hi = np.minimum(lo + 1, in_size - 1)
+    return lo, hi, torch.from_numpy(src - lo)
+
+
+def _nearest_index(out_size: int, in_size: int) -> np.ndarray:
+    """Source index per output pixel matching F.interpolate(mode="nearest")."""
+    scale = np.float32(in_size / out_size)
+    return np.minimum((np.arange(out_size, dtype=np.float32) * scale).astype(np.int64), in_size - 1)
+
+
+def _refine_boundaries(logits: torch.Tensor, low: np.ndarray, out: np.ndarray) -> None:
+    """
+    Recompute exact bilinear-argmax labels for output pixels whose 2x2 source
+    neighbourhood is not a single class, writing into ``out`` in place.
+
+    Where all four source cells agree on a class, that class also wins the
+    bilinear blend (a convex combination keeps the argmax), so the
+    nearest-neighbour label is already exact there.
+    """
+    h, w = low.shape
+    out_h, out_w = out.shape
+    y_lo, y_hi, wy = _source_index(out_h, h)
+    x_lo, x_hi, wx = _source_index(out_w, w)
+
+    # Source cell (y, x) is uncertain if the block it anchors mixes classes
+    down = low[np.minimum(np.arange(h) + 1, h - 1)]
+    uncertain = (low != down)
+    uncertain |= low != low[:, np.minimum(np.arange(w) + 1, w - 1)]
+    uncertain |= low != down[:, np.minimum(np.arange(w) + 1, w - 1)]
+
+    ys, xs = np.nonzero(uncertain[np.ix_(y_lo, x_lo)])
+    # (h, w, C) so each gather pulls one contiguous class vector per pixel
+    source = logits[0].float().permute(1, 2, 0).contiguous().cpu()
+    wy, wx = wy.numpy(), wx.numpy()
+    for start in range(0, len(ys), REFINE_CHUNK):
+        y, x = ys[start:start + REFINE_CHUNK], xs[start:start + REFINE_CHUNK]
+        y0, y1, x0, x1 = y_lo[y], y_hi[y], x_lo[x], x_hi[x]
+        ry = torch.from_numpy(wy[y])[:, None]
+        rx = torch.from_numpy(wx[x])[:, None]
+        # Same blend order as the ATen kernel: columns, then rows
+        top = source[y0, x0] * (1 - rx) + source[y0, x1] * rx
+        bottom = source[y1, x0] * (1 - rx) + source[y1, x1] * rx
+        out[y, x] = (top * (1 - ry) + bottom * ry).argmax(dim=1).numpy()
+
+
+def label_map(logits: torch.Tensor, size: Tuple[int, int], quality: str = "refine") -> np.ndarray:
+    """
+    Per-pixel class labels at a PIL (width, height) size.
+
+    quality:
+        exact   bilinear-upsample all class logits, then argmax (reference;
+                allocates num_classes * width * height floats)
+        refine  argmax at model resolution, nearest-upsample the uint8 label
+                map, then recompute the exact label for each output pixel
+                whose 2x2 source block mixes classes
+        fast    argmax at model resolution and nearest-upsample only
+    """
+    if quality not in MASK_QUALITIES:
+        raise ValueError(f"Unknown mask quality: {quality}")
+
+    if quality == "exact":
+        upsampled_logits = F.interpolate(
+            logits,
+            size=size[::-1],
+            mode="bilinear",
+            align_corners=False,
+        )
+        return upsampled_logits.argmax(dim=1)[0].to(torch.uint8).cpu().numpy()
+
+    low = logits.argmax(dim=1)[0].to(torch.uint8).cpu().numpy()
+    h, w = low.shape
+    out_w, out_h = size
+    if quality == "fast":
+        return low[np.ix_(_nearest_index(out_h, h), _nearest_index(out_w, w))]
+
+    # Start from the label of each pixel's bilinear anchor cell, which is
+    # exact wherever the surrounding 2x2 source block is a single class
+    out = low[np.ix_(_source_index(out_h, h)[0], _source_index(out_w, w)[0])]
+    _refine_boundaries(logits, low, out)
+    return out
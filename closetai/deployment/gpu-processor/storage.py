@@ -0,0 +1,178 @@
+"""
+Object storage backends for the GPU processor.
+
+``STORAGE_BACKEND`` selects the implementation:
+    s3      S3-compatible object storage (Linode by default)
+    local   files under ``STORAGE_LOCAL_ROOT``
+    memory  in-process dict, for tests and air-gapped benchmarks
+
+All backends take batched writes through ``put_many``; the S3 backend
+fans them out over one shared thread pool and connection pool and switches
+to multipart uploads above ``STORAGE_MULTIPART_THRESHOLD`` bytes.
+"""
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+# (key, data, content type)
+StorageObject = Tuple[str, bytes, str]
+
+
+class Storage:
+    """Minimal object store interface used by processor.py."""
+
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        raise NotImplementedError
+
+    def put_many(self, objects: Iterable[StorageObject]) -> None:
+        for key, data, content_type in objects:
+            self.put(key, data, content_type)
+
+    def get(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def url(self, key: str) -> str:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStorage(Storage):
+    def __init__(self, base_url: str = "memory://"):
+        self.base_url = base_url
+        self.objects: Dict[str, Tuple[bytes, str]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        with self._lock:
+            self.objects[key] = (bytes(data), content_type)
+
+    def get(self, key: str) -> bytes:
+        return self.objects[key][0]
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}{key}"
+
+
+class LocalStorage(Storage):
+    """Files under ``root``; writes go to a temp file and are renamed into place."""
+
+    def __init__(self, root: str, base_url: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip("/") if base_url else None
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Key escapes storage root: {key}")
+        return path
+
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def url(self, key: str) -> str:
+        if self.base_url:
+            return f"{self.base_url}/{key}"
+        return f"file://{self._path(key)}"
+
+
+class S3Storage(Storage):
+    """
+    S3-compatible storage. One boto3 client (thread-safe) is shared by all
+    writes, with its connection pool sized to the upload thread pool.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        bucket: str,
+        access_key: Optional[str] = None,
+        secret_key: Optional[str] = None,
+        region: str = "us-east-1",
+        max_workers: int = 8,
+        multipart_threshold: int = 8 * 1024 * 1024,
+        multipart_chunksize: int = 8 * 1024 * 1024,
+    ):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        self.endpoint = endpoint
+        self.bucket = bucket
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=f"https://{endpoint}",
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region,
+            config=Config(max_pool_connections=max_workers * 2),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=4,
+        )
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="s3-upload")
+
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        self.client.upload_fileobj(
+            io.BytesIO(data),
+            self.bucket,
+            key,
+            ExtraArgs={"ContentType": content_type},
+            Config=self.transfer_config,
+        )
+
+    def put_many(self, objects: Iterable[StorageObject]) -> None:
+        futures = [self.executor.submit(self.put, *obj) for obj in objects]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            raise errors[0]
+
+    def get(self, key: str) -> bytes:
+        buf = io.BytesIO()
+        self.client.download_fileobj(self.bucket, key, buf)
+        return buf.getvalue()
+
+    def url(self, key: str) -> str:
+        # Linode Object Storage public URL format
+        return f"https://{self.bucket}.{self.endpoint}/{key}"
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
+def create_storage(backend: Optional[str] = None) -> Storage:
+    """Build the backend named by ``backend`` or ``STORAGE_BACKEND`` (default s3)."""
+    backend = (backend or os.environ.get("STORAGE_BACKEND", "s3")).lower()
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "local":
+        return LocalStorage(
+            os.environ.get("STORAGE_LOCAL_ROOT", "/tmp/closetai-processor/objects"),
+            os.environ.get("STORAGE_PUBLIC_URL"),
+        )
+    if backend == "s3":
+        return S3Storage(
+            endpoint=os.environ.get("OBJECT_STORAGE_ENDPOINT", "us-sea-1.linodeobjects.com"),
+            bucket=os.environ.get("OBJECT_STORAGE_BUCKET", "wardrobe-stylist-media"),
+            access_key=os.environ.get("OBJECT_STORAGE_ACCESS_KEY"),
+            secret_key=os.environ.get("OBJECT_STORAGE_SECRET_KEY"),
+            max_workers=int(os.environ.get("PROCESSOR_UPLOAD_WORKERS", "8")),
+            multipart_threshold=int(os.environ.get("STORAGE_MULTIPART_THRESHOLD", str(8 * 1024 * 1024))),
+            multipart_chunksize=int(os.environ.get("STORAGE_MULTIPART_CHUNKSIZE", str(8 * 1024 * 1024))),
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
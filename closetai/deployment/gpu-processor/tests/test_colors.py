@@ -0,0 +1,25 @@
+import numpy as np
+
+import colors
+
+
+def test_rgb_to_lab_reference_points():
+    lab = colors.rgb_to_lab(np.array([[255, 255, 255], [0, 0, 0], [255, 0, 0]]))
+    np.testing.assert_allclose(lab[0], [100, 0, 0], atol=0.05)
+    np.testing.assert_allclose(lab[1], [0, 0, 0], atol=0.05)
+    np.testing.assert_allclose(lab[2], [53.24, 80.09, 67.20], atol=0.05)
+
+
+def test_extract_palette_recovers_base_colors():
+    rng = np.random.default_rng(0)
+    base = np.array([[20, 30, 90], [235, 235, 230], [200, 30, 40]], dtype=np.float32)
+    choice = rng.choice(3, size=200_000, p=[0.6, 0.3, 0.1])
+    pixels = np.clip(base[choice] + rng.normal(0, 6, size=(len(choice), 3)), 0, 255).astype(np.uint8)
+
+    palette = colors.extract_palette(pixels, k=3)
+    assert [round(c["coverage"], 1) for c in palette] == [0.6, 0.3, 0.1]
+    for color, expected in zip(palette, base):
+        assert np.abs(np.array(color["rgb"]) - expected).max() <= 6
+    assert palette[0]["hex"].startswith("#")
+    assert colors.extract_palette(np.zeros((0, 3), dtype=np.uint8)) == []
+
@@ -0,0 +1,43 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+import dedup
+
+
+def _photo(seed):
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (12, 9, 3), dtype=np.uint8)
+    return Image.fromarray(small).resize((360, 480), Image.BILINEAR)
+
+
+def test_perceptual_hash_survives_reencode_and_resize():
+    photo = _photo(0)
+    buf = io.BytesIO()
+    photo.resize((270, 360)).save(buf, format="JPEG", quality=70)
+    copy = Image.open(io.BytesIO(buf.getvalue()))
+    distance = bin(dedup.perceptual_hash(photo) ^ dedup.perceptual_hash(copy)).count("1")
+    other = bin(dedup.perceptual_hash(photo) ^ dedup.perceptual_hash(_photo(1))).count("1")
+    assert distance <= 3 < other
+
+
+def test_result_cache_lookup_eviction_and_persistence(tmp_path):
+    path = str(tmp_path / "dedup.sqlite3")
+    cache = dedup.ResultCache(path, max_entries=2, max_distance=3)
+    high_bit = 1 << 63  # exercises the signed SQLite round trip
+    cache.put("a", high_bit | 0b1111, {"image_id": "a"})
+    cache.put("b", 0xFF00FF00, {"image_id": "b"})
+
+    assert cache.get_exact("a") == {"image_id": "a"}
+    assert cache.get_similar(high_bit | 0b0111) == {"image_id": "a"}
+    assert cache.get_similar(0x00FF00FF) is None
+
+    cache.put("c", 0, {"image_id": "c"})  # evicts "b", the least recently used
+    assert cache.get_exact("b") is None and len(cache) == 2
+
+    reopened = dedup.ResultCache(path, max_entries=2, max_distance=3)
+    assert reopened.get_exact("a") == {"image_id": "a"}
+    assert reopened.get_exact("c") == {"image_id": "c"}
+    assert reopened.get_similar(high_bit | 0b1110) == {"image_id": "a"}
+    assert reopened.get_exact("b") is None
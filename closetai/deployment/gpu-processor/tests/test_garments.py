@@ -0,0 +1,39 @@
+import numpy as np
+
+import garments
+
+
+def test_class_boxes_match_per_class_scan():
+    rng = np.random.default_rng(0)
+    labels = np.zeros((60, 80), dtype=np.uint8)
+    labels[5:20, 10:30] = 4
+    labels[30:55, 40:50] = 6
+    labels[rng.integers(0, 60, 5), rng.integers(0, 80, 5)] = 17
+    areas, boxes = garments.class_boxes(labels, 18)
+    for class_id in range(18):
+        ys, xs = np.nonzero(labels == class_id)
+        assert areas[class_id] == len(ys)
+        if len(ys):
+            assert boxes[class_id].tolist() == [xs.min(), ys.min(), xs.max() + 1, ys.max() + 1]
+        else:
+            assert boxes[class_id].tolist() == [0, 0, 0, 0]
+
+
+def test_extract_garments_skips_hair_and_specks():
+    image = np.zeros((100, 100, 3), dtype=np.uint8)
+    labels = np.zeros((100, 100), dtype=np.uint8)
+    labels[0:10, 40:60] = 2            # hair
+    labels[20:60, 20:80] = 4           # upper clothes
+    image[20:60, 20:80] = [10, 20, 200]
+    labels[60:95, 30:70] = 6           # pants
+    image[60:95, 30:70] = [50, 50, 50]
+    labels[99, 99] = 16                # one-pixel "bag"
+
+    items = garments.extract_garments(image, labels, palette_size=2)
+    assert [item["category"] for item in items] == ["upper_clothes", "pants"]
+    upper = items[0]
+    assert upper["bbox"] == [20, 20, 80, 60]
+    assert upper["area"] == 2400 and upper["area_fraction"] == 0.24
+    assert upper["mask"].shape == upper["crop"].shape[:2] == (40, 60)
+    assert upper["mask"].all()
+    assert upper["palette"][0]["rgb"] == [10, 20, 200]
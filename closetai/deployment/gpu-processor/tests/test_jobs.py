@@ -0,0 +1,117 @@
+import asyncio
+import threading
+
+import pytest
+
+import jobs
+
+
+def _run_queue(queue, submissions):
+    """Submit each upload list concurrently and wait for every job to finish."""
+    async def main():
+        submitted = [queue.submit(uploads, webhook) for uploads, webhook in submissions]
+        while any(job.finished_at is None for job in submitted):
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)  # let webhook callbacks get scheduled
+        return submitted
+    return asyncio.run(main())
+
+
+def test_concurrent_jobs_share_batches_and_keep_order():
+    batches = []
+
+    async def handler(uploads):
+        batches.append([name for name, _ in uploads])
+        return [{"success": True, "filename": name} for name, _ in uploads]
+
+    queue = jobs.JobQueue(handler, batch_size=4, max_wait=0.05)
+    first, second = _run_queue(queue, [([("a", b""), ("b", b""), ("c", b"")], None), ([("d", b""), ("e", b"")], None)])
+    assert batches == [["a", "b", "c", "d"], ["e"]]
+    assert [r["filename"] for r in first.results] == ["a", "b", "c"]
+    assert second.to_dict()["status"] == "done"
+    assert second.to_dict()["completed"] == 2
+    assert queue.get(first.id) is first
+    assert len(queue) == 0
+
+
+def test_failed_batch_fails_job_and_fires_webhook(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        jobs, "post_webhook",
+        lambda url, payload, timeout, allowed_hosts: calls.append((url, payload, threading.current_thread().name)),
+    )
+
+    async def handler(uploads):
+        raise RuntimeError("boom")
+
+    queue = jobs.JobQueue(handler, batch_size=8, max_wait=0)
+    (job,) = _run_queue(queue, [([("a", b"")], "http://hooks.local/done")])
+    assert job.status == "failed"
+    assert job.results[0]["error"] == "boom"
+    queue._webhook_executor.shutdown(wait=True)
+    assert [(url, payload) for url, payload, _ in calls] == [("http://hooks.local/done", job.to_dict())]
+    assert calls[0][2].startswith("webhook")
+
+
+def test_queue_limit_and_expiry():
+    async def handler(uploads):
+        return [{"success": True} for _ in uploads]
+
+    queue = jobs.JobQueue(handler, max_queued=2, ttl=0)
+
+    async def main():
+        with pytest.raises(jobs.QueueFull):
+            queue.submit([("a", b""), ("b", b""), ("c", b"")])
+        job = queue.submit([])
+        assert job.status == "done"
+        await asyncio.sleep(0.01)
+        assert queue.get(job.id) is None
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://hooks.example.com/done",
+    "http:///done",
+    "http://127.0.0.1:8080/done",
+    "http://localhost/done",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://10.0.0.5/done",
+    "http://[::1]/done",
+    "http://[::ffff:192.168.1.1]/done",
+])
+def test_webhook_targets_must_be_public(url):
+    with pytest.raises(ValueError):
+        jobs.check_webhook_url(url)
+
+
+def test_webhook_allowlist(monkeypatch):
+    jobs.check_webhook_url("https://93.184.216.34/done")
+    allowed = ("hooks.example.com", ".partner.io")
+    jobs.check_webhook_url("https://hooks.example.com/done", allowed)
+    jobs.check_webhook_url("https://a.b.partner.io/done", allowed)
+    for url in ("https://example.com/done", "https://evilpartner.io/done", "http://169.254.169.254/"):
+        with pytest.raises(ValueError):
+            jobs.check_webhook_url(url, allowed)
+
+
+def test_refused_webhook_is_never_sent(monkeypatch):
+    def urlopen(*args, **kwargs):
+        raise AssertionError("webhook sent")
+
+    monkeypatch.setattr(jobs._webhook_opener, "open", urlopen)
+    assert jobs.post_webhook("http://169.254.169.254/", {"job_id": "x"}, retries=1) is False
+
+
+def test_webhook_backs_off_only_between_attempts(monkeypatch):
+    attempts, sleeps = [], []
+
+    def urlopen(*args, **kwargs):
+        attempts.append(args)
+        raise OSError("connection refused")
+
+    monkeypatch.setattr(jobs._webhook_opener, "open", urlopen)
+    monkeypatch.setattr(jobs.time, "sleep", sleeps.append)
+    assert jobs.post_webhook("https://93.184.216.34/done", {"job_id": "x"}, retries=3) is False
+    assert len(attempts) == 3
+    assert sleeps == [1, 2]
@@ -0,0 +1,47 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import masks
+
+
+@pytest.fixture
+def labels():
+    rng = np.random.default_rng(0)
+    labels = np.zeros((48, 64), dtype=np.uint8)
+    labels[5:30, 10:40] = 4
+    labels[30:48, 20:35] = 6
+    labels[0:4, 50:64] = 17
+    labels[rng.integers(0, 48, 20), rng.integers(0, 64, 20)] = 2
+    return labels
+
+
+def test_label_png_roundtrip_keeps_classes_and_original_size(labels):
+    data = masks.encode_label_png(labels, (640, 480))
+    assert Image.open(io.BytesIO(data)).mode == "P"
+    decoded, original_size = masks.decode_label_png(data)
+    np.testing.assert_array_equal(decoded, labels)
+    assert original_size == (640, 480)
+
+    _, untagged = masks.decode_label_png(masks.encode_label_png(labels))
+    assert untagged == (64, 48)
+
+
+def test_rle_roundtrips(labels):
+    rle = masks.rle_encode(labels)
+    assert sum(rle["counts"]) == labels.size
+    np.testing.assert_array_equal(masks.rle_decode(rle), labels)
+
+    mask = labels == 4
+    np.testing.assert_array_equal(masks.mask_rle_decode(masks.mask_rle_encode(mask)), mask)
+    # COCO convention: column-major, first run counts zeros
+    assert masks.mask_rle_encode(np.array([[1, 0], [1, 1]], dtype=bool))["counts"] == [0, 2, 1, 1]
+
+
+def test_class_mask_upscale_matches_pil_nearest(labels):
+    mask = masks.class_mask(labels, [4, 6], (200, 150))
+    expected = np.asarray(Image.fromarray(np.isin(labels, [4, 6])).resize((200, 150), Image.NEAREST))
+    np.testing.assert_array_equal(mask, expected)
+    np.testing.assert_array_equal(masks.class_mask(labels, 17), labels == 17)
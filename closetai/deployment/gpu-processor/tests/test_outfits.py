@@ -0,0 +1,63 @@
+import itertools
+
+import numpy as np
+
+import outfits
+
+
+def _item(id, category, color, embedding=None):
+    return {"id": id, "category": category, "color": color, "embedding": embedding}
+
+
+def _brute_force(items, pair_scores):
+    """Exhaustive best top+bottom+shoes outfit for a closet without dresses or outer layers."""
+    by_slot = {slot: [i for i, item in enumerate(items) if outfits.CATEGORY_SLOTS[item["category"]] == slot]
+               for slot in ("top", "bottom", "shoes")}
+    best = max(
+        itertools.product(by_slot["top"], by_slot["bottom"], by_slot["shoes"]),
+        key=lambda combo: sum(pair_scores[a, b] for a, b in itertools.combinations(combo, 2)),
+    )
+    return [items[i]["id"] for i in best]
+
+
+def test_harmony_prefers_neutrals_and_complements_over_clashes():
+    names = ["navy", "red", "gray", "burgundy", "yellow", None]
+    items = [_item(str(name), "top", name) for name in names]
+    harmony = outfits.color_harmony_matrix(items)
+    assert harmony.shape == (6, 6)
+    assert harmony[1, 0] > 0.95 and harmony[1, 2] > 0.95   # navy and gray go with anything
+    assert harmony[1, 3] > 0.9                               # analogous
+    assert harmony[1, 4] < 0.5                               # clash
+    assert harmony[1, 5] == 1                                # no color information
+    np.testing.assert_allclose(harmony, harmony.T, atol=1e-6)
+
+
+def test_beam_search_matches_exhaustive_search():
+    rng = np.random.default_rng(0)
+    categories = ["top"] * 8 + ["pants"] * 6 + ["left_shoe"] * 5
+    items = [
+        {"id": i, "category": c, "palette": [{"rgb": rng.integers(0, 255, 3).tolist(), "coverage": 1.0}],
+         "embedding": rng.normal(size=16).tolist()}
+        for i, c in enumerate(categories)
+    ]
+    result = outfits.generate_outfits(items, top_n=3, beam_width=1000)
+    harmony = outfits.color_harmony_matrix(items)
+    compat, _ = outfits.compatibility_matrix(items)
+    assert result[0]["items"] == _brute_force(items, 0.6 * harmony + 0.4 * compat)
+    assert len({outfit["slots"]["top"] for outfit in result}) == 3
+
+
+def test_dresses_outer_layers_and_empty_closets():
+    items = [_item("d", "dress", "black"), _item("s", "sneakers", "white"), _item("c", "coat", "camel")]
+    result = outfits.generate_outfits(items, top_n=5)
+    assert {tuple(o["items"]) for o in result} <= {("d", "s"), ("d", "s", "c")}
+    assert result[0]["compatibility"] is None
+    assert outfits.generate_outfits([_item("s", "shoes", "red")]) == []
+    assert outfits.parse_color("rgb(1, 2, 3)") == (1, 2, 3) and outfits.parse_color("#0a0b0c") == (10, 11, 12)
+
+
+def test_tops_without_bottoms_are_not_outfits():
+    items = [_item("t1", "shirt", "white"), _item("t2", "sweater", "navy"), _item("s", "shoes", "black")]
+    assert outfits.generate_outfits(items) == []
+    items.append(_item("d", "dress", "red"))
+    assert {tuple(o["items"]) for o in outfits.generate_outfits(items)} == {("d", "s")}
@@ -0,0 +1,215 @@
+import asyncio
+import importlib
+import io
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+transformers = pytest.importorskip("transformers")
+httpx = pytest.importorskip("httpx")
+from fastapi.testclient import TestClient  # noqa: E402
+
+from dedup import ResultCache  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def processor(tmp_path_factory):
+    """processor.py loaded with a tiny local SegFormer and in-memory storage."""
+    model_dir = tmp_path_factory.mktemp("segformer")
+    torch.manual_seed(0)
+    config = transformers.SegformerConfig(
+        num_labels=18,
+        hidden_sizes=[8, 16, 32, 64],
+        depths=[1, 1, 1, 1],
+        num_attention_heads=[1, 1, 2, 2],
+        decoder_hidden_size=32,
+    )
+    transformers.SegformerForSemanticSegmentation(config).save_pretrained(model_dir)
+    transformers.SegformerImageProcessor(size={"height": 64, "width": 64}).save_pretrained(model_dir)
+
+    env = {
+        "SEGFORMER_MODEL": str(model_dir),
+        "STORAGE_BACKEND": "memory",
+        "PROCESSOR_DEDUP_CACHE_PATH": "",
+        "PROCESSOR_WARMUP_SIZES": "",
+        "PROCESSOR_MAX_IN_FLIGHT": "2",
+        "PROCESSOR_QUEUE_TIMEOUT_SECONDS": "0.2",
+        "PROCESSOR_WORKING_MAX_SIDE": "64",
+    }
+    with pytest.MonkeyPatch.context() as mp:
+        for key, value in env.items():
+            mp.setenv(key, value)
+        sys.modules.pop("processor", None)
+        module = importlib.import_module("processor")
+        module.warmup_future.result()
+        yield module
+    sys.modules.pop("processor", None)
+
+
+@pytest.fixture
+def app(processor, monkeypatch):
+    """Fresh in-flight slots and result cache for each test."""
+    monkeypatch.setattr(processor, "in_flight", asyncio.Semaphore(processor.MAX_IN_FLIGHT))
+    monkeypatch.setattr(processor, "result_cache", ResultCache(None))
+    return processor
+
+
+def _png(seed: int, size: int = 48) -> bytes:
+    rng = np.random.default_rng(seed)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 255, (size, size, 3), dtype=np.uint8)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _gate_inference(app, monkeypatch):
+    """Block segment_images until the returned event is set; ``started`` counts calls."""
+    release, started = threading.Event(), threading.Semaphore(0)
+    original = app.segment_images
+
+    def gated(*args):
+        started.release()
+        release.wait(10)
+        return original(*args)
+
+    monkeypatch.setattr(app, "segment_images", gated)
+    return release, started
+
+
+def test_batch_results_stream_and_return_slot(app):
+    with TestClient(app.app) as client:
+        files = [("files", (f"{i}.png", _png(i), "image/png")) for i in range(3)]
+        response = client.post("/process-clothing/batch", files=files)
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert response.status_code == 200
+    assert sorted(line["filename"] for line in lines) == ["0.png", "1.png", "2.png"]
+    assert all(line["success"] for line in lines)
+    assert app.in_flight._value == app.MAX_IN_FLIGHT
+
+
+def test_in_flight_limit_busy_and_health_during_inference(app, monkeypatch):
+    release, started = _gate_inference(app, monkeypatch)
+    with TestClient(app.app) as client:
+        responses = []
+
+        def post(seed):
+            files = [("files", (f"{seed}.png", _png(seed), "image/png"))]
+            responses.append(client.post("/process-clothing/batch", files=files))
+
+        threads = [threading.Thread(target=post, args=(seed,)) for seed in range(2)]
+        for thread in threads:
+            thread.start()
+        assert started.acquire(timeout=10)
+        deadline = time.monotonic() + 10
+        while app.in_flight._value and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert app.in_flight._value == 0
+
+        busy = client.post("/process-clothing", files={"file": ("busy.png", _png(9), "image/png")})
+        assert busy.status_code == 503
+        assert busy.headers["Retry-After"] == "1"
+
+        start = time.perf_counter()
+        health = client.get("/health")
+        assert health.status_code == 200 and health.json()["status"] == "healthy"
+        assert time.perf_counter() - start < 1
+
+        release.set()
+        for thread in threads:
+            thread.join(10)
+    assert [r.status_code for r in responses] == [200, 200]
+    assert app.in_flight._value == app.MAX_IN_FLIGHT
+
+
+async def _post_and_drop(app, path: str, files, fail_on: str) -> None:
+    """
+    Drive one ASGI request whose client goes away: ``http.disconnect``
+    right after the body, or a send that fails on the ``fail_on`` message.
+    """
+    request = httpx.Request("POST", f"http://test{path}", files=files)
+    body = request.read()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "client": ("test", 1), "server": ("test", 80),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in request.headers.items()],
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        if fail_on == "http.disconnect":
+            return {"type": "http.disconnect"}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == fail_on:
+            raise OSError("client went away")
+
+    try:
+        await app.app(scope, receive, send)
+    except Exception:
+        pass
+
+
+@pytest.mark.parametrize("fail_on", ["http.disconnect", "http.response.start", "http.response.body"])
+def test_dropped_batch_request_frees_its_slot(app, fail_on):
+    files = [("files", ("a.png", _png(1), "image/png"))]
+
+    async def main():
+        for _ in range(app.MAX_IN_FLIGHT + 1):
+            await _post_and_drop(app, "/process-clothing/batch", files, fail_on)
+
+    asyncio.run(main())
+    assert app.in_flight._value == app.MAX_IN_FLIGHT
+    with TestClient(app.app) as client:
+        response = client.post("/process-clothing/batch", files=files)
+    assert response.status_code == 200
+
+
+def test_result_cache_io_runs_off_the_event_loop(app, monkeypatch):
+    class SlowCache(ResultCache):
+        """SQLite on a slow disk: every lookup and store blocks its thread."""
+
+        def get_exact(self, digest):
+            time.sleep(0.5)
+            return super().get_exact(digest)
+
+        def put(self, digest, phash, result):
+            time.sleep(0.5)
+            super().put(digest, phash, result)
+
+    monkeypatch.setattr(app, "result_cache", SlowCache(None))
+    with TestClient(app.app) as client:
+        done = []
+        upload = threading.Thread(target=lambda: done.append(
+            client.post("/process-clothing", files={"file": ("a.png", _png(3), "image/png")})
+        ))
+        upload.start()
+        time.sleep(0.1)
+        latencies = []
+        while upload.is_alive():
+            start = time.perf_counter()
+            assert client.get("/health/live").status_code == 200
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.05)
+        upload.join()
+    assert done[0].status_code == 200
+    assert len(latencies) > 5 and max(latencies) < 0.25
+
+
+def test_job_webhook_must_not_target_internal_hosts(app):
+    with TestClient(app.app) as client:
+        response = client.post(
+            "/jobs",
+            files=[("files", ("a.png", _png(4), "image/png"))],
+            data={"webhook_url": "http://169.254.169.254/latest/meta-data/"},
+        )
+    assert response.status_code == 400
+    assert "non-public" in response.json()["error"]
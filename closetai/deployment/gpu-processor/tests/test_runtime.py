@@ -0,0 +1,37 @@
+import pytest
+import torch
+
+import runtime
+
+
+def test_parse_sizes():
+    assert runtime.parse_sizes("768x1024, 1024X768,") == [(768, 1024), (1024, 768)]
+    assert runtime.parse_sizes("") == []
+
+
+def test_configure_threads_splits_cpu_budget(monkeypatch):
+    before = torch.get_num_threads()
+    monkeypatch.setattr(runtime, "available_cpus", lambda: 8)
+    try:
+        intra, inter = runtime.configure_threads(workers=3)
+        assert intra == 2 and torch.get_num_threads() == 2
+        assert inter >= 1
+        assert runtime.configure_threads(intra_op=5)[0] == 5
+    finally:
+        torch.set_num_threads(before)
+
+
+def test_compile_model_modes():
+    model = torch.nn.Linear(2, 2)
+    assert runtime.compile_model(model, "none") is model
+    with pytest.raises(ValueError):
+        runtime.compile_model(model, "jit")
+    assert runtime.available_cpus() >= 1
+
+
+def test_check_precision():
+    assert runtime.check_precision("bf16", "cpu") == "bf16"
+    with pytest.raises(ValueError):
+        runtime.check_precision("fp16", "cpu")
+    with pytest.raises(ValueError):
+        runtime.check_precision("fp8", "cpu")
@@ -0,0 +1,123 @@
+import io
+import zipfile
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+import segmentation as seg
+
+transformers = pytest.importorskip("transformers")
+
+
+@pytest.fixture(scope="module")
+def tiny_segformer():
+    """Randomly initialised SegFormer with the clothes head size; runs on CPU."""
+    torch.manual_seed(0)
+    config = transformers.SegformerConfig(
+        num_labels=18,
+        hidden_sizes=[8, 16, 32, 64],
+        depths=[1, 1, 1, 1],
+        num_attention_heads=[1, 1, 2, 2],
+        decoder_hidden_size=32,
+    )
+    model = transformers.SegformerForSemanticSegmentation(config).eval()
+    image_processor = transformers.SegformerImageProcessor(size={"height": 128, "width": 128})
+    return model, image_processor
+
+
+def _image(width, height, seed):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 255, (height, width, 3), dtype=np.uint8))
+
+
+def _encoded(width, height, fmt):
+    buf = io.BytesIO()
+    _image(width, height, 0).save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def test_decode_image_caps_working_resolution():
+    image, original_size = seg.decode_image(_encoded(2400, 1800, "JPEG"), max_side=512)
+    assert original_size == (2400, 1800)
+    assert image.size == (512, 384) and image.mode == "RGB"
+
+    image, original_size = seg.decode_image(_encoded(300, 200, "PNG"), max_side=512)
+    assert image.size == original_size == (300, 200)
+
+    with pytest.raises(ValueError):
+        seg.decode_image(_encoded(2400, 1800, "PNG"), max_side=512, max_pixels=1_000_000)
+    # JPEG draft decodes at 1/4 scale, well under the pixel cap
+    seg.decode_image(_encoded(2400, 1800, "JPEG"), max_side=512, max_pixels=1_000_000)
+
+
+def test_iter_batches_groups_by_size_bucket():
+    items = [{"image": _image(w, h, i)} for i, (w, h) in enumerate(
+        [(100, 120), (600, 800), (90, 300), (110, 130), (610, 790)]
+    )]
+    batches = list(seg.iter_batches(items, batch_size=2))
+    sizes = [[item["image"].size for item in batch] for batch in batches]
+    assert sizes == [[(100, 120), (110, 130)], [(600, 800), (610, 790)], [(90, 300)]]
+
+
+def test_expand_upload_unpacks_zip():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        archive.writestr("a.jpg", b"x")
+        archive.writestr("notes.txt", b"y")
+        archive.writestr("dir/b.png", b"z")
+    assert list(seg.expand_upload("closet.zip", buf.getvalue())) == [("a.jpg", b"x"), ("dir/b.png", b"z")]
+    assert list(seg.expand_upload("shirt.jpg", b"raw")) == [("shirt.jpg", b"raw")]
+
+
+def test_batched_forward_matches_single_image(tiny_segformer):
+    model, image_processor = tiny_segformer
+    images = [_image(160, 200, 1), _image(150, 210, 2), _image(170, 190, 3)]
+    batched = seg.segment_batch(model, image_processor, images, torch.device("cpu"))
+    for image, logits in zip(images, batched):
+        single = seg.segment_batch(model, image_processor, [image], torch.device("cpu"))[0]
+        assert logits.shape == single.shape
+        assert torch.allclose(logits, single, atol=1e-4)
+        assert seg.label_map(logits, image.size).shape == image.size[::-1]
+
+
+def test_unresized_inputs_are_padded_and_cropped(tiny_segformer):
+    model, _ = tiny_segformer
+    image_processor = transformers.SegformerImageProcessor(do_resize=False)
+    images = [_image(64, 96, 4), _image(96, 64, 5)]
+    batched = seg.segment_batch(model, image_processor, images, torch.device("cpu"))
+    assert [tuple(l.shape[-2:]) for l in batched] == [(24, 16), (16, 24)]
+
+
+@pytest.mark.parametrize("size", [(500, 375), (1333, 1000), (100, 90), (128, 128)])
+def test_label_map_fast_paths_agree_with_exact(size):
+    torch.manual_seed(0)
+    low = torch.nn.functional.interpolate(torch.randn(1, 18, 16, 16), size=(128, 128), mode="bilinear")
+    logits = 3 * low + 0.3 * torch.randn(1, 18, 128, 128)
+    exact = seg.label_map(logits, size, quality="exact")
+    refine = seg.label_map(logits, size, quality="refine")
+    fast = seg.label_map(logits, size, quality="fast")
+    assert exact.shape == refine.shape == fast.shape == size[::-1]
+    assert refine.dtype == fast.dtype == np.uint8
+    assert (refine == exact).mean() > 0.9999
+    assert (fast == exact).mean() > 0.7
+
+
+def test_reduced_precision_and_channels_last(tiny_segformer):
+    model, image_processor = tiny_segformer
+    images = [_image(160, 200, 0), _image(200, 160, 1)]
+    reference = seg.segment_batch(model, image_processor, images, "cpu")
+    bf16 = seg.segment_batch(model, image_processor, images, "cpu", precision="bf16")
+    assert all(logits.dtype == torch.float32 for logits in bf16)
+
+    model.to(memory_format=torch.channels_last)
+    try:
+        nhwc = seg.segment_batch(model, image_processor, images, "cpu", channels_last=True)
+        assert seg.mask_agreement(model, image_processor, images, "cpu", "bf16", channels_last=True) > 0.9
+    finally:
+        model.to(memory_format=torch.contiguous_format)
+    for ref, out in zip(reference, nhwc):
+        torch.testing.assert_close(ref, out, rtol=1e-4, atol=1e-4)
+    with pytest.raises(ValueError):
+        seg.segment_batch(model, image_processor, images, "cpu", precision="int8")
@@ -0,0 +1,31 @@
+import pytest
+
+import storage
+
+
+def test_memory_storage_batched_writes():
+    store = storage.create_storage("memory")
+    store.put_many([("a/1.png", b"one", "image/png"), ("a/2.png", b"two", "image/png")])
+    assert store.get("a/2.png") == b"two"
+    assert store.url("a/1.png") == "memory://a/1.png"
+
+
+def test_local_storage_roundtrip_and_urls(tmp_path, monkeypatch):
+    monkeypatch.setenv("STORAGE_LOCAL_ROOT", str(tmp_path))
+    store = storage.create_storage("local")
+    store.put_many([("masks/x.png", b"mask", "image/png"), ("items/x/dress.png", b"crop", "image/png")])
+    assert (tmp_path / "items" / "x" / "dress.png").read_bytes() == b"crop"
+    assert store.get("masks/x.png") == b"mask"
+    assert store.url("masks/x.png") == f"file://{tmp_path}/masks/x.png"
+    assert not list(tmp_path.rglob("*.tmp"))
+
+    with pytest.raises(ValueError):
+        store.put("../escape.png", b"", "image/png")
+
+    public = storage.LocalStorage(str(tmp_path), "http://cdn.local/media/")
+    assert public.url("masks/x.png") == "http://cdn.local/media/masks/x.png"
+
+
+def test_unknown_backend_rejected():
+    with pytest.raises(ValueError):
+        storage.create_storage("ftp")
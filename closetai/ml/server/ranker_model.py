@@ -3,18 +3,62 @@ from flask import Flask, request, jsonify
 import torch
 import numpy as np
 import os
-from ml.train.ranker_train import MLP
+import threading
+from ml.train.ranker_train import build_model, load_model, TwoTower
 
 app = Flask(__name__)
-MODEL_PATH = os.path.join(os.path.dirname(__file__), '..','models','ranker_demo.pt')
-model = MLP()
+MODEL_PATH = os.environ.get('RANKER_MODEL_PATH', os.path.join(os.path.dirname(__file__), '..','models','ranker_demo.pt'))
 if os.path.exists(MODEL_PATH):
-    model.load_state_dict(torch.load(MODEL_PATH))
+    model, arch = load_model(MODEL_PATH)
+else:
+    arch = os.environ.get('RANKER_ARCH', 'mlp')
+    model = build_model(arch)
 model.eval()
 
+# two-tower only: (item id -> row, item vectors), filled by /index_items.
+# Replaced as one tuple so /score never sees ids and vectors from different updates
+ITEM_INDEX = ({}, torch.empty(0))
+INDEX_LOCK = threading.Lock()  # serializes /index_items writers
+
+@app.route('/index_items', methods=['POST'])
+def index_items():
+    """Precompute item tower outputs so /score only needs the user tower."""
+    global ITEM_INDEX
+    if not isinstance(model, TwoTower):
+        return jsonify({"error": f"item cache requires two_tower, model is {arch}"}), 400
+    items = request.json.get('items', {})  # {item_id: item feature vector}
+    if not items:
+        return jsonify({"error": "no items to index"}), 400
+    ids = list(items)
+    X = torch.tensor(np.array([items[i] for i in ids], dtype=np.float32))
+    with torch.no_grad():
+        vecs = model.encode_items(X)
+    with INDEX_LOCK:
+        item_ids, item_vecs = ITEM_INDEX
+        item_ids = dict(item_ids)
+        for i in ids:
+            item_ids.setdefault(i, len(item_ids))
+        new = torch.zeros(len(item_ids), vecs.shape[1])
+        if item_vecs.numel():
+            new[:len(item_vecs)] = item_vecs
+        new[[item_ids[i] for i in ids]] = vecs
+        ITEM_INDEX = (item_ids, new)
+    return jsonify({"indexed": len(ids), "total": len(item_ids)})
+
 @app.route('/score', methods=['POST'])
 def score():
     payload = request.json
+    if 'item_ids' in payload:
+        # two-tower fast path: one user forward + matrix-vector over cached items
+        item_ids, item_vecs = ITEM_INDEX
+        missing = [i for i in payload['item_ids'] if i not in item_ids]
+        if missing or not isinstance(model, TwoTower):
+            return jsonify({"error": "unknown item ids", "missing": missing}), 400
+        u = torch.tensor(np.array(payload['user'], dtype=np.float32))
+        rows = item_vecs[[item_ids[i] for i in payload['item_ids']]]
+        with torch.no_grad():
+            preds = model.score_items(model.encode_users(u), rows).numpy().tolist()
+        return jsonify({"scores": preds})
     # candidates: list of feature vectors (list of floats)
     candidates = payload.get('candidates', [])
     # user features ignored for demo, we take candidates as full vector
@@ -4,3 +4,81 @@ def test_train_runs(tmp_path):
     rt.synth_data(10)  # small synthetic
     # If no exceptions, pass
     assert True
+
+def test_model_zoo_forward_and_roundtrip(tmp_path):
+    import torch
+    import ml.train.ranker_train as rt
+    X, _ = rt.synth_data(8)
+    x = torch.tensor(X)
+    for arch in rt.MODELS:
+        model = rt.build_model(arch).eval()
+        path = tmp_path / f'{arch}.pt'
+        torch.save({'arch': arch, 'state_dict': model.state_dict()}, path)
+        loaded, loaded_arch = rt.load_model(path)
+        loaded.eval()
+        assert loaded_arch == arch
+        with torch.no_grad():
+            assert model(x).shape == (8,)
+            assert torch.allclose(model(x), loaded(x))
+
+def test_two_tower_cached_scoring_matches_forward():
+    import torch
+    import ml.train.ranker_train as rt
+    model = rt.TwoTower().eval()
+    user = torch.randn(32)
+    items = torch.randn(5, 32)
+    with torch.no_grad():
+        full = model(torch.cat([user.expand(5, 32), items], dim=1))
+        cached = model.score_items(model.encode_users(user), model.encode_items(items))
+    assert torch.allclose(full, cached, atol=1e-5)
+
+def test_index_items_swaps_ids_and_vectors_together(tmp_path, monkeypatch):
+    import importlib
+    import threading
+    import numpy as np
+    monkeypatch.setenv('RANKER_MODEL_PATH', str(tmp_path / 'missing.pt'))
+    monkeypatch.setenv('RANKER_ARCH', 'two_tower')
+    import ml.server.ranker_model as server
+    server = importlib.reload(server)
+    client = server.app.test_client()
+    rng = np.random.default_rng(0)
+    user = rng.normal(size=32).tolist()
+    errors = []
+
+    def writer():
+        for batch in range(50):
+            items = {f'item{batch}_{k}': rng.normal(size=32).tolist() for k in range(4)}
+            client.post('/index_items', json={'items': items})
+
+    def reader():
+        for _ in range(200):
+            item_ids = list(server.ITEM_INDEX[0])
+            if item_ids:
+                response = client.post('/score', json={'user': user, 'item_ids': item_ids})
+                if response.status_code != 200 or len(response.json['scores']) != len(item_ids):
+                    errors.append(response.json)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    item_ids, item_vecs = server.ITEM_INDEX
+    assert len(item_ids) == len(item_vecs) == 200
+
+def test_index_items_rejects_empty_request(tmp_path, monkeypatch):
+    import importlib
+    import numpy as np
+    monkeypatch.setenv('RANKER_MODEL_PATH', str(tmp_path / 'missing.pt'))
+    monkeypatch.setenv('RANKER_ARCH', 'two_tower')
+    import ml.server.ranker_model as server
+    server = importlib.reload(server)
+    client = server.app.test_client()
+    item = np.random.default_rng(0).normal(size=32).tolist()
+    assert client.post('/index_items', json={'items': {'a': item}}).status_code == 200
+    for payload in ({'items': {}}, {}):
+        response = client.post('/index_items', json=payload)
+        assert response.status_code == 400
+    item_ids, item_vecs = server.ITEM_INDEX
+    assert list(item_ids) == ['a'] and len(item_vecs) == 1
@@ -0,0 +1,391 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+
+@pytest.fixture(autouse=True)
+def manifest_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    return tmp_path / 'cache' / 'closetai' / 'pair-manifests'
+
+
+@pytest.fixture
+def pairs_dir(tmp_path):
+    rng = np.random.default_rng(0)
+    tmp_path = tmp_path / 'pairs'
+    for sub in ('input', 'target'):
+        (tmp_path / sub).mkdir(parents=True)
+    for i in range(5):
+        for sub in ('input', 'target'):
+            pixels = rng.integers(0, 255, (90, 120, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(tmp_path / sub / f'{i}.png')
+    return tmp_path
+
+
+def test_packed_dataset_matches_decoded_pairs(pairs_dir, tmp_path):
+    import ml.training.train_transfer as tt
+    dataset = tt.packed_dataset(str(pairs_dir), str(tmp_path / 'packs'), image_size=32, num_workers=2)
+    pairs = tt.PairedImageDataset(str(pairs_dir), image_size=32).pairs
+    assert len(dataset) == len(pairs) == 5
+
+    input_img, target_img = dataset[3]
+    assert input_img.dtype == torch.uint8 and input_img.shape == (3, 32, 32)
+    expected = np.asarray(tt.load_resized(pairs[3][1], 32)).transpose(2, 0, 1)
+    assert np.array_equal(target_img.numpy(), expected)
+
+    batch, _ = next(iter(torch.utils.data.DataLoader(dataset, batch_size=4)))
+    scaled = tt.to_model_input(batch, torch.device('cpu'))
+    assert scaled.dtype == torch.float32 and scaled.shape == (4, 3, 32, 32)
+    assert torch.allclose(scaled * 255, batch.float())
+
+
+def test_pack_is_reused_until_pairs_change(pairs_dir, tmp_path):
+    import ml.training.train_transfer as tt
+    pack_dir = str(tmp_path / 'packs')
+    path = tt.packed_dataset(str(pairs_dir), pack_dir, image_size=16).path
+    mtime = Path(path).stat().st_mtime_ns
+    assert tt.packed_dataset(str(pairs_dir), pack_dir, image_size=16).path == path
+    assert Path(path).stat().st_mtime_ns == mtime
+
+    (pairs_dir / 'input' / '4.png').unlink()
+    assert len(tt.packed_dataset(str(pairs_dir), pack_dir, image_size=16)) == 4
+
+
+def test_packs_for_same_named_dirs_do_not_collide(pairs_dir, tmp_path):
+    import shutil
+    import ml.training.train_transfer as tt
+    pack_dir = str(tmp_path / 'packs')
+    other = tmp_path / 'val' / 'pairs'
+    shutil.copytree(pairs_dir, other)
+    (other / 'input' / '4.png').unlink()
+    first = tt.packed_dataset(str(pairs_dir), pack_dir, image_size=16)
+    second = tt.packed_dataset(str(other), pack_dir, image_size=16)
+    assert first.path != second.path
+    assert (len(first), len(second)) == (5, 4)
+    assert len(tt.packed_dataset(str(pairs_dir), pack_dir, image_size=16)) == 5
+
+
+def test_pack_with_wrong_shape_is_rebuilt(pairs_dir, tmp_path):
+    import ml.training.train_transfer as tt
+    pack_dir = str(tmp_path / 'packs')
+    path = tt.packed_dataset(str(pairs_dir), pack_dir, image_size=16).path
+    np.save(path, np.zeros((2, 2, 16, 16, 3), dtype=np.uint8))
+    dataset = tt.packed_dataset(str(pairs_dir), pack_dir, image_size=16)
+    assert len(dataset) == 5 and dataset[4][0].any()
+
+
+def test_discover_pairs_matches_both_layouts(pairs_dir):
+    import ml.training.train_transfer as tt
+    (pairs_dir / 'target' / '0.png').unlink()
+    (pairs_dir / 'input' / 'notes.txt').write_text('x')
+    (pairs_dir / 'a-input.jpg').write_bytes(b'')
+    (pairs_dir / 'a-target.jpg').write_bytes(b'')
+    (pairs_dir / 'b-input.jpg').write_bytes(b'')
+
+    pairs = tt.discover_pairs(str(pairs_dir))
+    assert pairs[:4] == [(f'input/{i}.png', f'target/{i}.png') for i in range(1, 5)]
+    assert pairs[4:] == [('a-input.jpg', 'a-target.jpg')]
+
+
+def test_manifest_cache_follows_directory_mtimes(pairs_dir, manifest_cache, monkeypatch):
+    import ml.training.train_transfer as tt
+    pairs = tt.load_pairs(str(pairs_dir))
+    assert len(pairs) == 5 and len(list(manifest_cache.iterdir())) == 1
+
+    scans = []
+    scan_names = tt._scan_names
+    monkeypatch.setattr(tt, '_scan_names', lambda d: scans.append(d) or scan_names(d))
+    assert tt.load_pairs(str(pairs_dir)) == pairs
+    assert scans == []
+
+    (pairs_dir / 'input' / '4.png').unlink()
+    assert len(tt.load_pairs(str(pairs_dir))) == 4
+    assert len(scans) == 3
+
+
+def test_prebuilt_manifest_is_trusted(pairs_dir, tmp_path):
+    import ml.training.train_transfer as tt
+    manifest = tmp_path / 'manifest.json'
+    dataset = tt.PairedImageDataset(str(pairs_dir), image_size=16, manifest=str(manifest))
+    assert manifest.exists() and len(dataset) == 5
+
+    # Used as-is even once the directory changes
+    (pairs_dir / 'input' / 'extra.png').write_bytes(b'')
+    (pairs_dir / 'target' / 'extra.png').write_bytes(b'')
+    dataset = tt.PairedImageDataset(str(pairs_dir), image_size=16, manifest=str(manifest))
+    assert len(dataset) == 5
+    assert dataset[0][0].shape == (3, 16, 16)
+
+
+def test_patch_crops_are_aligned_across_resolutions(tmp_path):
+    import ml.training.train_transfer as tt
+    gradient = np.linspace(0, 255, 400, dtype=np.float32)
+    pixels = np.stack(np.broadcast_arrays(gradient[None, :], gradient[:300, None], 128 + 0 * gradient[None, :]), -1)
+    Image.fromarray(pixels.astype(np.uint8)).save(tmp_path / 'in.png')
+    Image.fromarray(pixels.astype(np.uint8)).resize((800, 600), Image.BILINEAR).save(tmp_path / 'tgt.png')
+
+    dataset = tt.PatchPairDataset([(str(tmp_path / 'in.png'), str(tmp_path / 'tgt.png'))],
+                                  patch_size=64, patches_per_image=6, scales=(1.0, 0.5))
+    inputs, targets = dataset[0]
+    assert inputs.shape == targets.shape == (6, 3, 64, 64) and inputs.dtype == torch.uint8
+    assert (inputs.float() - targets.float()).abs().mean() < 2
+
+    batch = tt.collate_patches([dataset[0], dataset[0]])
+    assert batch[0].shape == (12, 3, 64, 64)
+
+    # Seeded (validation) crops repeat every epoch; unseeded ones do not
+    val = tt.PatchPairDataset(dataset.pairs, patch_size=64, patches_per_image=6, scales=(1.0, 0.5), seed=0)
+    assert torch.equal(val[0][0], val[0][0]) and torch.equal(val[0][1], val[0][1])
+    assert not torch.equal(dataset[0][0], dataset[0][0])
+
+
+@pytest.mark.parametrize('size', [(37, 50), (130, 200)])
+def test_tiled_inference_blends_back_to_full_size(size):
+    import ml.training.train_transfer as tt
+    image = torch.rand(2, 3, *size)
+    out = tt.tiled_inference(torch.nn.Identity(), image, tile_size=64, overlap=16, batch_size=3)
+    assert out.shape == image.shape
+    assert torch.allclose(out, image, atol=1e-6)
+
+    model = tt.RefinementUNet(base_channels=4, num_residual_blocks=1).eval()
+    refined = tt.refine_image(model, Image.fromarray(np.zeros((*size, 3), np.uint8)), torch.device('cpu'), 64, 16)
+    assert refined.size == (size[1], size[0])
+
+
+def test_refinement_unet_keeps_input_resolution():
+    import ml.training.train_transfer as tt
+    model = tt.RefinementUNet(base_channels=4, num_residual_blocks=1)
+    assert model(torch.rand(2, 3, 48, 64)).shape == (2, 3, 48, 64)
+
+
+def test_perceptual_loss_and_cache_match_separate_passes():
+    import ml.training.train_transfer as tt
+    torch.manual_seed(0)
+    loss_fn = tt.VGGPerceptualLoss(pretrained=False)
+    x, target = torch.rand(3, 3, 32, 32, requires_grad=True), torch.rand(3, 3, 32, 32)
+
+    expected, a, b = 0, x, target
+    for module in loss_fn.slice.children():
+        a, b = module(a), module(b)
+        expected += torch.nn.functional.mse_loss(a, b)
+    assert torch.allclose(loss_fn(x, target), expected, rtol=1e-5)
+    with torch.no_grad():
+        assert torch.allclose(loss_fn(x, target), expected, rtol=1e-5)
+
+    loss_fn.cache = tt.TargetFeatureCache(max_bytes=10 ** 7, dtype=torch.float32)
+    indices = torch.tensor([4, 7, 9])
+    assert torch.allclose(loss_fn(x, target, indices), expected, rtol=1e-5)
+    assert len(loss_fn.cache) == 3
+
+    # Cached targets are used as-is: the target tensor is not read again
+    cached = loss_fn(x, torch.zeros_like(target), indices)
+    assert torch.allclose(cached, expected, rtol=1e-5)
+    cached.backward()
+    assert x.grad is not None and x.grad.abs().sum() > 0
+
+
+def test_target_feature_cache_respects_budget():
+    import ml.training.train_transfer as tt
+    cache = tt.TargetFeatureCache(max_bytes=3000)
+    features = [torch.ones(4, 8, 8), torch.ones(8, 4, 4)]  # 384 values, 768 bytes as fp16
+    assert all(cache.put(i, features) for i in range(3))
+    assert not cache.put(3, features)
+    assert len(cache) == 3 and cache.nbytes == 3 * 768
+    assert cache.get(0)[0].dtype == torch.float16
+
+
+def test_activation_checkpointing_matches_plain_backward():
+    import ml.training.train_transfer as tt
+    torch.manual_seed(0)
+    plain = tt.RefinementUNet(base_channels=4, num_residual_blocks=2)
+    checkpointed = tt.RefinementUNet(base_channels=4, num_residual_blocks=2, checkpoint_activations=True)
+    checkpointed.load_state_dict(plain.state_dict())
+    x = torch.rand(2, 3, 32, 32)
+
+    for model in (plain, checkpointed):
+        model(x).square().mean().backward()
+    assert torch.allclose(plain(x), checkpointed(x), atol=1e-6)
+    for a, b in zip(plain.parameters(), checkpointed.parameters()):
+        assert torch.allclose(a.grad, b.grad, atol=1e-6)
+
+
+def _ddp_worker(rank, world_size, init_file, out_dir):
+    import os
+    import ml.training.train_transfer as tt
+    os.environ.update(WORLD_SIZE=str(world_size), RANK=str(rank), LOCAL_RANK=str(rank))
+    torch.distributed.init_process_group('gloo', init_method=f'file://{init_file}', rank=rank, world_size=world_size)
+    assert tt.setup_distributed() == (rank, world_size, rank)
+
+    torch.manual_seed(0)
+    model = tt.RefinementUNet(base_channels=4, num_residual_blocks=1, checkpoint_activations=True)
+    trainer = tt.TransferTrainer(model, device='cpu', use_amp=False, pretrained_vgg=False)
+    data = torch.utils.data.TensorDataset(torch.rand(8, 3, 32, 32), torch.rand(8, 3, 32, 32))
+    sampler = torch.utils.data.DistributedSampler(data, seed=0)
+    loader = torch.utils.data.DataLoader(data, batch_size=2, sampler=sampler)
+    assert len(loader) == 2
+
+    loss = trainer.train_epoch(loader, gradient_accumulation_steps=2)
+    trainer.save_checkpoint(os.path.join(out_dir, 'model.pt'), 0, loss)
+    torch.save(trainer.module.state_dict(), os.path.join(out_dir, f'rank{rank}.pt'))
+    torch.distributed.destroy_process_group()
+
+
+def test_ddp_ranks_stay_in_sync_and_rank0_checkpoints(tmp_path):
+    torch.multiprocessing.spawn(_ddp_worker, args=(2, str(tmp_path / 'init'), str(tmp_path)), nprocs=2)
+    states = [torch.load(tmp_path / f'rank{r}.pt') for r in range(2)]
+    # BatchNorm running stats are per rank (DDP broadcasts rank 0's each forward)
+    for key in (k for k in states[0] if 'running_' not in k and 'num_batches' not in k):
+        assert torch.equal(states[0][key], states[1][key]), key
+    checkpoint = torch.load(tmp_path / 'model.pt', weights_only=False)
+    assert checkpoint['model_state_dict'].keys() == states[0].keys()
+
+
+def _tiny_trainer(tt, **kwargs):
+    model = tt.RefinementUNet(base_channels=4, num_residual_blocks=1)
+    return tt.TransferTrainer(model, device='cpu', use_amp=False, pretrained_vgg=False, **kwargs)
+
+
+def test_resume_from_async_checkpoint_is_exact(tmp_path):
+    import ml.training.train_transfer as tt
+    data = torch.utils.data.TensorDataset(torch.rand(6, 3, 32, 32), torch.rand(6, 3, 32, 32))
+
+    def run(resume: bool):
+        tt.set_seed(0)
+        trainer = _tiny_trainer(tt)
+        loader = torch.utils.data.DataLoader(data, batch_size=2, shuffle=True)
+        trainer.train_epoch(loader, gradient_accumulation_steps=1)
+        trainer.save_checkpoint(str(tmp_path / 'checkpoint.pt'), 0, 1.0)
+        trainer.wait_for_checkpoints()
+        if resume:
+            # Same random VGG weights as above (pretrained ones are fixed anyway)
+            tt.set_seed(0)
+            trainer = _tiny_trainer(tt)
+            for param in trainer.module.parameters():
+                param.data.zero_()
+            assert trainer.load_checkpoint(str(tmp_path / 'checkpoint.pt')) == (0, 1.0)
+        trainer.train_epoch(loader, gradient_accumulation_steps=1)
+        return trainer.module.state_dict()
+
+    continuous, resumed = run(False), run(True)
+    for key in continuous:
+        assert torch.equal(continuous[key], resumed[key]), key
+
+
+def test_checkpoint_retention_and_weights_export(tmp_path):
+    import ml.training.train_transfer as tt
+    trainer = _tiny_trainer(tt, keep_last=2)
+    for epoch in range(5):
+        trainer.save_checkpoint(str(tmp_path / f'checkpoint_epoch_{epoch + 1}.pt'), epoch, 1.0, prune=True)
+    trainer.export_weights(str(tmp_path / 'best_weights.pt'), 4, 0.5)
+    trainer.wait_for_checkpoints()
+
+    assert sorted(p.name for p in tmp_path.glob('checkpoint_epoch_*')) == ['checkpoint_epoch_4.pt', 'checkpoint_epoch_5.pt']
+    assert not list(tmp_path.glob('*.tmp'))
+    weights = torch.load(tmp_path / 'best_weights.pt', weights_only=True)
+    assert set(weights) == {'epoch', 'best_loss', 'model_state_dict'}
+    assert all(t.device.type == 'cpu' for t in weights['model_state_dict'].values())
+    assert (tmp_path / 'best_weights.pt').stat().st_size < (tmp_path / 'checkpoint_epoch_5.pt').stat().st_size
+
+
+def test_step_metrics_and_profiler_trace(tmp_path):
+    import json
+    import ml.training.train_transfer as tt
+    profiler = tt.StepProfiler(1, 3, str(tmp_path / 'trace.json'), torch.device('cpu'))
+    trainer = _tiny_trainer(tt, metrics_path=str(tmp_path / 'metrics.jsonl'), metrics_window=2, profiler=profiler)
+    data = torch.utils.data.TensorDataset(torch.rand(6, 3, 32, 32), torch.rand(6, 3, 32, 32))
+    trainer.train_epoch(torch.utils.data.DataLoader(data, batch_size=2), gradient_accumulation_steps=1)
+
+    records = [json.loads(line) for line in (tmp_path / 'metrics.jsonl').read_text().splitlines()]
+    assert [(r['step'], r['steps'], r['images']) for r in records] == [(2, 2, 4), (3, 1, 2)]
+    assert set(records[0]['phase_ms']) == set(tt.TRAIN_PHASES)
+    assert records[0]['phase_ms']['forward'] > 0 and records[0]['images_per_sec'] > 0
+    assert records[0]['peak_memory_mb'] > 0
+
+    trace = json.loads((tmp_path / 'trace.json').read_text())
+    names = {event.get('name') for event in trace['traceEvents']}
+    assert {'forward', 'losses', 'backward', 'optimizer'} <= names
+
+
+def test_refine_pipeline_batches_tiles_and_exports(tmp_path):
+    import ml.training.train_transfer as tt
+    import ml.training.refine as refine
+    torch.manual_seed(0)
+    model = tt.RefinementUNet(base_channels=4, num_residual_blocks=2).eval()
+    torch.save({'epoch': 0, 'best_loss': 1.0, 'model_state_dict': model.state_dict()}, tmp_path / 'weights.pt')
+    loaded = tt.load_refinement_model(str(tmp_path / 'weights.pt'))
+    assert len(loaded.res_blocks) == 2 and loaded.conv_in.out_channels == 4
+
+    inputs = tmp_path / 'in'
+    inputs.mkdir()
+    rng = np.random.default_rng(0)
+    sizes = {'a.png': (30, 40), 'b.png': (30, 40), 'c.png': (30, 40), 'd.jpg': (20, 20), 'big.png': (100, 150)}
+    for name, (h, w) in sizes.items():
+        Image.fromarray(rng.integers(0, 255, (h, w, 3), dtype=np.uint8)).save(inputs / name)
+    (inputs / 'broken.png').write_bytes(b'not an image')
+
+    pipeline = refine.RefinePipeline(loaded, tile_size=64, overlap=16, batch_size=2, workers=2)
+    records = pipeline.run(refine.list_images(str(inputs)), str(tmp_path / 'out'))
+    by_name = {Path(r['input']).name: r for r in records}
+    assert 'error' in by_name.pop('broken.png')
+    for name, (h, w) in sizes.items():
+        assert Image.open(tmp_path / 'out' / name).size == (w, h)
+    assert sorted(r['batch'] for r in by_name.values()) == [1, 1, 1, 2, 2]
+
+    with torch.no_grad():
+        x = torch.from_numpy(np.array(Image.open(inputs / 'a.png'))).permute(2, 0, 1)[None].float() / 255
+        expected = refine.forward_padded(model, x)[0].clamp(0, 1).mul(255).round().byte().permute(1, 2, 0).numpy()
+    assert np.array_equal(np.array(Image.open(tmp_path / 'out' / 'a.png')), expected)
+
+    summary = refine.summarize(records, 1.0)
+    assert summary['images'] == 5 and summary['failed'] == 1 and summary['latency_ms']['p95'] > 0
+
+    # Same names from different directories, and an image that cannot be saved
+    other = tmp_path / 'other'
+    other.mkdir()
+    Image.fromarray(rng.integers(0, 255, (30, 40, 3), dtype=np.uint8)).save(other / 'a.png')
+    (other / 'a.unknown').write_bytes((other / 'a.png').read_bytes())
+    paths = [str(inputs / 'a.png'), str(other / 'a.png'), str(other / 'a.unknown'), str(inputs / 'b.png')]
+    records = pipeline.run(paths, str(tmp_path / 'mixed'))
+    assert [Path(r.get('output', '')).name for r in records if 'error' not in r] == ['a.png', 'a-1.png', 'b.png']
+    assert [r.get('renamed_from') for r in records if 'error' not in r] == [None, 'a.png', None]
+    assert [r['input'] for r in records if 'error' in r] == [str(other / 'a.unknown')]
+    assert np.array_equal(np.array(Image.open(tmp_path / 'mixed' / 'a.png')), expected)
+    assert refine.summarize(records, 1.0)['failed'] == 1
+
+    refine.export_torchscript(loaded, str(tmp_path / 'model.ts'), image_size=32)
+    scripted = torch.jit.load(str(tmp_path / 'model.ts'))
+    x = torch.rand(2, 3, 48, 40)
+    with torch.no_grad():
+        assert torch.allclose(scripted(x), loaded(x), atol=1e-5)
+
+
+def test_separable_student_round_trips_and_distills(tmp_path):
+    import ml.training.train_transfer as tt
+    import ml.training.refine as refine
+    torch.manual_seed(0)
+    dense = tt.RefinementUNet(base_channels=8, num_residual_blocks=2)
+    student = tt.RefinementUNet(base_channels=8, num_residual_blocks=2, separable=True)
+    x = torch.rand(2, 3, 32, 40)
+    assert student(x).shape == x.shape
+    count = lambda m: sum(p.numel() for p in m.parameters())
+    assert count(student) < count(dense) / 2
+
+    torch.save({'epoch': 0, 'model_state_dict': student.state_dict()}, tmp_path / 'student.pt')
+    loaded = tt.load_refinement_model(str(tmp_path / 'student.pt'))
+    assert loaded.separable and len(loaded.res_blocks) == 2
+    student.eval()
+    with torch.no_grad():
+        assert torch.allclose(loaded(x), student(x))
+
+    teacher = tt.RefinementUNet(base_channels=4, num_residual_blocks=1)
+    teacher_state = {k: v.clone() for k, v in teacher.state_dict().items()}
+    trainer = _tiny_trainer(tt, teacher=teacher, distill_weight=0.5)
+    data = torch.utils.data.TensorDataset(torch.rand(4, 3, 32, 32), torch.rand(4, 3, 32, 32))
+    before = {k: v.clone() for k, v in trainer.module.state_dict().items()}
+    trainer.train_epoch(torch.utils.data.DataLoader(data, batch_size=2), gradient_accumulation_steps=1)
+    assert not trainer.teacher.training
+    assert all(torch.equal(v, teacher_state[k]) for k, v in trainer.teacher.state_dict().items())
+    assert any(not torch.equal(v, before[k]) for k, v in trainer.module.state_dict().items())
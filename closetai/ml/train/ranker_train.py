@@ -1,8 +1,15 @@
 """
-Train a tiny MLP ranker using synthetic demo data.
+Train a tiny ranker using synthetic demo data.
 Produces ml/models/ranker_demo.pt
+
+Architectures (select with --arch):
+  mlp        full MLP over the concatenated (user, item) vector
+  two_tower  separate user/item towers joined by a dot product; item
+             vectors can be precomputed so scoring is a matrix-vector product
+  fm         factorization machine (linear + pairwise factor interactions)
 """
 import os
+import argparse
 import json
 import random
 import numpy as np
@@ -38,16 +45,65 @@ class MLP(nn.Module):
         self.net = nn.Sequential(nn.Linear(inp,128), nn.ReLU(), nn.Dropout(0.1), nn.Linear(128,64), nn.ReLU(), nn.Linear(64,1))
     def forward(self,x): return self.net(x).squeeze(-1)
 
-def train():
+class TwoTower(nn.Module):
+    """User and item towers whose embeddings are joined by a dot product.
+    Item embeddings do not depend on the user, so they can be computed once
+    with encode_items() and reused for every request."""
+    def __init__(self, inp=64, user_dim=32, emb=32):
+        super().__init__()
+        self.user_dim = user_dim
+        item_dim = inp - user_dim
+        self.user_tower = nn.Sequential(nn.Linear(user_dim,64), nn.ReLU(), nn.Linear(64,emb))
+        self.item_tower = nn.Sequential(nn.Linear(item_dim,64), nn.ReLU(), nn.Linear(64,emb))
+        self.bias = nn.Parameter(torch.zeros(1))
+    def encode_users(self,u): return self.user_tower(u)
+    def encode_items(self,i): return self.item_tower(i)
+    def score_items(self, user_vec, item_vecs):
+        """Score cached item embeddings (N, emb) against one user embedding (emb,)."""
+        return item_vecs @ user_vec + self.bias
+    def forward(self,x):
+        u = self.encode_users(x[:, :self.user_dim])
+        i = self.encode_items(x[:, self.user_dim:])
+        return (u*i).sum(-1) + self.bias
+
+class FactorizationMachine(nn.Module):
+    """Second-order FM over the dense (user, item) feature vector, using the
+    O(n*k) identity sum_{i<j} <v_i,v_j> x_i x_j = 0.5*((xV)^2 - x^2 V^2)."""
+    def __init__(self, inp=64, k=16):
+        super().__init__()
+        self.linear = nn.Linear(inp,1)
+        self.V = nn.Parameter(0.01*torch.randn(inp,k))
+    def forward(self,x):
+        xv = x @ self.V
+        pair = 0.5*(xv.pow(2) - (x.pow(2) @ self.V.pow(2))).sum(-1)
+        return self.linear(x).squeeze(-1) + pair
+
+MODELS = {'mlp': MLP, 'two_tower': TwoTower, 'fm': FactorizationMachine}
+
+def build_model(arch='mlp'):
+    if arch not in MODELS:
+        raise ValueError(f"Unknown ranker arch: {arch} (choose from {', '.join(MODELS)})")
+    return MODELS[arch]()
+
+def load_model(path):
+    """Load a ranker checkpoint. Plain state dicts from older runs are MLPs."""
+    ckpt = torch.load(path, map_location='cpu')
+    arch = ckpt.get('arch', 'mlp') if isinstance(ckpt, dict) else 'mlp'
+    state = ckpt['state_dict'] if 'state_dict' in ckpt else ckpt
+    model = build_model(arch)
+    model.load_state_dict(state)
+    return model, arch
+
+def train(arch='mlp', epochs=10, out=None):
     X,y = synth_data(2000)
     X_train, X_val, y_train, y_val = train_test_split(X,y,test_size=0.2)
     ds_train = RankerDataset(X_train,y_train)
     ds_val = RankerDataset(X_val,y_val)
     dl = DataLoader(ds_train, batch_size=64, shuffle=True)
-    model = MLP()
+    model = build_model(arch)
     opt = torch.optim.Adam(model.parameters(), lr=1e-3)
     loss_fn = nn.BCEWithLogitsLoss()
-    for epoch in range(10):
+    for epoch in range(epochs):
         model.train()
         total=0; los=0
         for xb,yb in dl:
@@ -57,8 +113,15 @@ def train():
             opt.zero_grad(); loss.backward(); opt.step()
             total+=len(xb); los+=loss.item()*len(xb)
         print('epoch',epoch,'loss',los/total)
-    torch.save(model.state_dict(), os.path.join(MODEL_DIR,'ranker_demo.pt'))
-    print('Saved model to', os.path.join(MODEL_DIR,'ranker_demo.pt'))
+    out = out or os.path.join(MODEL_DIR,'ranker_demo.pt')
+    torch.save({'arch': arch, 'state_dict': model.state_dict()}, out)
+    print('Saved', arch, 'model to', out)
+    return model
 
 if __name__=='__main__':
-    train()
+    ap = argparse.ArgumentParser(description='Train the demo ranker')
+    ap.add_argument('--arch', choices=sorted(MODELS), default='mlp')
+    ap.add_argument('--epochs', type=int, default=10)
+    ap.add_argument('--out', default=None, help='checkpoint path (default ml/models/ranker_demo.pt)')
+    a = ap.parse_args()
+    train(a.arch, a.epochs, a.out)
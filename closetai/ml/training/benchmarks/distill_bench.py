@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Latency/quality trade-off of distilled RefinementUNet students against
+their teacher.
+
+For the teacher and each student it reports parameters and batch-1 CPU
+latency. With --data-dir it also reports L1 (and LPIPS, if installed)
+against the ground truth and against the teacher's output. Students are
+checkpoints from `train_transfer.py --teacher ...`, or CHANNELSxBLOCKS
+specs (e.g. 16x2) for randomly initialised separable students, which
+measures latency only.
+
+Usage:
+    python ml/training/benchmarks/distill_bench.py --students 16x2,24x3,32x3
+    python ml/training/benchmarks/distill_bench.py --teacher outputs/best_model.pt \\
+        --students outputs/s16/best_model.pt,outputs/s32/best_model.pt --data-dir ./data/val
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from train_transfer import (  # noqa: E402
+    LPIPS_AVAILABLE, PairedImageDataset, RefinementUNet, load_refinement_model, to_model_input
+)
+
+if LPIPS_AVAILABLE:
+    import lpips
+
+
+def build(spec: str, device: str) -> RefinementUNet:
+    if spec.endswith('.pt'):
+        return load_refinement_model(spec, device)
+    channels, blocks = (int(v) for v in spec.lower().split('x'))
+    return RefinementUNet(base_channels=channels, num_residual_blocks=blocks, separable=True).to(device).eval()
+
+
+@torch.no_grad()
+def latency_ms(model: RefinementUNet, image_size: int, runs: int) -> float:
+    x = torch.rand(1, 3, image_size, image_size)
+    model(x)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model(x)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000
+
+
+@torch.no_grad()
+def quality(model, teacher, loader, lpips_fn) -> dict:
+    totals = {'l1_gt': 0.0, 'l1_teacher': 0.0, 'lpips_gt': 0.0, 'lpips_teacher': 0.0}
+    count = 0
+    for input_img, target_img in loader:
+        input_img = to_model_input(input_img, torch.device('cpu'))
+        target_img = to_model_input(target_img, torch.device('cpu'))
+        output, reference = model(input_img), teacher(input_img)
+        n = len(input_img)
+        totals['l1_gt'] += F.l1_loss(output, target_img).item() * n
+        totals['l1_teacher'] += F.l1_loss(output, reference).item() * n
+        if lpips_fn is not None:
+            totals['lpips_gt'] += lpips_fn(output * 2 - 1, target_img * 2 - 1).mean().item() * n
+            totals['lpips_teacher'] += lpips_fn(output * 2 - 1, reference * 2 - 1).mean().item() * n
+        count += n
+    return {k: v / count for k, v in totals.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark distilled students')
+    parser.add_argument('--teacher', default=None, help='Teacher checkpoint (default: random 64x9)')
+    parser.add_argument('--students', default='16x2,24x3,32x3')
+    parser.add_argument('--data-dir', default=None, help='Paired validation data for quality metrics')
+    parser.add_argument('--image-size', type=int, default=512)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=0, help='torch intra-op threads (0: default)')
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    teacher = build(args.teacher, 'cpu') if args.teacher else RefinementUNet().eval()
+    models = [('teacher', teacher)] + [(spec, build(spec, 'cpu')) for spec in args.students.split(',')]
+
+    loader = lpips_fn = None
+    if args.data_dir:
+        dataset = PairedImageDataset(args.data_dir, image_size=args.image_size)
+        loader = DataLoader(dataset, batch_size=4)
+        lpips_fn = lpips.LPIPS(net='alex').eval() if LPIPS_AVAILABLE else None
+
+    print(f'batch 1 at {args.image_size}px on cpu ({torch.get_num_threads()} threads)')
+    base = None
+    for name, model in models:
+        params = sum(p.numel() for p in model.parameters()) / 1e6
+        ms = latency_ms(model, args.image_size, args.runs)
+        base = base or ms
+        line = f'{os.path.basename(name):24s} {params:7.2f} M params  {ms:8.1f} ms  ({base / ms:5.1f}x)'
+        if loader is not None:
+            q = quality(model, teacher, loader, lpips_fn)
+            line += f"  L1 gt {q['l1_gt']:.4f}  L1 teacher {q['l1_teacher']:.4f}"
+            if lpips_fn is not None:
+                line += f"  LPIPS gt {q['lpips_gt']:.4f}  LPIPS teacher {q['lpips_teacher']:.4f}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark training data loading: PairedImageDataset (decode + resize per
+sample) against PackedPairDataset (memory-mapped uint8 pack).
+
+Writes a synthetic paired set of phone-sized JPEGs unless --data-dir is
+given, packs it once (timed separately), then reports loader images/sec
+for each dataset with the same DataLoader settings.
+
+Usage:
+    python ml/training/benchmarks/loader_bench.py
+    python ml/training/benchmarks/loader_bench.py --data-dir ./data/pairs --num-workers 8
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+from torch.utils.data import DataLoader
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from train_transfer import PairedImageDataset, packed_dataset  # noqa: E402
+
+
+def synthetic_pairs(root: str, count: int, size: tuple) -> None:
+    rng = np.random.default_rng(0)
+    for sub in ('input', 'target'):
+        os.makedirs(os.path.join(root, sub), exist_ok=True)
+    for i in range(count):
+        small = rng.integers(0, 255, (12, 9, 3), dtype=np.uint8)
+        image = Image.fromarray(small).resize(size, Image.BILINEAR)
+        for sub in ('input', 'target'):
+            image.save(os.path.join(root, sub, f'{i:05d}.jpg'), quality=90)
+
+
+def images_per_second(dataset, args) -> float:
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=True,
+                        num_workers=args.num_workers, pin_memory=False)
+    start = time.perf_counter()
+    count = 0
+    for _ in range(args.epochs):
+        for input_img, _ in loader:
+            count += 2 * len(input_img)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark paired data loading')
+    parser.add_argument('--data-dir', default=None)
+    parser.add_argument('--pairs', type=int, default=64)
+    parser.add_argument('--source-size', default='3024x4032', help='WIDTHxHEIGHT of synthetic photos')
+    parser.add_argument('--image-size', type=int, default=512)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--num-workers', type=int, default=4)
+    parser.add_argument('--epochs', type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir
+        if data_dir is None:
+            data_dir = os.path.join(tmp, 'pairs')
+            synthetic_pairs(data_dir, args.pairs, tuple(int(v) for v in args.source_size.split('x')))
+
+        raw = PairedImageDataset(data_dir, image_size=args.image_size)
+        start = time.perf_counter()
+        packed = packed_dataset(data_dir, os.path.join(tmp, 'packs'), args.image_size, args.num_workers * 2)
+        pack_seconds = time.perf_counter() - start
+
+        print(f'{len(raw)} pairs at {args.image_size}px, {args.num_workers} workers, batch {args.batch_size}')
+        print(f'pack once             {pack_seconds:8.1f} s')
+        print(f'PairedImageDataset    {images_per_second(raw, args):8.1f} img/s')
+        print(f'PackedPairDataset     {images_per_second(packed, args):8.1f} img/s')
+
+
+if __name__ == '__main__':
+    main()
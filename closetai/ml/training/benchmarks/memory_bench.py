@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark RefinementUNet training memory and throughput with and without
+activation checkpointing, and the largest batch (and effective batch under
+DDP) that fits a memory budget.
+
+Each (mode, batch size) runs forward + L1 backward in a fresh process.
+Peak memory is torch.cuda.max_memory_allocated on GPU and the growth of
+peak RSS on CPU. Per-sample activation memory is the slope between the
+two largest batch sizes.
+
+Usage:
+    python ml/training/benchmarks/memory_bench.py
+    python ml/training/benchmarks/memory_bench.py --device cuda --image-size 512 --memory-gb 24 --world-size 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from train_transfer import RefinementUNet  # noqa: E402
+
+
+def peak_bytes(device: torch.device) -> int:
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(checkpointing: bool, batch_size: int, args, queue) -> None:
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+    model = RefinementUNet(checkpoint_activations=checkpointing).to(device).train()
+    x = torch.rand(batch_size, 3, args.image_size, args.image_size, device=device)
+    target = torch.rand_like(x)
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    baseline = peak_bytes(device) if device.type == 'cpu' else torch.cuda.memory_allocated(device)
+
+    start = None
+    for step in range(args.steps + 1):
+        if step == 1:
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+        model.zero_grad(set_to_none=True)
+        F.l1_loss(model(x), target).backward()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    seconds = time.perf_counter() - start
+    queue.put((peak_bytes(device) - baseline, batch_size * args.steps / seconds))
+
+
+def run(checkpointing: bool, batch_size: int, args):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=measure, args=(checkpointing, batch_size, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark activation checkpointing')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--image-size', type=int, default=256)
+    parser.add_argument('--batch-sizes', default='1,2,4')
+    parser.add_argument('--steps', type=int, default=2)
+    parser.add_argument('--memory-gb', type=float, default=16, help='Per-device budget for the max-batch estimate')
+    parser.add_argument('--world-size', type=int, default=1, help='DDP ranks for the effective-batch estimate')
+    parser.add_argument('--grad-accum-steps', type=int, default=4)
+    args = parser.parse_args()
+    batch_sizes = [int(v) for v in args.batch_sizes.split(',')]
+
+    print(f'RefinementUNet at {args.image_size}px on {args.device}, forward + backward')
+    budget = args.memory_gb * 1024 ** 3
+    for checkpointing in (False, True):
+        results = [run(checkpointing, b, args) for b in batch_sizes]
+        label = 'checkpointed' if checkpointing else 'plain'
+        for batch_size, (peak, throughput) in zip(batch_sizes, results):
+            print(f'{label:13s} batch {batch_size:3d}  peak {peak / 2 ** 20:8.0f} MiB  {throughput:7.2f} img/s')
+        (b0, (m0, _)), (b1, (m1, _)) = list(zip(batch_sizes, results))[-2:]
+        per_sample = max((m1 - m0) / (b1 - b0), 1)
+        max_batch = max(0, int((budget - (m1 - per_sample * b1)) // per_sample))
+        effective = max_batch * args.world_size * args.grad_accum_steps
+        print(f'{label:13s} {per_sample / 2 ** 20:.0f} MiB/sample -> batch {max_batch} in '
+              f'{args.memory_gb:g} GB, effective batch {effective} '
+              f'({args.world_size} ranks x {args.grad_accum_steps} accumulation steps)')
+
+
+if __name__ == '__main__':
+    main()
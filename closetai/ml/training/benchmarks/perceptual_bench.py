@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark one perceptual-loss step (VGG forward + backward into the model
+output): separate VGG passes on output and target as before, one
+concatenated pass (which also backpropagates through the target rows),
+VGGPerceptualLoss as it is now (target under no_grad) and a warm
+TargetFeatureCache.
+
+VGG weights are randomly initialised (timing does not depend on them), so
+this runs offline.
+
+Usage:
+    python ml/training/benchmarks/perceptual_bench.py
+    python ml/training/benchmarks/perceptual_bench.py --device cuda --image-size 512 --batch-size 8
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from train_transfer import TargetFeatureCache, VGGPerceptualLoss  # noqa: E402
+
+
+def concatenated_pass(loss_fn: VGGPerceptualLoss, x: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+    loss = 0
+    for f in loss_fn.features(torch.cat([x, target])):
+        loss += F.mse_loss(f[:len(x)], f[len(x):])
+    return loss
+
+
+def separate_passes(loss_fn: VGGPerceptualLoss, x: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+    loss = 0
+    for module in loss_fn.slice.children():
+        x = module(x)
+        target = module(target)
+        loss += F.mse_loss(x, target)
+    return loss
+
+
+def ms_per_step(step, x: torch.Tensor, args) -> float:
+    for _ in range(args.warmup):
+        step().backward()
+    if x.is_cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        x.grad = None
+        step().backward()
+    if x.is_cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / args.steps * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the VGG perceptual loss')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--image-size', type=int, default=256)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    loss_fn = VGGPerceptualLoss(pretrained=False).to(device)
+    shape = (args.batch_size, 3, args.image_size, args.image_size)
+    x = torch.rand(shape, device=device, requires_grad=True)
+    target = torch.rand(shape, device=device)
+    indices = torch.arange(args.batch_size)
+
+    separate = ms_per_step(lambda: separate_passes(loss_fn, x, target), x, args)
+    concatenated = ms_per_step(lambda: concatenated_pass(loss_fn, x, target), x, args)
+    current = ms_per_step(lambda: loss_fn(x, target), x, args)
+    loss_fn.cache = TargetFeatureCache(max_bytes=2 ** 40, device=args.device)
+    cached = ms_per_step(lambda: loss_fn(x, target, indices), x, args)
+
+    print(f'batch {args.batch_size} at {args.image_size}px on {device}, forward + backward per step')
+    print(f'separate passes       {separate:8.1f} ms')
+    print(f'concatenated pass     {concatenated:8.1f} ms  ({separate - concatenated:+.1f} ms saved)')
+    print(f'no_grad target        {current:8.1f} ms  ({separate - current:+.1f} ms saved)')
+    print(f'cached targets        {cached:8.1f} ms  ({separate - cached:+.1f} ms saved)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Inference and export for the refinement model trained by train_transfer.py.
+
+Loads RefinementUNet weights (best_model.pt, best_weights.pt or a bare
+state dict) without unpickling code, refines a directory or a stream of
+image paths, and optionally exports TorchScript or ONNX.
+
+Images are decoded and encoded on worker threads while the model runs.
+Same-size images are batched together, and images larger than a tile go
+through overlapping tiled inference. Per-image latency and overall
+throughput are reported at the end.
+
+Usage:
+    python refine.py --weights outputs/best_model.pt --input ./provider --output ./refined
+    find ./provider -name '*.jpg' | python refine.py --weights outputs/best_weights.pt --input - --output ./refined
+    python refine.py --weights outputs/best_model.pt --export-torchscript refine.ts --export-onnx refine.onnx
+
+@author: R&D Team
+@date: 2024
+"""
+
+import os
+import sys
+import argparse
+import json
+import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from PIL import Image
+
+try:
+    from .train_transfer import load_refinement_model, tiled_inference, to_model_input
+except ImportError:
+    from train_transfer import load_refinement_model, tiled_inference, to_model_input
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+# ============================================================================
+# Model Loading and Export
+# ============================================================================
+
+def export_torchscript(model: nn.Module, path: str, image_size: int = 512) -> None:
+    """Trace ``model`` to TorchScript (any batch size and spatial size divisible by 8)."""
+    example = torch.rand(1, 3, image_size, image_size, device=next(model.parameters()).device)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    traced.save(path)
+
+
+def export_onnx(model: nn.Module, path: str, image_size: int = 512, opset: int = 17) -> None:
+    """Export ``model`` to ONNX with dynamic batch, height and width (needs the onnx package)."""
+    example = torch.rand(1, 3, image_size, image_size, device=next(model.parameters()).device)
+    dynamic = {0: 'batch', 2: 'height', 3: 'width'}
+    torch.onnx.export(
+        model, example, path,
+        input_names=['input'], output_names=['output'],
+        dynamic_axes={'input': dynamic, 'output': dynamic},
+        opset_version=opset,
+    )
+
+
+# ============================================================================
+# Inference
+# ============================================================================
+
+@torch.no_grad()
+def forward_padded(model: nn.Module, batch: torch.Tensor) -> torch.Tensor:
+    """Run ``model`` on a batch padded to a multiple of 8 (three poolings), cropped back."""
+    height, width = batch.shape[-2:]
+    pad_h, pad_w = -height % 8, -width % 8
+    if pad_h or pad_w:
+        mode = 'reflect' if pad_h < height and pad_w < width else 'replicate'
+        batch = F.pad(batch, (0, pad_w, 0, pad_h), mode=mode)
+    return model(batch)[:, :, :height, :width]
+
+
+def list_images(input_path: str) -> Iterator[str]:
+    """Image paths in a directory (sorted), or one path per line from stdin for ``-``."""
+    if input_path == '-':
+        for line in sys.stdin:
+            if line.strip():
+                yield line.strip()
+        return
+    for path in sorted(Path(input_path).iterdir()):
+        if path.suffix.lower() in IMAGE_SUFFIXES:
+            yield str(path)
+
+
+def _decode(path: str) -> Tuple[str, Optional[np.ndarray], float, Optional[str]]:
+    start = time.perf_counter()
+    try:
+        with Image.open(path) as img:
+            pixels = np.array(img.convert('RGB'))
+        return path, pixels, start, None
+    except Exception as e:
+        return path, None, start, str(e)
+
+
+class RefinePipeline:
+    """
+    Decode -> batched/tiled refine -> encode, with decode and encode on
+    ``workers`` threads each so they overlap the model.
+
+    Images no larger than ``tile_size`` on either side are grouped by exact
+    size into batches of up to ``batch_size``. Larger ones run alone through
+    ``tiled_inference``. At most ``prefetch`` images are buffered ahead of
+    the model.
+
+    Outputs keep the input file names. When two inputs share a name (paths
+    from several directories on stdin), later ones get a ``-N`` suffix and
+    their records note the original name under ``renamed_from``.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        device: str = 'cpu',
+        tile_size: int = 512,
+        overlap: int = 64,
+        batch_size: int = 4,
+        workers: int = 4,
+        prefetch: Optional[int] = None,
+        half: bool = False
+    ):
+        self.model = model
+        self.device = torch.device(device)
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.workers = workers
+        self.prefetch = prefetch or batch_size * 4
+        self.half = half and self.device.type == 'cuda'
+
+    def _refine(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        batch = torch.from_numpy(np.stack(images)).permute(0, 3, 1, 2)
+        batch = to_model_input(batch, self.device)
+        with torch.autocast('cuda', dtype=torch.float16) if self.half else nullcontext():
+            height, width = batch.shape[-2:]
+            if max(height, width) > self.tile_size:
+                out = tiled_inference(self.model, batch, self.tile_size, self.overlap, self.batch_size)
+            else:
+                out = forward_padded(self.model, batch)
+        out = out.float().clamp(0, 1).mul(255).round().byte().permute(0, 2, 3, 1)
+        return list(out.cpu().numpy())
+
+    def run(self, paths: Iterable[str], output_dir: str) -> List[Dict]:
+        """
+        Refine ``paths`` into ``output_dir``; returns one record per image.
+        Images that fail to decode or to save get an ``error`` record.
+        """
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        records = []
+        used_names = set()
+
+        def output_path(path: str, record: Dict) -> str:
+            name = os.path.basename(path)
+            stem, suffix = os.path.splitext(name)
+            unique, n = name, 0
+            while unique in used_names:
+                n += 1
+                unique = f'{stem}-{n}{suffix}'
+            used_names.add(unique)
+            if unique != name:
+                record['renamed_from'] = name
+            return os.path.join(output_dir, unique)
+
+        def encode(path: str, pixels: np.ndarray, record: Dict) -> Dict:
+            start = time.perf_counter()
+            try:
+                Image.fromarray(pixels).save(record['output'], quality=95)
+            except Exception as e:
+                record.pop('_start')
+                return {**record, 'error': str(e)}
+            record['encode_ms'] = (time.perf_counter() - start) * 1000
+            record['latency_ms'] = (time.perf_counter() - record.pop('_start')) * 1000
+            return record
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='decode') as decoder, \
+                ThreadPoolExecutor(self.workers, thread_name_prefix='encode') as encoder:
+            decoding = deque()
+            groups: Dict[Tuple[int, ...], List] = {}
+            encoding = []
+            buffered = 0
+
+            def refine(group: List) -> None:
+                start = time.perf_counter()
+                outputs = self._refine([pixels for _, pixels, _ in group])
+                compute_ms = (time.perf_counter() - start) * 1000 / len(group)
+                for (path, _, record), out in zip(group, outputs):
+                    record.update(compute_ms=compute_ms, batch=len(group))
+                    encoding.append(encoder.submit(encode, path, out, record))
+
+            def flush(key) -> None:
+                nonlocal buffered
+                group = groups.pop(key)
+                buffered -= len(group)
+                refine(group)
+
+            def take(future) -> None:
+                nonlocal buffered
+                path, pixels, start, error = future.result()
+                record = {'input': path, '_start': start, 'decode_ms': (time.perf_counter() - start) * 1000}
+                if error is not None:
+                    record.pop('_start')
+                    records.append({**record, 'error': error})
+                    return
+                record['size'] = [pixels.shape[1], pixels.shape[0]]
+                record['output'] = output_path(path, record)
+                key = pixels.shape[:2]
+                # Large images are tiled alone; small ones batch by exact size
+                if max(key) > self.tile_size:
+                    refine([(path, pixels, record)])
+                    return
+                groups.setdefault(key, []).append((path, pixels, record))
+                buffered += 1
+                if len(groups[key]) >= self.batch_size:
+                    flush(key)
+                elif buffered >= self.prefetch:
+                    flush(max(groups, key=lambda k: len(groups[k])))
+
+            for path in paths:
+                decoding.append(decoder.submit(_decode, path))
+                if len(decoding) >= self.prefetch:
+                    take(decoding.popleft())
+            while decoding:
+                take(decoding.popleft())
+            for key in list(groups):
+                flush(key)
+            records.extend(future.result() for future in encoding)
+        return records
+
+
+def summarize(records: List[Dict], seconds: float) -> Dict:
+    """Throughput and per-image latency percentiles for ``RefinePipeline.run`` records."""
+    done = [r for r in records if 'error' not in r]
+    summary = {'images': len(done), 'failed': len(records) - len(done), 'seconds': round(seconds, 3)}
+    if done:
+        summary['images_per_sec'] = round(len(done) / seconds, 2)
+        for field in ('latency_ms', 'decode_ms', 'compute_ms', 'encode_ms'):
+            values = np.array([r[field] for r in done])
+            summary[field] = {
+                'p50': round(float(np.percentile(values, 50)), 2),
+                'p95': round(float(np.percentile(values, 95)), 2),
+                'max': round(float(values.max()), 2),
+            }
+    return summary
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Refine images with a trained RefinementUNet, or export it"
+    )
+
+    parser.add_argument(
+        '--weights',
+        type=str,
+        required=True,
+        help='best_model.pt, best_weights.pt or a state dict'
+    )
+    parser.add_argument(
+        '--input',
+        type=str,
+        default=None,
+        help="Directory of images, or '-' to read image paths from stdin"
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default='./refined',
+        help='Directory for refined images (same file names, -N suffix on duplicates)'
+    )
+    parser.add_argument(
+        '--device',
+        type=str,
+        default='cuda',
+        help='Device to use (cuda/cpu)'
+    )
+    parser.add_argument(
+        '--tile-size',
+        type=int,
+        default=512,
+        help='Images larger than this on either side are refined in overlapping tiles'
+    )
+    parser.add_argument(
+        '--overlap',
+        type=int,
+        default=64,
+        help='Tile overlap in pixels, blended linearly'
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=4,
+        help='Same-size images (or tiles) per forward pass'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Decode threads and encode threads'
+    )
+    parser.add_argument(
+        '--half',
+        action='store_true',
+        help='fp16 autocast on CUDA'
+    )
+    parser.add_argument(
+        '--report',
+        type=str,
+        default=None,
+        help='Write one JSON line per image (latency breakdown) here'
+    )
+    parser.add_argument(
+        '--export-torchscript',
+        type=str,
+        default=None,
+        help='Write a traced TorchScript model here'
+    )
+    parser.add_argument(
+        '--export-onnx',
+        type=str,
+        default=None,
+        help='Write an ONNX model with dynamic batch/height/width here'
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point."""
+    args = parse_args()
+    device = args.device if torch.cuda.is_available() else 'cpu'
+    model = load_refinement_model(args.weights, device)
+
+    if args.export_torchscript:
+        export_torchscript(model, args.export_torchscript, args.tile_size)
+        print(f"TorchScript model saved to {args.export_torchscript}")
+    if args.export_onnx:
+        export_onnx(model, args.export_onnx, args.tile_size)
+        print(f"ONNX model saved to {args.export_onnx}")
+    if not args.input:
+        return
+
+    pipeline = RefinePipeline(
+        model,
+        device=device,
+        tile_size=args.tile_size,
+        overlap=args.overlap,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        half=args.half
+    )
+    start = time.perf_counter()
+    records = pipeline.run(list_images(args.input), args.output)
+    summary = summarize(records, time.perf_counter() - start)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+    for record in records:
+        if 'error' in record:
+            print(f"Failed {record['input']}: {record['error']}")
+        elif 'renamed_from' in record:
+            print(f"Saved {record['input']} as {record['output']} (name already used)")
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,11 @@ Trains a refinement model to improve Perfect API outputs using:
 Usage:
     python train_transfer.py --config config.yaml
     python train_transfer.py --data-dir ./pairs --epochs 100 --batch-size 4
+    python train_transfer.py --data-dir ./pairs --pack-dir ./packed  # decode once, train from memmap
+    python train_transfer.py --data-dir /mnt/pairs --manifest /mnt/pairs.json  # prebuilt pair list
+    python train_transfer.py --data-dir ./pairs --patch-size 256 --patch-scales 1.0,0.5  # full-res crops
+    torchrun --nproc_per_node 4 train_transfer.py --data-dir ./pairs --checkpoint-activations  # DDP
+    python train_transfer.py --data-dir ./pairs --teacher outputs/best_model.pt --student-channels 16  # distill
 
 @author: R&D Team
 @date: 2024
@@ -22,18 +27,28 @@ import argparse
 import yaml
 import json
 import random
+import hashlib
+import re
+import resource
+import time
 import numpy as np
 from pathlib import Path
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torch.utils.data import Dataset, DataLoader
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.checkpoint import checkpoint
+from torch.utils.data import Dataset, DataLoader, DistributedSampler
 from torch.cuda.amp import GradScaler, autocast
 from torch.optim import AdamW
 from torch.optim.lr_scheduler import CosineAnnealingWarmRestarts
+from torch.profiler import ProfilerActivity, profile, record_function
 from torchvision import models, transforms
 from PIL import Image
 import cv2
@@ -107,10 +122,21 @@ class RefinementUNet(nn.Module):
         in_channels: int = 3, 
         out_channels: int = 3,
         base_channels: int = 64,
-        num_residual_blocks: int = 9
+        num_residual_blocks: int = 9,
+        checkpoint_activations: bool = False,
+        separable: bool = False
     ):
         super().__init__()
         
+        # Depthwise-separable 3x3 convs inside the blocks (lightweight
+        # students); conv_in/conv_out stay dense
+        self.separable = separable
+        
+        # Recompute encoder and residual activations in backward instead of
+        # storing them (training only). BatchNorm running stats see those
+        # stages twice per step.
+        self.checkpoint_activations = checkpoint_activations
+        
         # Initial convolution
         self.conv_in = nn.Conv2d(in_channels, base_channels, kernel_size=3, padding=1)
         
@@ -139,54 +165,71 @@ class RefinementUNet(nn.Module):
         self.pool = nn.MaxPool2d(2)
         self.upsample = nn.Upsample(scale_factor=2, mode='bilinear', align_corners=True)
         
+    def _conv(self, in_ch: int, out_ch: int) -> nn.Module:
+        if not self.separable:
+            return nn.Conv2d(in_ch, out_ch, kernel_size=3, padding=1)
+        return nn.Sequential(
+            nn.Conv2d(in_ch, in_ch, kernel_size=3, padding=1, groups=in_ch, bias=False),
+            nn.Conv2d(in_ch, out_ch, kernel_size=1),
+        )
+    
     def _make_encoder_block(self, in_ch: int, out_ch: int) -> nn.Sequential:
         return nn.Sequential(
-            nn.Conv2d(in_ch, out_ch, kernel_size=3, padding=1),
+            self._conv(in_ch, out_ch),
             nn.BatchNorm2d(out_ch),
             nn.ReLU(inplace=True),
-            nn.Conv2d(out_ch, out_ch, kernel_size=3, padding=1),
+            self._conv(out_ch, out_ch),
             nn.BatchNorm2d(out_ch),
             nn.ReLU(inplace=True),
         )
     
     def _make_decoder_block(self, in_ch: int, out_ch: int) -> nn.Sequential:
         return nn.Sequential(
-            nn.Conv2d(in_ch, out_ch, kernel_size=3, padding=1),
+            self._conv(in_ch, out_ch),
             nn.BatchNorm2d(out_ch),
             nn.ReLU(inplace=True),
-            nn.Conv2d(out_ch, out_ch, kernel_size=3, padding=1),
+            self._conv(out_ch, out_ch),
             nn.BatchNorm2d(out_ch),
             nn.ReLU(inplace=True),
         )
     
     def _make_residual_block(self, channels: int) -> nn.Sequential:
         return nn.Sequential(
-            nn.Conv2d(channels, channels, kernel_size=3, padding=1),
+            self._conv(channels, channels),
             nn.BatchNorm2d(channels),
             nn.ReLU(inplace=True),
-            nn.Conv2d(channels, channels, kernel_size=3, padding=1),
+            self._conv(channels, channels),
             nn.BatchNorm2d(channels),
         )
     
+    def _stage(self, fn, x: torch.Tensor) -> torch.Tensor:
+        if self.checkpoint_activations and self.training and torch.is_grad_enabled():
+            return checkpoint(fn, x, use_reentrant=False)
+        return fn(x)
+    
+    @staticmethod
+    def _residual(block: nn.Module):
+        return lambda x: x + F.relu(block(x))
+    
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         # Initial convolution
         x = self.conv_in(x)
         
         # Encoder with skip connections
-        e1 = self.enc1(x)
-        e2 = self.enc2(self.pool(e1))
-        e3 = self.enc3(self.pool(e2))
-        e4 = self.enc4(self.pool(e3))
+        e1 = self._stage(self.enc1, x)
+        e2 = self._stage(self.enc2, self.pool(e1))
+        e3 = self._stage(self.enc3, self.pool(e2))
+        e4 = self._stage(self.enc4, self.pool(e3))
         
         # Residual blocks
         for res_block in self.res_blocks:
-            e4 = e4 + F.relu(res_block(e4))
+            e4 = self._stage(self._residual(res_block), e4)
         
         # Decoder with skip connections
-        d4 = self.dec4(self.upsample(e4))
-        d3 = self.dec3(self.upsample(d4 + e3))
-        d2 = self.dec2(self.upsample(d3 + e2))
-        d1 = self.dec1(self.upsample(d2 + e1))
+        d4 = self.dec4(e4)
+        d3 = self.dec3(self.upsample(d4) + e3)
+        d2 = self.dec2(self.upsample(d3) + e2)
+        d1 = self.dec1(self.upsample(d2) + e1)
         
         # Output
         out = self.conv_out(d1)
@@ -194,17 +237,81 @@ class RefinementUNet(nn.Module):
         return torch.sigmoid(out)
 
 
+def model_from_state_dict(state: Dict[str, torch.Tensor]) -> RefinementUNet:
+    """``RefinementUNet`` with the width, depth and conv type found in ``state``, loaded."""
+    model = RefinementUNet(
+        base_channels=state['conv_in.weight'].shape[0],
+        num_residual_blocks=len({key.split('.')[1] for key in state if key.startswith('res_blocks.')}),
+        separable='enc1.0.0.weight' in state
+    )
+    model.load_state_dict(state)
+    return model
+
+
+def load_refinement_model(path: str, device: str = 'cpu') -> RefinementUNet:
+    """
+    ``RefinementUNet`` in eval mode from a training checkpoint, weights-only
+    export or bare state dict, loaded with ``weights_only=True``.
+    """
+    state = torch.load(path, map_location='cpu', weights_only=True)
+    return model_from_state_dict(state.get('model_state_dict', state)).to(device).eval()
+
+
+class TargetFeatureCache:
+    """
+    Target-side VGG feature maps keyed by dataset index, so unchanging
+    targets go through VGG once instead of every epoch. Maps are kept on
+    ``device`` in ``dtype`` until ``max_bytes`` is used; later samples are
+    simply not cached. Only valid when a sample's target is the same every
+    time it is loaded (no random crops or augmentation).
+    """
+    
+    def __init__(self, max_bytes: int, device: str = 'cpu', dtype: torch.dtype = torch.float16):
+        self.max_bytes = max_bytes
+        self.device = torch.device(device)
+        self.dtype = dtype
+        self.nbytes = 0
+        self.entries: Dict[int, List[torch.Tensor]] = {}
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def __contains__(self, index: int) -> bool:
+        return index in self.entries
+    
+    def get(self, index: int) -> List[torch.Tensor]:
+        return self.entries[index]
+    
+    def put(self, index: int, features: List[torch.Tensor]) -> bool:
+        """Store one sample's per-layer maps (no batch dim); False if over budget."""
+        size = sum(f.numel() for f in features) * torch.finfo(self.dtype).bits // 8
+        if index in self.entries or self.nbytes + size > self.max_bytes:
+            return False
+        self.entries[index] = [f.detach().to(self.device, self.dtype) for f in features]
+        self.nbytes += size
+        return True
+
+
 class VGGPerceptualLoss(nn.Module):
-    """VGG-based perceptual loss."""
+    """
+    VGG-based perceptual loss. With a ``TargetFeatureCache`` and the batch's
+    dataset ``indices``, cached targets skip VGG entirely.
+    """
     
-    def __init__(self, layers: List[str] = None):
+    def __init__(
+        self,
+        layers: List[str] = None,
+        pretrained: bool = True,
+        cache: Optional[TargetFeatureCache] = None
+    ):
         super().__init__()
         
         if layers is None:
             layers = ['relu1_2', 'relu2_2', 'relu3_3', 'relu4_3']
         
-        vgg = models.vgg16(pretrained=True).features
+        vgg = models.vgg16(pretrained=pretrained).features
         self.layers = layers
+        self.cache = cache
         
         # Extract specified layers
         self.slice = nn.Module()
@@ -218,14 +325,68 @@ class VGGPerceptualLoss(nn.Module):
         for param in self.parameters():
             param.requires_grad = False
     
-    def forward(self, x: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
-        loss = 0
-        
-        for name, module in self.slice.named_children():
+    def features(self, x: torch.Tensor) -> List[torch.Tensor]:
+        """Feature maps after each slice."""
+        features = []
+        for module in self.slice.children():
             x = module(x)
-            target = module(target)
-            loss += F.mse_loss(x, target)
+            features.append(x)
+        return features
+    
+    def _feature_pair(
+        self,
+        x: torch.Tensor,
+        target: torch.Tensor
+    ) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+        """
+        (output features, target features). Without autograd both go through
+        VGG as one batch; when training, the target runs under ``no_grad``
+        instead, since a shared pass would also backpropagate through it.
+        """
+        if torch.is_grad_enabled() and x.requires_grad:
+            with torch.no_grad():
+                target_feats = self.features(target) if len(target) else None
+            return self.features(x), target_feats
+        feats = self.features(torch.cat([x, target]))
+        return [f[:len(x)] for f in feats], [f[len(x):] for f in feats]
+    
+    def _target_features(
+        self,
+        x: torch.Tensor,
+        target: torch.Tensor,
+        indices: Optional[torch.Tensor]
+    ) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+        """(output features, target features), running VGG only on uncached targets."""
+        if self.cache is None or indices is None:
+            return self._feature_pair(x, target)
+        
+        indices = indices.tolist()
+        missing = [i for i, idx in enumerate(indices) if idx not in self.cache]
+        out_feats, computed = self._feature_pair(x, target[missing])
         
+        target_feats = []
+        for layer, f in enumerate(out_feats):
+            t = torch.empty_like(f)
+            if missing:
+                t[missing] = computed[layer]
+            for i, idx in enumerate(indices):
+                if idx in self.cache:
+                    t[i] = self.cache.get(idx)[layer]
+            target_feats.append(t)
+        for i in missing:
+            self.cache.put(indices[i], [t[i] for t in target_feats])
+        return out_feats, target_feats
+    
+    def forward(
+        self,
+        x: torch.Tensor,
+        target: torch.Tensor,
+        indices: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        out_feats, target_feats = self._target_features(x, target, indices)
+        loss = 0
+        for out_f, target_f in zip(out_feats, target_feats):
+            loss += F.mse_loss(out_f, target_f)
         return loss
 
 
@@ -233,6 +394,129 @@ class VGGPerceptualLoss(nn.Module):
 # Dataset
 # ============================================================================
 
+MANIFEST_VERSION = 1
+
+
+def _scan_names(directory: str) -> List[str]:
+    """Names of the regular files in ``directory`` (one ``os.scandir`` pass)."""
+    try:
+        with os.scandir(directory) as entries:
+            return [entry.name for entry in entries if entry.is_file()]
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def _dir_mtimes(data_dir: str) -> Dict[str, Optional[int]]:
+    """mtime (ns) of ``data_dir`` and its input/ and target/ subdirectories."""
+    mtimes = {}
+    for sub in ('', 'input', 'target'):
+        try:
+            mtimes[sub] = os.stat(os.path.join(data_dir, sub)).st_mtime_ns
+        except OSError:
+            mtimes[sub] = None
+    return mtimes
+
+
+def discover_pairs(data_dir: str) -> List[Tuple[str, str]]:
+    """
+    (input, target) paths relative to ``data_dir``, sorted, for both layouts:
+    - input/*.jpg|png and target/<same name>
+    - *-input.jpg and *-target.jpg side by side
+    Each directory is listed once (in parallel) and pairs are matched by
+    set intersection, with no per-file ``exists`` calls.
+    """
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        root, inputs, targets = pool.map(
+            _scan_names, [os.path.join(data_dir, sub) for sub in ('', 'input', 'target')]
+        )
+    
+    inputs = {name for name in inputs if name.endswith(('.jpg', '.png'))}
+    pairs = [
+        (os.path.join('input', name), os.path.join('target', name))
+        for name in sorted(inputs & set(targets))
+    ]
+    
+    root = set(root)
+    for name in sorted(name for name in root if name.endswith('-input.jpg')):
+        target = name.replace('-input', '-target')
+        if target in root:
+            pairs.append((name, target))
+    return pairs
+
+
+def default_manifest_cache() -> Path:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(Path.home(), '.cache')
+    return Path(cache_home) / 'closetai' / 'pair-manifests'
+
+
+def write_manifest(path: str, data_dir: str, pairs: List[Tuple[str, str]], mtimes: Optional[Dict] = None) -> None:
+    """Write a pair manifest (pairs relative to ``data_dir``) atomically."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            'version': MANIFEST_VERSION,
+            'data_dir': str(Path(data_dir).resolve()),
+            'mtimes': mtimes,
+            'pairs': [list(p) for p in pairs],
+        }, f)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(path: str) -> Dict:
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version in {path}")
+    return manifest
+
+
+def load_pairs(
+    data_dir: str,
+    manifest: Optional[str] = None,
+    cache_dir: Optional[str] = None
+) -> List[Tuple[str, str]]:
+    """
+    Absolute (input, target) pairs for ``data_dir``.
+    
+    With ``manifest``, that file is trusted as-is (it is written from a fresh
+    scan first if it does not exist yet), so large shared datasets can ship
+    a prebuilt one. Otherwise a manifest cached under ``cache_dir`` is
+    reused while the mtimes of ``data_dir``, input/ and target/ are
+    unchanged (adding, removing or renaming files updates them) and
+    rebuilt when they differ.
+    """
+    data_dir = str(Path(data_dir).resolve())
+    
+    def absolute(pairs) -> List[Tuple[str, str]]:
+        return [(os.path.join(data_dir, inp), os.path.join(data_dir, tgt)) for inp, tgt in pairs]
+    
+    if manifest:
+        if not os.path.exists(manifest):
+            write_manifest(manifest, data_dir, discover_pairs(data_dir))
+        return absolute(read_manifest(manifest)['pairs'])
+    
+    cache_dir = Path(cache_dir) if cache_dir else default_manifest_cache()
+    key = hashlib.sha1(data_dir.encode()).hexdigest()[:16]
+    cache_path = str(cache_dir / f'{Path(data_dir).name}-{key}.json')
+    # Taken before scanning, so changes made during the scan invalidate it
+    mtimes = _dir_mtimes(data_dir)
+    
+    try:
+        cached = read_manifest(cache_path)
+        if cached['data_dir'] == data_dir and cached['mtimes'] == mtimes:
+            return absolute(cached['pairs'])
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    pairs = discover_pairs(data_dir)
+    try:
+        write_manifest(cache_path, data_dir, pairs, mtimes)
+    except OSError as e:
+        print(f"Could not cache pair manifest at {cache_path}: {e}")
+    return absolute(pairs)
+
+
 class PairedImageDataset(Dataset):
     """Dataset of paired images (provider output, ground truth)."""
     
@@ -240,32 +524,15 @@ class PairedImageDataset(Dataset):
         self, 
         data_dir: str,
         transform: Optional[transforms.Compose] = None,
-        image_size: int = 512
+        image_size: int = 512,
+        manifest: Optional[str] = None,
+        manifest_cache_dir: Optional[str] = None
     ):
         self.data_dir = Path(data_dir)
         self.image_size = image_size
         
-        # Find all pairs
-        self.pairs = []
-        
-        # Look for pairs in format:
-        # - input/*.jpg and target/*.jpg
-        # - *-input.jpg and *-target.jpg
-        input_dir = self.data_dir / 'input'
-        target_dir = self.data_dir / 'target'
-        
-        if input_dir.exists() and target_dir.exists():
-            input_files = list(input_dir.glob('*.jpg')) + list(input_dir.glob('*.png'))
-            for inp in input_files:
-                target_file = target_dir / inp.name
-                if target_file.exists():
-                    self.pairs.append((str(inp), str(target_file)))
-        
-        # Also look for pairs in same directory (*-input.jpg, *-target.jpg)
-        for file in self.data_dir.glob('*-input.jpg'):
-            target = file.parent / file.name.replace('-input', '-target')
-            if target.exists():
-                self.pairs.append((str(file), str(target)))
+        # Find all pairs (see load_pairs for the manifest cache)
+        self.pairs = load_pairs(data_dir, manifest, manifest_cache_dir)
         
         self.transform = transform or transforms.Compose([
             transforms.Resize((image_size, image_size)),
@@ -289,12 +556,575 @@ class PairedImageDataset(Dataset):
         return input_tensor, target_tensor
 
 
+def load_resized(path: str, image_size: int) -> Image.Image:
+    """
+    Decode ``path`` as an RGB ``image_size`` x ``image_size`` image. JPEGs
+    are first downscaled inside the decoder (DCT scaling), so large studio
+    photos are never decoded at full resolution.
+    """
+    img = Image.open(path)
+    img.draft('RGB', (image_size, image_size))
+    return img.convert('RGB').resize((image_size, image_size), Image.BILINEAR)
+
+
+def pack_pairs(
+    pairs: List[Tuple[str, str]],
+    out_path: str,
+    image_size: int = 512,
+    num_workers: int = 8
+) -> str:
+    """
+    Decode and resize every (input, target) pair once into a uint8 ``.npy``
+    array of shape (N, 2, image_size, image_size, 3), written through a
+    memory map so the whole set never has to fit in RAM. The source pairs
+    are recorded in ``<out_path>.json``. Returns ``out_path``.
+    """
+    tmp_path = out_path + '.tmp'
+    packed = np.lib.format.open_memmap(
+        tmp_path, mode='w+', dtype=np.uint8,
+        shape=(len(pairs), 2, image_size, image_size, 3)
+    )
+    
+    def fill(idx: int) -> None:
+        input_path, target_path = pairs[idx]
+        packed[idx, 0] = np.asarray(load_resized(input_path, image_size))
+        packed[idx, 1] = np.asarray(load_resized(target_path, image_size))
+    
+    # PIL releases the GIL while decoding and resizing
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        list(tqdm(pool.map(fill, range(len(pairs))), total=len(pairs), desc='Packing'))
+    
+    packed.flush()
+    del packed
+    os.replace(tmp_path, out_path)
+    with open(out_path + '.json', 'w') as f:
+        json.dump({'image_size': image_size, 'pairs': [list(p) for p in pairs]}, f)
+    return out_path
+
+
+class PackedPairDataset(Dataset):
+    """
+    Pairs pre-decoded by ``pack_pairs``. Samples are uint8 (3, H, W) views
+    into the memory-mapped array (no decode, resize or copy per sample);
+    convert them with ``to_model_input`` after moving the batch to the
+    device.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._data = None
+        self._length = np.load(path, mmap_mode='r').shape[0]
+    
+    def __len__(self) -> int:
+        return self._length
+    
+    def __getstate__(self):
+        # Each DataLoader worker maps the file itself
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+    
+    def __getitem__(self, idx: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        if self._data is None:
+            # Copy-on-write mapping: writable views, file never modified
+            self._data = np.load(self.path, mmap_mode='c')
+        pair = torch.from_numpy(self._data[idx]).permute(0, 3, 1, 2)
+        return pair[0], pair[1]
+
+
+def packed_dataset(
+    data_dir: str,
+    pack_dir: str,
+    image_size: int = 512,
+    num_workers: int = 8,
+    manifest: Optional[str] = None
+) -> PackedPairDataset:
+    """
+    ``PackedPairDataset`` for ``data_dir``, packing it into ``pack_dir``
+    first if there is no pack yet or its pairs or array shape no longer
+    match. Packs are named by a hash of the resolved ``data_dir``, like
+    the manifest cache, so directories sharing a basename do not collide.
+    """
+    pairs = load_pairs(data_dir, manifest)
+    Path(pack_dir).mkdir(parents=True, exist_ok=True)
+    data_dir = str(Path(data_dir).resolve())
+    key = hashlib.sha1(data_dir.encode()).hexdigest()[:16]
+    path = str(Path(pack_dir) / f'{Path(data_dir).name}-{key}_{image_size}.npy')
+    
+    try:
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        stale = meta['pairs'] != [list(p) for p in pairs] or meta['image_size'] != image_size
+        packed = np.load(path, mmap_mode='r')
+        stale = stale or packed.dtype != np.uint8 or packed.shape != (len(pairs), 2, image_size, image_size, 3)
+        del packed
+    except (OSError, ValueError, KeyError):
+        stale = True
+    
+    if stale:
+        print(f"Packing {len(pairs)} pairs into {path}")
+        pack_pairs(pairs, path, image_size, num_workers)
+    return PackedPairDataset(path)
+
+
+class PatchPairDataset(Dataset):
+    """
+    Aligned random crops from full-resolution pairs. Each sample is one
+    image's patch budget: ``patches_per_image`` uint8 (3, patch_size,
+    patch_size) crops of the input and the same regions of the target,
+    stacked as (P, 3, patch_size, patch_size). Use ``collate_patches`` so
+    a batch of B images becomes B * P patches.
+    
+    Each crop picks a scale from ``scales``: at scale s it covers
+    patch_size / s source pixels (capped at the image size) resized to
+    patch_size, so scales below 1 add context at lower detail. Crop boxes
+    are in relative coordinates, so a target at a different resolution
+    than its input is cut at the matching region.
+    
+    With ``seed`` the crops of each image are fixed (drawn from a generator
+    seeded by ``seed`` and the index), so a validation split sees the same
+    patches every epoch and its loss is comparable across epochs.
+    """
+    
+    def __init__(
+        self,
+        pairs: List[Tuple[str, str]],
+        patch_size: int = 256,
+        patches_per_image: int = 8,
+        scales: Tuple[float, ...] = (1.0,),
+        seed: Optional[int] = None
+    ):
+        self.pairs = pairs
+        self.patch_size = patch_size
+        self.patches_per_image = patches_per_image
+        self.scales = tuple(scales)
+        self.seed = seed
+    
+    def __len__(self) -> int:
+        return len(self.pairs)
+    
+    def _boxes(
+        self,
+        width: int,
+        height: int,
+        generator: Optional[torch.Generator] = None
+    ) -> List[Tuple[float, float, float, float]]:
+        """Random crop boxes as (left, top, right, bottom) fractions of the image."""
+        boxes = []
+        scale_idx = torch.randint(len(self.scales), (self.patches_per_image,), generator=generator)
+        for i in scale_idx.tolist():
+            crop = self.patch_size / self.scales[i]
+            crop_w, crop_h = min(crop, width), min(crop, height)
+            left = torch.rand((), generator=generator).item() * (width - crop_w)
+            top = torch.rand((), generator=generator).item() * (height - crop_h)
+            boxes.append((left / width, top / height, (left + crop_w) / width, (top + crop_h) / height))
+        return boxes
+    
+    def _crops(self, img: Image.Image, boxes) -> torch.Tensor:
+        width, height = img.size
+        size = (self.patch_size, self.patch_size)
+        crops = [
+            np.asarray(img.resize(size, Image.BILINEAR, box=(l * width, t * height, r * width, b * height)))
+            for l, t, r, b in boxes
+        ]
+        return torch.from_numpy(np.stack(crops)).permute(0, 3, 1, 2)
+    
+    def __getitem__(self, idx: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        input_path, target_path = self.pairs[idx]
+        input_img = Image.open(input_path).convert('RGB')
+        target_img = Image.open(target_path).convert('RGB')
+        generator = None
+        if self.seed is not None:
+            generator = torch.Generator().manual_seed(self.seed * len(self.pairs) + idx)
+        boxes = self._boxes(*input_img.size, generator=generator)
+        return self._crops(input_img, boxes), self._crops(target_img, boxes)
+
+
+def collate_patches(batch: List[Tuple[torch.Tensor, torch.Tensor]]) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Concatenate per-image patch stacks from ``PatchPairDataset`` into one batch."""
+    inputs, targets = zip(*batch)
+    return torch.cat(inputs), torch.cat(targets)
+
+
+class IndexedDataset(Dataset):
+    """Wraps a paired dataset so samples are (input, target, index), for ``TargetFeatureCache``."""
+    
+    def __init__(self, dataset: Dataset):
+        self.dataset = dataset
+    
+    def __len__(self) -> int:
+        return len(self.dataset)
+    
+    def __getitem__(self, idx: int) -> Tuple[torch.Tensor, torch.Tensor, int]:
+        input_img, target_img = self.dataset[idx]
+        return input_img, target_img, idx
+
+
+def to_model_input(batch: torch.Tensor, device: torch.device) -> torch.Tensor:
+    """Move a batch to ``device``; uint8 batches are scaled to [0, 1] floats there."""
+    batch = batch.to(device, non_blocking=True)
+    if batch.dtype == torch.uint8:
+        batch = batch.float().div_(255)
+    return batch
+
+
+# ============================================================================
+# Tiled Inference
+# ============================================================================
+
+def _tile_starts(length: int, tile: int, stride: int) -> List[int]:
+    """Tile offsets covering ``length``; the last tile is flush with the end."""
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    return starts + [length - tile]
+
+
+def _blend_window(tile: int, overlap: int, device: torch.device) -> torch.Tensor:
+    """(tile, tile) weights ramping up over ``overlap`` pixels at each edge."""
+    ramp = torch.ones(tile, device=device)
+    if overlap > 0:
+        edge = torch.arange(1, overlap + 1, device=device, dtype=torch.float32) / (overlap + 1)
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge.flip(0)
+    return ramp[:, None] * ramp[None, :]
+
+
+@torch.no_grad()
+def tiled_inference(
+    model: nn.Module,
+    image: torch.Tensor,
+    tile_size: int = 512,
+    overlap: int = 64,
+    batch_size: int = 4
+) -> torch.Tensor:
+    """
+    Run ``model`` over a (B, 3, H, W) batch of any size in overlapping
+    ``tile_size`` tiles, so memory is bounded by the tile rather than the
+    image. Overlaps are blended with a linear ramp to hide seams. Images are
+    padded to a multiple of 8 (three poolings in ``RefinementUNet``) and at
+    least one tile, and cropped back afterwards. The model should be in
+    eval mode.
+    """
+    if tile_size % 8 or not 0 <= overlap < tile_size // 2:
+        raise ValueError("tile_size must be a multiple of 8 and overlap below half of it")
+    
+    _, _, height, width = image.shape
+    pad_h = max(tile_size, -(-height // 8) * 8) - height
+    pad_w = max(tile_size, -(-width // 8) * 8) - width
+    if pad_h or pad_w:
+        mode = 'reflect' if pad_h < height and pad_w < width else 'replicate'
+        image = F.pad(image, (0, pad_w, 0, pad_h), mode=mode)
+    padded_h, padded_w = image.shape[-2:]
+    
+    stride = tile_size - overlap
+    positions = [
+        (top, left)
+        for top in _tile_starts(padded_h, tile_size, stride)
+        for left in _tile_starts(padded_w, tile_size, stride)
+    ]
+    window = _blend_window(tile_size, overlap, image.device)
+    output = None
+    weights = torch.zeros(1, 1, padded_h, padded_w, device=image.device)
+    
+    for start in range(0, len(positions), batch_size):
+        chunk = positions[start:start + batch_size]
+        tiles = torch.cat([image[:, :, t:t + tile_size, l:l + tile_size] for t, l in chunk])
+        refined = model(tiles).float().split(image.shape[0])
+        if output is None:
+            output = torch.zeros(image.shape[0], refined[0].shape[1], padded_h, padded_w, device=image.device)
+        for (top, left), tile_out in zip(chunk, refined):
+            output[:, :, top:top + tile_size, left:left + tile_size] += tile_out * window
+            weights[:, :, top:top + tile_size, left:left + tile_size] += window
+    
+    return (output / weights)[:, :, :height, :width]
+
+
+def refine_image(
+    model: nn.Module,
+    img: Image.Image,
+    device: torch.device,
+    tile_size: int = 512,
+    overlap: int = 64
+) -> Image.Image:
+    """Refine a PIL image at its full resolution with ``tiled_inference``."""
+    x = to_model_input(torch.from_numpy(np.array(img.convert('RGB'))).permute(2, 0, 1)[None], device)
+    out = tiled_inference(model, x, tile_size, overlap)
+    pixels = out[0].clamp(0, 1).mul(255).round().byte().permute(1, 2, 0).cpu().numpy()
+    return Image.fromarray(pixels)
+
+
+# ============================================================================
+# Distributed
+# ============================================================================
+
+def setup_distributed(backend: Optional[str] = None) -> Tuple[int, int, int]:
+    """
+    Join the process group when launched by ``torchrun`` (``WORLD_SIZE`` > 1).
+    The backend defaults to NCCL with GPUs and gloo otherwise, so CPU nodes
+    work too. Returns (rank, world_size, local_rank); (0, 1, 0) when not
+    distributed.
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', '1'))
+    if world_size <= 1:
+        return 0, 1, 0
+    local_rank = int(os.environ.get('LOCAL_RANK', '0'))
+    if backend is None:
+        backend = 'nccl' if torch.cuda.is_available() else 'gloo'
+    if torch.cuda.is_available():
+        torch.cuda.set_device(local_rank)
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend)
+    return dist.get_rank(), dist.get_world_size(), local_rank
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def mean_across_ranks(value: float) -> float:
+    """Average a per-rank scalar over all ranks (``value`` itself when not distributed)."""
+    if not is_distributed():
+        return value
+    tensor = torch.tensor([value], dtype=torch.float64)
+    if dist.get_backend() == 'nccl':
+        tensor = tensor.cuda()
+    dist.all_reduce(tensor)
+    return tensor.item() / dist.get_world_size()
+
+
+# ============================================================================
+# Checkpointing
+# ============================================================================
+
+def cpu_snapshot(state):
+    """Deep copy of a (nested) state dict with every tensor cloned to CPU."""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {k: cpu_snapshot(v) for k, v in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(cpu_snapshot(v) for v in state)
+    return state
+
+
+def atomic_save(obj, path: str) -> None:
+    """``torch.save`` to a temp file, fsync, then rename over ``path``."""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def prune_checkpoints(directory: str, keep_last: int, pattern: str = 'checkpoint_epoch_*.pt') -> None:
+    """Delete all but the ``keep_last`` highest-epoch checkpoints matching ``pattern``."""
+    if keep_last <= 0:
+        return
+    def epoch_of(path: Path) -> int:
+        match = re.search(r'(\d+)', path.stem)
+        return int(match.group(1)) if match else -1
+    for old in sorted(Path(directory).glob(pattern), key=epoch_of)[:-keep_last]:
+        old.unlink(missing_ok=True)
+
+
+def rng_state() -> Dict:
+    """Python, NumPy and torch RNG states, in types ``torch.load(weights_only=True)`` accepts."""
+    name, keys, pos, has_gauss, cached = np.random.get_state()
+    state = {
+        'python': random.getstate(),
+        'numpy': (name, torch.from_numpy(keys.astype(np.int64)), pos, has_gauss, cached),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state: Dict) -> None:
+    random.setstate(state['python'])
+    name, keys, pos, has_gauss, cached = state['numpy']
+    np.random.set_state((name, keys.numpy().astype(np.uint32), pos, has_gauss, cached))
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints on one background thread so training does not wait
+    on disk. At most ``max_pending`` snapshots are in memory; saving
+    another first waits for the oldest. Write errors surface on the next
+    ``submit`` or ``wait``.
+    """
+    
+    def __init__(self, max_pending: int = 2):
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint')
+        self.pending = []
+    
+    def submit(self, fn, *args) -> None:
+        while len(self.pending) >= self.max_pending:
+            self.pending.pop(0).result()
+        self.pending.append(self.executor.submit(fn, *args))
+    
+    def wait(self) -> None:
+        while self.pending:
+            self.pending.pop(0).result()
+    
+    def close(self) -> None:
+        self.wait()
+        self.executor.shutdown()
+
+
+# ============================================================================
+# Instrumentation
+# ============================================================================
+
+TRAIN_PHASES = ('data', 'forward', 'losses', 'backward', 'optimizer')
+
+
+def peak_memory_mb(device: torch.device, reset: bool = False) -> float:
+    """Peak allocated CUDA memory (optionally resetting it), or peak process RSS on CPU."""
+    if device.type == 'cuda':
+        peak = torch.cuda.max_memory_allocated(device)
+        if reset:
+            torch.cuda.reset_peak_memory_stats(device)
+        return peak / 2 ** 20
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class TrainingMetrics:
+    """
+    Per-phase step timing (see ``TRAIN_PHASES``), images/sec and peak memory,
+    aggregated over windows of ``window`` steps. Each window is appended to
+    ``path`` as one JSON line when a path is given.
+    
+    On CUDA, phases are timed with CUDA events and only resolved when a
+    window closes, so timing adds no synchronisation to the step. Phases
+    are also labelled for ``torch.profiler`` traces.
+    """
+    
+    def __init__(self, device: torch.device, path: Optional[str] = None, window: int = 50):
+        self.device = device
+        self.path = path
+        self.window = window
+        self.cuda = device.type == 'cuda'
+        self._reset()
+    
+    def _reset(self) -> None:
+        self.cpu_ms = {name: 0.0 for name in TRAIN_PHASES}
+        self.events = []
+        self.steps = 0
+        self.images = 0
+        self.loss = 0.0
+        self.started = time.perf_counter()
+    
+    @contextmanager
+    def phase(self, name: str):
+        with record_function(name):
+            if self.cuda:
+                start = torch.cuda.Event(enable_timing=True)
+                end = torch.cuda.Event(enable_timing=True)
+                start.record()
+                yield
+                end.record()
+                self.events.append((name, start, end))
+            else:
+                start = time.perf_counter()
+                yield
+                self.cpu_ms[name] += (time.perf_counter() - start) * 1000
+    
+    def add(self, name: str, seconds: float) -> None:
+        """Add host-side time measured by the caller (e.g. waiting on the DataLoader)."""
+        self.cpu_ms[name] += seconds * 1000
+    
+    def step(self, images: int, loss: float, epoch: int, global_step: int) -> Optional[Dict]:
+        """Count one step; returns (and writes) the window record when it closes."""
+        self.steps += 1
+        self.images += images
+        self.loss += loss
+        if self.steps >= self.window:
+            return self.flush(epoch, global_step)
+        return None
+    
+    def flush(self, epoch: int, global_step: int) -> Optional[Dict]:
+        if not self.steps:
+            return None
+        if self.cuda:
+            torch.cuda.synchronize(self.device)
+        phase_ms = dict(self.cpu_ms)
+        for name, start, end in self.events:
+            phase_ms[name] += start.elapsed_time(end)
+        seconds = time.perf_counter() - self.started
+        record = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'epoch': epoch,
+            'step': global_step,  # training steps completed
+            'steps': self.steps,
+            'images': self.images,
+            'images_per_sec': round(self.images / seconds, 2),
+            'step_ms': round(seconds * 1000 / self.steps, 2),
+            'phase_ms': {name: round(ms / self.steps, 2) for name, ms in phase_ms.items()},
+            'loss': self.loss / self.steps,
+            'peak_memory_mb': round(peak_memory_mb(self.device, reset=True), 1),
+        }
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        self._reset()
+        return record
+
+
+class StepProfiler:
+    """
+    Opt-in ``torch.profiler`` capture of training steps ``start`` (inclusive)
+    to ``end`` (exclusive), counted across epochs. The trace is written as
+    Chrome trace JSON (chrome://tracing or ui.perfetto.dev) to ``trace_path``.
+    """
+    
+    def __init__(self, start: int, end: int, trace_path: str, device: torch.device):
+        if not 0 <= start < end:
+            raise ValueError(f"Invalid profile step range: {start}:{end}")
+        self.start = start
+        self.end = end
+        self.trace_path = trace_path
+        self.activities = [ProfilerActivity.CPU]
+        if device.type == 'cuda':
+            self.activities.append(ProfilerActivity.CUDA)
+        self.profiler = None
+    
+    def before_step(self, global_step: int) -> None:
+        if global_step == self.start and self.profiler is None:
+            self.profiler = profile(activities=self.activities, record_shapes=True, profile_memory=True)
+            self.profiler.start()
+    
+    def after_step(self, global_step: int) -> None:
+        if self.profiler is not None and global_step + 1 >= self.end:
+            self.stop()
+    
+    def stop(self) -> None:
+        if self.profiler is None:
+            return
+        self.profiler.stop()
+        self.profiler.export_chrome_trace(self.trace_path)
+        print(f"Profiler trace written to {self.trace_path}")
+        self.profiler = None
+        # Never restart
+        self.start = -1
+
+
 # ============================================================================
 # Training
 # ============================================================================
 
 class TransferTrainer:
-    """Trainer for the refinement model."""
+    """
+    Trainer for the refinement model. Inside an initialised process group
+    the model is wrapped in ``DistributedDataParallel`` (``self.module``
+    stays the bare model); only rank 0 writes checkpoints.
+    """
     
     def __init__(
         self,
@@ -302,11 +1132,26 @@ class TransferTrainer:
         device: str = 'cuda',
         lr: float = 1e-4,
         weight_decay: float = 1e-5,
-        use_amp: bool = True
+        use_amp: bool = True,
+        target_cache_bytes: int = 0,
+        pretrained_vgg: bool = True,
+        async_checkpoints: bool = True,
+        keep_last: int = 3,
+        metrics_path: Optional[str] = None,
+        metrics_window: int = 50,
+        profiler: Optional[StepProfiler] = None,
+        teacher: Optional[nn.Module] = None,
+        distill_weight: float = 0.5
     ):
         self.device = torch.device(device if torch.cuda.is_available() else 'cpu')
-        self.model = model.to(self.device)
+        self.module = model.to(self.device)
+        self.model = self.module
         self.use_amp = use_amp
+        self.distributed = is_distributed()
+        self.rank = dist.get_rank() if self.distributed else 0
+        if self.distributed:
+            device_ids = [self.device] if self.device.type == 'cuda' else None
+            self.model = DistributedDataParallel(self.module, device_ids=device_ids)
         
         # Optimizer
         self.optimizer = AdamW(
@@ -322,7 +1167,10 @@ class TransferTrainer:
             self.lpips_loss = lpips.LPIPS(net='alex').to(self.device)
             self.lpips_loss.eval()
         
-        self.perceptual_loss = VGGPerceptualLoss().to(self.device)
+        # Cached target features live next to the model; ``target_cache_bytes``
+        # is a budget on that device
+        cache = TargetFeatureCache(target_cache_bytes, self.device) if target_cache_bytes else None
+        self.perceptual_loss = VGGPerceptualLoss(pretrained=pretrained_vgg, cache=cache).to(self.device)
         
         # Mixed precision scaler
         self.scaler = GradScaler() if use_amp else None
@@ -338,6 +1186,24 @@ class TransferTrainer:
         self.train_losses = []
         self.val_losses = []
         
+        # Knowledge distillation: a frozen teacher's output is a second target
+        self.teacher = teacher
+        self.distill_weight = distill_weight
+        if teacher is not None:
+            self.teacher = teacher.to(self.device).eval()
+            for param in self.teacher.parameters():
+                param.requires_grad = False
+        
+        # Step timing; only rank 0 writes the metrics file
+        self.metrics = TrainingMetrics(self.device, metrics_path if self.rank == 0 else None, metrics_window)
+        self.profiler = profiler if self.rank == 0 else None
+        self.global_step = 0
+        self.epoch = 0
+        
+        # Checkpoints are snapshotted to CPU and written in the background
+        self.checkpoint_writer = CheckpointWriter() if async_checkpoints else None
+        self.keep_last = keep_last
+        
     def train_epoch(
         self, 
         dataloader: DataLoader,
@@ -346,72 +1212,91 @@ class TransferTrainer:
         lambda_perceptual: float = 0.1,
         gradient_accumulation_steps: int = 4
     ) -> float:
-        """Train for one epoch."""
+        """Train for one epoch, timing each phase of every step (see ``TrainingMetrics``)."""
         self.model.train()
         
         total_loss = 0
         num_batches = 0
+        metrics = self.metrics
         
         self.optimizer.zero_grad()
         
-        for batch_idx, (input_img, target_img) in enumerate(tqdm(dataloader, desc='Training')):
-            input_img = input_img.to(self.device)
-            target_img = target_img.to(self.device)
+        data_start = time.perf_counter()
+        for batch_idx, batch in enumerate(tqdm(dataloader, desc='Training', disable=self.rank != 0)):
+            if self.profiler is not None:
+                self.profiler.before_step(self.global_step)
+            
+            # IndexedDataset batches also carry dataset indices
+            input_img, target_img, indices = batch if len(batch) == 3 else (*batch, None)
+            input_img = to_model_input(input_img, self.device)
+            target_img = to_model_input(target_img, self.device)
+            metrics.add('data', time.perf_counter() - data_start)
+            
+            # Gradients are all-reduced only on the micro-batch that steps
+            sync = (batch_idx + 1) % gradient_accumulation_steps == 0
+            no_sync = self.model.no_sync() if self.distributed and not sync else nullcontext()
             
-            # Forward pass with mixed precision
-            if self.use_amp:
-                with autocast():
-                    output = self.model(input_img)
+            with no_sync:
+                # Forward pass with mixed precision
+                with autocast() if self.use_amp else nullcontext():
+                    with metrics.phase('forward'):
+                        output = self.model(input_img)
+                        if self.teacher is not None:
+                            with torch.no_grad():
+                                teacher_img = self.teacher(input_img)
                     
                     # Calculate losses
-                    loss_l1 = self.l1_loss(output, target_img)
-                    loss_perceptual = self.perceptual_loss(output, target_img)
-                    
-                    if LPIPS_AVAILABLE:
-                        loss_lpips = self.lpips_loss(output, target_img).mean()
-                        loss = (lambda_l1 * loss_l1 + 
-                               lambda_lpips * loss_lpips + 
-                               lambda_perceptual * loss_perceptual)
-                    else:
-                        loss = lambda_l1 * loss_l1 + lambda_perceptual * loss_perceptual
-                    
-                    loss = loss / gradient_accumulation_steps
+                    with metrics.phase('losses'):
+                        loss_l1 = self.l1_loss(output, target_img)
+                        loss_perceptual = self.perceptual_loss(output, target_img, indices)
+                        
+                        if LPIPS_AVAILABLE:
+                            loss_lpips = self.lpips_loss(output, target_img).mean()
+                            loss = (lambda_l1 * loss_l1 + 
+                                   lambda_lpips * loss_lpips + 
+                                   lambda_perceptual * loss_perceptual)
+                        else:
+                            loss = lambda_l1 * loss_l1 + lambda_perceptual * loss_perceptual
+                        
+                        # Blend the ground-truth loss with matching the teacher
+                        if self.teacher is not None:
+                            loss_distill = self.l1_loss(output, teacher_img)
+                            loss = (1 - self.distill_weight) * loss + self.distill_weight * loss_distill
+                        
+                        loss = loss / gradient_accumulation_steps
                 
                 # Backward pass
-                self.scaler.scale(loss).backward()
-                
-                # Update weights
-                if (batch_idx + 1) % gradient_accumulation_steps == 0:
-                    self.scaler.step(self.optimizer)
-                    self.scaler.update()
-                    self.optimizer.zero_grad()
-            else:
-                output = self.model(input_img)
-                
-                loss_l1 = self.l1_loss(output, target_img)
-                loss_perceptual = self.perceptual_loss(output, target_img)
-                
-                if LPIPS_AVAILABLE:
-                    loss_lpips = self.lpips_loss(output, target_img).mean()
-                    loss = (lambda_l1 * loss_l1 + 
-                           lambda_lpips * loss_lpips + 
-                           lambda_perceptual * loss_perceptual)
-                else:
-                    loss = lambda_l1 * loss_l1 + lambda_perceptual * loss_perceptual
-                
-                loss = loss / gradient_accumulation_steps
-                loss.backward()
-                
-                if (batch_idx + 1) % gradient_accumulation_steps == 0:
-                    self.optimizer.step()
+                with metrics.phase('backward'):
+                    if self.use_amp:
+                        self.scaler.scale(loss).backward()
+                    else:
+                        loss.backward()
+            
+            # Update weights
+            if sync:
+                with metrics.phase('optimizer'):
+                    if self.use_amp:
+                        self.scaler.step(self.optimizer)
+                        self.scaler.update()
+                    else:
+                        self.optimizer.step()
                     self.optimizer.zero_grad()
             
-            total_loss += loss.item() * gradient_accumulation_steps
+            step_loss = loss.item() * gradient_accumulation_steps
+            total_loss += step_loss
             num_batches += 1
+            
+            metrics.step(len(input_img), step_loss, self.epoch, self.global_step + 1)
+            if self.profiler is not None:
+                self.profiler.after_step(self.global_step)
+            self.global_step += 1
+            data_start = time.perf_counter()
         
+        metrics.flush(self.epoch, self.global_step)
+        self.epoch += 1
         self.scheduler.step()
         
-        return total_loss / num_batches
+        return mean_across_ranks(total_loss / num_batches)
     
     def validate(self, dataloader: DataLoader) -> float:
         """Validate the model."""
@@ -421,9 +1306,9 @@ class TransferTrainer:
         num_batches = 0
         
         with torch.no_grad():
-            for input_img, target_img in tqdm(dataloader, desc='Validating'):
-                input_img = input_img.to(self.device)
-                target_img = target_img.to(self.device)
+            for input_img, target_img in tqdm(dataloader, desc='Validating', disable=self.rank != 0):
+                input_img = to_model_input(input_img, self.device)
+                target_img = to_model_input(target_img, self.device)
                 
                 output = self.model(input_img)
                 
@@ -431,36 +1316,77 @@ class TransferTrainer:
                 total_loss += loss_l1.item()
                 num_batches += 1
         
-        return total_loss / num_batches
+        return mean_across_ranks(total_loss / num_batches)
     
     def save_checkpoint(
         self, 
         path: str, 
         epoch: int, 
-        best_loss: float
+        best_loss: float,
+        prune: bool = False
     ) -> None:
-        """Save model checkpoint."""
+        """
+        Save a full training checkpoint for ``epoch`` (the last finished one),
+        including RNG states so a resumed run continues exactly. The state is
+        copied to CPU here and written atomically in the background. With
+        ``prune``, older ``checkpoint_epoch_*.pt`` files beyond ``keep_last``
+        are deleted after the write. Rank 0 only; other ranks return at once.
+        """
+        if self.rank != 0:
+            return
         checkpoint = {
             'epoch': epoch,
-            'model_state_dict': self.model.state_dict(),
+            'model_state_dict': self.module.state_dict(),
             'optimizer_state_dict': self.optimizer.state_dict(),
             'scheduler_state_dict': self.scheduler.state_dict(),
-            'train_losses': self.train_losses,
-            'val_losses': self.val_losses,
+            'train_losses': list(self.train_losses),
+            'val_losses': list(self.val_losses),
             'best_loss': best_loss,
+            'rng_state': rng_state(),
+            'global_step': self.global_step,
         }
         
         if self.use_amp:
             checkpoint['scaler_state_dict'] = self.scaler.state_dict()
         
-        torch.save(checkpoint, path)
-        print(f"Checkpoint saved to {path}")
+        self._write(path, cpu_snapshot(checkpoint), prune)
+    
+    def export_weights(self, path: str, epoch: int, best_loss: float) -> None:
+        """Save only the model weights (no optimizer state) for inference."""
+        if self.rank != 0:
+            return
+        weights = {
+            'epoch': epoch,
+            'best_loss': best_loss,
+            'model_state_dict': self.module.state_dict(),
+        }
+        self._write(path, cpu_snapshot(weights), False)
+    
+    def _write(self, path: str, state: Dict, prune: bool) -> None:
+        def write():
+            atomic_save(state, path)
+            if prune:
+                prune_checkpoints(os.path.dirname(path) or '.', self.keep_last)
+            print(f"Checkpoint saved to {path}")
+        
+        if self.checkpoint_writer is None:
+            write()
+        else:
+            self.checkpoint_writer.submit(write)
+    
+    def wait_for_checkpoints(self) -> None:
+        """Block until background checkpoint writes are on disk."""
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.wait()
     
     def load_checkpoint(self, path: str) -> Tuple[int, float]:
-        """Load model checkpoint."""
+        """
+        Load a checkpoint from ``save_checkpoint``. Returns (last finished
+        epoch, best loss); training resumes at the epoch after it.
+        """
         checkpoint = torch.load(path, map_location=self.device)
         
-        self.model.load_state_dict(checkpoint['model_state_dict'])
+        self.module.load_state_dict(checkpoint['model_state_dict'])
         self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
         self.scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
         
@@ -469,10 +1395,13 @@ class TransferTrainer:
         
         if self.use_amp and 'scaler_state_dict' in checkpoint:
             self.scaler.load_state_dict(checkpoint['scaler_state_dict'])
+        if 'rng_state' in checkpoint:
+            set_rng_state(checkpoint['rng_state'])
+        self.global_step = checkpoint.get('global_step', 0)
+        self.epoch = checkpoint['epoch'] + 1
         
         return checkpoint['epoch'], checkpoint.get('best_loss', float('inf'))
 
-
 def set_seed(seed: int = 42):
     """Set random seed for reproducibility."""
     random.seed(seed)
@@ -553,6 +1482,124 @@ def parse_args():
         default=42,
         help='Random seed'
     )
+    parser.add_argument(
+        '--pack-dir',
+        type=str,
+        default=None,
+        help='Decode and resize pairs once into memory-mapped packs here and train from them'
+    )
+    parser.add_argument(
+        '--num-workers',
+        type=int,
+        default=4,
+        help='DataLoader workers (and packing threads x2)'
+    )
+    parser.add_argument(
+        '--manifest',
+        type=str,
+        default=None,
+        help='Prebuilt pair manifest for --data-dir (written from a scan if missing)'
+    )
+    parser.add_argument(
+        '--val-manifest',
+        type=str,
+        default=None,
+        help='Prebuilt pair manifest for --val-dir'
+    )
+    parser.add_argument(
+        '--patch-size',
+        type=int,
+        default=0,
+        help='Train on aligned random crops of this size at full resolution (0: resize to --image-size)'
+    )
+    parser.add_argument(
+        '--patches-per-image',
+        type=int,
+        default=None,
+        help='Crops sampled from each image per epoch in patch mode (default: 8)'
+    )
+    parser.add_argument(
+        '--patch-scales',
+        type=str,
+        default=None,
+        help='Comma-separated crop scales for patch mode, e.g. 1.0,0.5 (default: 1.0)'
+    )
+    parser.add_argument(
+        '--target-cache-gb',
+        type=float,
+        default=0,
+        help='Cache target VGG features per sample up to this many GB on the training device (not in patch mode)'
+    )
+    parser.add_argument(
+        '--grad-accum-steps',
+        type=int,
+        default=None,
+        help='Micro-batches per optimizer step (effective batch: batch size x ranks x this; default: 4)'
+    )
+    parser.add_argument(
+        '--checkpoint-activations',
+        action='store_true',
+        help='Recompute encoder and residual block activations in backward to fit larger batches'
+    )
+    parser.add_argument(
+        '--dist-backend',
+        type=str,
+        default=None,
+        help='torch.distributed backend under torchrun (default: nccl with GPUs, else gloo)'
+    )
+    parser.add_argument(
+        '--checkpoint-every',
+        type=int,
+        default=None,
+        help='Write checkpoint_epoch_N.pt every N epochs (default: 1)'
+    )
+    parser.add_argument(
+        '--keep-last',
+        type=int,
+        default=None,
+        help='Epoch checkpoints to keep (0 keeps all; default: 3); best_model.pt is always kept'
+    )
+    parser.add_argument(
+        '--metrics-window',
+        type=int,
+        default=None,
+        help='Steps per line of <output-dir>/metrics.jsonl (phase times, images/sec, peak memory; default: 50)'
+    )
+    parser.add_argument(
+        '--profile-steps',
+        type=str,
+        default=None,
+        help='Capture a torch.profiler trace over training steps START:END into <output-dir>/profile_trace.json'
+    )
+    parser.add_argument(
+        '--teacher',
+        type=str,
+        default=None,
+        help='Distill from this frozen RefinementUNet checkpoint into a student'
+    )
+    parser.add_argument(
+        '--student-channels',
+        type=int,
+        default=None,
+        help='Student base channels (distillation only; default: 32)'
+    )
+    parser.add_argument(
+        '--student-blocks',
+        type=int,
+        default=None,
+        help='Student residual blocks (distillation only; default: 3)'
+    )
+    parser.add_argument(
+        '--dense-student',
+        action='store_true',
+        help='Use dense 3x3 convs in the student instead of depthwise-separable ones'
+    )
+    parser.add_argument(
+        '--distill-weight',
+        type=float,
+        default=None,
+        help='Weight of the L1-to-teacher term; the ground-truth losses get 1 - this (default: 0.5)'
+    )
     
     return parser.parse_args()
 
@@ -567,6 +1614,10 @@ def main():
     """Main entry point."""
     args = parse_args()
     
+    # Join the process group when launched with torchrun
+    rank, world_size, local_rank = setup_distributed(args.dist_backend)
+    is_main = rank == 0
+    
     # Set seed
     set_seed(args.seed)
     
@@ -584,47 +1635,122 @@ def main():
     image_size = args.image_size or config.get('image_size', 512)
     device = args.device or config.get('device', 'cuda')
     output_dir = Path(args.output_dir or config.get('output_dir', './outputs'))
+    pack_dir = args.pack_dir or config.get('pack_dir')
+    num_workers = args.num_workers
+    patch_size = args.patch_size or config.get('patch_size', 0)
+    patches_per_image = (
+        args.patches_per_image if args.patches_per_image is not None else config.get('patches_per_image', 8)
+    )
+    patch_scales = args.patch_scales if args.patch_scales is not None else config.get('patch_scales', '1.0')
+    patch_scales = tuple(float(v) for v in str(patch_scales).split(','))
+    target_cache_gb = args.target_cache_gb or config.get('target_cache_gb', 0)
+    grad_accum_steps = (
+        args.grad_accum_steps if args.grad_accum_steps is not None else config.get('grad_accum_steps', 4)
+    )
+    checkpoint_activations = args.checkpoint_activations or config.get('checkpoint_activations', False)
+    if world_size > 1 and device.startswith('cuda'):
+        device = f'cuda:{local_rank}'
+    
+    if patch_size and pack_dir:
+        raise ValueError("--pack-dir stores resized squares and cannot be combined with --patch-size")
+    if patch_size and target_cache_gb:
+        raise ValueError("Random patches change every epoch, so --target-cache-gb needs full-image training")
     
     output_dir.mkdir(parents=True, exist_ok=True)
     
+    def make_dataset(directory: str, manifest: Optional[str], seed: Optional[int] = None) -> Dataset:
+        if patch_size:
+            return PatchPairDataset(
+                load_pairs(directory, manifest), patch_size, patches_per_image, patch_scales, seed=seed
+            )
+        if pack_dir:
+            # Rank 0 packs; the others wait and then open its pack
+            if world_size > 1 and not is_main:
+                dist.barrier()
+            dataset = packed_dataset(directory, pack_dir, image_size, num_workers * 2, manifest)
+            if world_size > 1 and is_main:
+                dist.barrier()
+            return dataset
+        return PairedImageDataset(data_dir=directory, image_size=image_size, manifest=manifest)
+    
     # Create datasets
-    train_dataset = PairedImageDataset(
-        data_dir=data_dir,
-        image_size=image_size
-    )
+    train_dataset = make_dataset(data_dir, args.manifest or config.get('manifest'))
+    if target_cache_gb:
+        train_dataset = IndexedDataset(train_dataset)
     
+    # Each rank gets a disjoint shard, reshuffled every epoch via set_epoch
+    train_sampler = DistributedSampler(train_dataset, seed=args.seed) if world_size > 1 else None
     train_loader = DataLoader(
         train_dataset,
         batch_size=batch_size,
-        shuffle=True,
-        num_workers=4,
-        pin_memory=True
+        shuffle=train_sampler is None,
+        sampler=train_sampler,
+        num_workers=num_workers,
+        pin_memory=True,
+        persistent_workers=num_workers > 0,
+        collate_fn=collate_patches if patch_size else None
     )
     
     val_loader = None
     if val_dir:
-        val_dataset = PairedImageDataset(
-            data_dir=val_dir,
-            image_size=image_size
-        )
+        # Fixed validation crops, so best-checkpoint selection is not driven by crop noise
+        val_dataset = make_dataset(val_dir, args.val_manifest or config.get('val_manifest'), seed=0)
+        val_sampler = DistributedSampler(val_dataset, shuffle=False) if world_size > 1 else None
         val_loader = DataLoader(
             val_dataset,
             batch_size=batch_size,
             shuffle=False,
-            num_workers=4,
-            pin_memory=True
+            sampler=val_sampler,
+            num_workers=num_workers,
+            pin_memory=True,
+            persistent_workers=num_workers > 0,
+            collate_fn=collate_patches if patch_size else None
         )
     
-    print(f"Training dataset: {len(train_dataset)} pairs")
-    if val_loader:
-        print(f"Validation dataset: {len(val_dataset)} pairs")
+    if is_main:
+        print(f"Training dataset: {len(train_dataset)} pairs")
+        if val_loader:
+            print(f"Validation dataset: {len(val_dataset)} pairs")
+        print(f"Effective batch: {batch_size} x {world_size} ranks x {grad_accum_steps} accumulation steps")
     
-    # Create model
-    model = RefinementUNet(
-        in_channels=3,
-        out_channels=3,
-        base_channels=64,
-        num_residual_blocks=9
+    # Create model (a narrow student when distilling from a teacher)
+    teacher = None
+    teacher_path = args.teacher or config.get('teacher')
+    if teacher_path:
+        teacher = load_refinement_model(teacher_path)
+        student_channels = (
+            args.student_channels if args.student_channels is not None else config.get('student_channels', 32)
+        )
+        student_blocks = (
+            args.student_blocks if args.student_blocks is not None else config.get('student_blocks', 3)
+        )
+        model = RefinementUNet(
+            base_channels=student_channels,
+            num_residual_blocks=student_blocks,
+            checkpoint_activations=checkpoint_activations,
+            separable=not (args.dense_student or config.get('dense_student', False))
+        )
+    else:
+        model = RefinementUNet(
+            in_channels=3,
+            out_channels=3,
+            base_channels=64,
+            num_residual_blocks=9,
+            checkpoint_activations=checkpoint_activations
+        )
+    
+    profiler = None
+    profile_steps = args.profile_steps or config.get('profile_steps')
+    if profile_steps:
+        start, end = (int(v) for v in str(profile_steps).split(':'))
+        profile_device = torch.device(device if torch.cuda.is_available() else 'cpu')
+        profiler = StepProfiler(start, end, str(output_dir / 'profile_trace.json'), profile_device)
+    
+    keep_last = args.keep_last if args.keep_last is not None else config.get('keep_last', 3)
+    distill_weight = args.distill_weight if args.distill_weight is not None else config.get('distill_weight', 0.5)
+    metrics_window = args.metrics_window if args.metrics_window is not None else config.get('metrics_window', 50)
+    checkpoint_every = (
+        args.checkpoint_every if args.checkpoint_every is not None else config.get('checkpoint_every', 1)
     )
     
     # Create trainer
@@ -632,7 +1758,14 @@ def main():
         model=model,
         device=device,
         lr=lr,
-        use_amp=torch.cuda.is_available()
+        use_amp=torch.cuda.is_available(),
+        target_cache_bytes=int(target_cache_gb * 1024 ** 3),
+        keep_last=keep_last,
+        metrics_path=str(output_dir / 'metrics.jsonl'),
+        metrics_window=metrics_window,
+        profiler=profiler,
+        teacher=teacher,
+        distill_weight=distill_weight
     )
     
     # Resume from checkpoint if specified
@@ -640,27 +1773,35 @@ def main():
     best_loss = float('inf')
     
     if args.resume:
-        start_epoch, best_loss = trainer.load_checkpoint(args.resume)
-        print(f"Resumed from epoch {start_epoch}")
+        last_epoch, best_loss = trainer.load_checkpoint(args.resume)
+        start_epoch = last_epoch + 1
+        if is_main:
+            print(f"Resumed after epoch {start_epoch}")
     
     # Training loop
-    print(f"\nStarting training for {epochs} epochs...")
+    if is_main:
+        print(f"\nStarting training for {epochs} epochs...")
     
     for epoch in range(start_epoch, epochs):
-        print(f"\nEpoch {epoch + 1}/{epochs}")
+        if is_main:
+            print(f"\nEpoch {epoch + 1}/{epochs}")
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
         
-        # Train
-        train_loss = trainer.train_epoch(train_loader)
-        print(f"Train Loss: {train_loss:.4f}")
+        # Train (losses are averaged over ranks, so every rank agrees below)
+        train_loss = trainer.train_epoch(train_loader, gradient_accumulation_steps=grad_accum_steps)
+        if is_main:
+            print(f"Train Loss: {train_loss:.4f}")
         trainer.train_losses.append(train_loss)
         
         # Validate
         if val_loader:
             val_loss = trainer.validate(val_loader)
-            print(f"Val Loss: {val_loss:.4f}")
+            if is_main:
+                print(f"Val Loss: {val_loss:.4f}")
             trainer.val_losses.append(val_loss)
             
-            # Save best model
+            # Save best model, plus its weights alone for inference
             if val_loss < best_loss:
                 best_loss = val_loss
                 trainer.save_checkpoint(
@@ -668,21 +1809,32 @@ def main():
                     epoch,
                     best_loss
                 )
+                trainer.export_weights(str(output_dir / 'best_weights.pt'), epoch, best_loss)
         
-        # Save periodic checkpoint
-        if (epoch + 1) % 10 == 0:
+        # Save periodic checkpoint, keeping the last --keep-last
+        if (epoch + 1) % checkpoint_every == 0:
             trainer.save_checkpoint(
                 str(output_dir / f'checkpoint_epoch_{epoch+1}.pt'),
                 epoch,
-                best_loss
+                best_loss,
+                prune=True
             )
     
     # Save final model
     trainer.save_checkpoint(
         str(output_dir / 'final_model.pt'),
-        epochs,
+        epochs - 1,
         best_loss
     )
+    trainer.export_weights(str(output_dir / 'final_weights.pt'), epochs - 1, best_loss)
+    trainer.wait_for_checkpoints()
+    if trainer.profiler is not None:
+        trainer.profiler.stop()
+    
+    if world_size > 1:
+        dist.destroy_process_group()
+    if not is_main:
+        return
     
     # Save training history
     history = {
@@ -696,6 +1848,5 @@ def main():
     print(f"\nTraining complete! Best loss: {best_loss:.4f}")
     print(f"Models saved to {output_dir}")
 
-
 if __name__ == '__main__':
     main()
@@ -11,9 +11,17 @@ transfer using various metrics:
 - Keypoint IoU for fit accuracy
 - Demographic parity metrics
 
+Pairs are decoded and scored on a process pool while LPIPS runs in
+batches. Every result (or error) is streamed to a JSON-lines file as it
+finishes, and stored in a persistent store keyed by the content hashes of
+both images and the metric version, so re-runs only compute pairs whose
+files changed and an interrupted run resumes.
+
 Usage:
     python benchmark_transfer.py --baseline-dir ./baseline --refined-dir ./refined
     python benchmark_transfer.py --pairs-file pairs.json --output results.json
+    python benchmark_transfer.py --pairs-file pairs.json --workers 16 --lpips-batch-size 32
+    python benchmark_transfer.py --baseline-dir ./baseline --refined-dir ./refined_v1 --diff-dir ./refined_v2
 
 @author: R&D Team
 @date: 2024
@@ -23,10 +31,14 @@ import os
 import argparse
 import json
 import glob
+import hashlib
+import multiprocessing
 import numpy as np
 import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from typing import Iterable, List, Dict, Tuple, Optional
 from dataclasses import dataclass, field, asdict
 import cv2
 from PIL import Image
@@ -46,6 +58,13 @@ try:
 except ImportError:
     TORCH_AVAILABLE = False
 
+# Bump when a metric implementation changes; stored results from other
+# versions are then recomputed
+METRICS_VERSION = 1
+
+# Metrics compared by --diff-dir, and whether lower values are better
+DIFF_METRICS = {'lpips': True, 'ssim': False, 'psnr': False, 'delta_e': True, 'mse': True}
+
 
 @dataclass
 class EvaluationMetrics:
@@ -87,7 +106,7 @@ class AggregateResults:
 class LPIPSModel:
     """LPIPS (Learned Perceptual Image Patch Similarity) calculator."""
     
-    def __init__(self, net: str = 'alex'):
+    def __init__(self, net: str = 'alex', pretrained: bool = True):
         if not TORCH_AVAILABLE:
             raise ImportError("PyTorch is required for LPIPS calculation")
         
@@ -95,9 +114,9 @@ class LPIPSModel:
         
         # Load pretrained network
         if net == 'alex':
-            self.net = models.alexnet(pretrained=True).features.to(self.device)
+            self.net = models.alexnet(pretrained=pretrained).features.to(self.device)
         elif net == 'vgg':
-            self.net = models.vgg16(pretrained=True).features.to(self.device)
+            self.net = models.vgg16(pretrained=pretrained).features.to(self.device)
         else:
             raise ValueError(f"Unknown network: {net}")
         
@@ -123,6 +142,20 @@ class LPIPSModel:
             lpips = diff.mean().item()
         
         return float(lpips)
+    
+    def calculate_batch(self, images1: np.ndarray, images2: np.ndarray) -> List[float]:
+        """LPIPS for each pair in two (N, H, W, 3) uint8 stacks, in one forward pass."""
+        mean = torch.tensor([0.485, 0.456, 0.406], device=self.device).view(1, 3, 1, 1)
+        std = torch.tensor([0.229, 0.224, 0.225], device=self.device).view(1, 3, 1, 1)
+        batch = torch.from_numpy(np.concatenate([images1, images2])).to(self.device)
+        batch = (batch.permute(0, 3, 1, 2).float() / 255 - mean) / std
+        
+        with torch.no_grad():
+            feat1, feat2 = self.net(batch).chunk(2)
+            diff = (feat1 - feat2).pow(2).sum(dim=1, keepdim=True)
+            lpips = diff.mean(dim=(1, 2, 3))
+        
+        return [float(v) for v in lpips.cpu()]
 
 
 def calculate_ssim(img1: np.ndarray, img2: np.ndarray) -> float:
@@ -222,11 +255,203 @@ def calculate_delta_e(img1: np.ndarray, img2: np.ndarray) -> float:
     return float(np.mean(delta_e))
 
 
+def _init_worker():
+    # The pool supplies the parallelism; keep OpenCV to one thread per process
+    cv2.setNumThreads(1)
+
+
+def compute_pair_metrics(baseline_path: str, refined_path: str, keep_pixels: bool = False) -> Dict:
+    """
+    Decode a pair and compute SSIM, PSNR, Delta E and MSE (runs in pool
+    workers). The refined image is resized to the baseline's size first,
+    as the metric functions would. With ``keep_pixels`` both arrays are
+    returned too, for batched LPIPS in the parent.
+    """
+    try:
+        with Image.open(baseline_path) as img:
+            baseline = np.array(img.convert('RGB'))
+        with Image.open(refined_path) as img:
+            refined = np.array(img.convert('RGB'))
+        if refined.shape != baseline.shape:
+            refined = cv2.resize(refined, (baseline.shape[1], baseline.shape[0]))
+        
+        metrics = {
+            'ssim': calculate_ssim(baseline, refined),
+            'psnr': calculate_psnr(baseline, refined),
+            'delta_e': calculate_delta_e(baseline, refined),
+            'mse': calculate_mse(baseline, refined),
+        }
+    except Exception as e:
+        return {'error': str(e)}
+    
+    output = {'metrics': metrics}
+    if keep_pixels:
+        output['pixels'] = (baseline, refined)
+    return output
+
+
+def result_record(result: 'EvaluationResult') -> Dict:
+    """JSON-serializable form of a result, as written to the output file."""
+    return {
+        'image_name': result.image_name,
+        'baseline': result.baseline_path,
+        'refined': result.refined_path,
+        'metrics': asdict(result.metrics),
+        'demographic': result.demographic_info,
+    }
+
+
+def default_results_store() -> str:
+    """Results store shared by all runs, under the user's cache directory."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'closetai', 'benchmark_results.jsonl')
+
+
+def hash_file(path: str) -> str:
+    """SHA-1 of a file's contents."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultsStore:
+    """
+    Append-only JSON-lines store of pair metrics.
+    
+    Metrics are keyed by (baseline hash, refined hash, METRICS_VERSION),
+    so unchanged pairs are never recomputed whatever their paths. File
+    hashes are memoized by (path, size, mtime) in the same file, so an
+    unchanged tree is not re-read either. Lines are flushed as they are
+    written. A line cut short by a crash is skipped on load and
+    terminated before anything new is appended.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.metrics: Dict[Tuple[str, str], Dict] = {}
+        self.files: Dict[str, Tuple[int, int, str]] = {}
+        
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record.get('type') == 'file':
+                        self.files[record['path']] = (record['size'], record['mtime_ns'], record['sha1'])
+                    elif record.get('type') == 'metrics' and record.get('version') == METRICS_VERSION:
+                        self.metrics[(record['baseline'], record['refined'])] = record['metrics']
+        
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, 'a+')
+        if self._file.tell():
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != '\n':
+                self._file.write('\n')
+    
+    def _append(self, record: Dict) -> None:
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+    
+    def hashes(self, paths: Iterable[str], workers: int = 8) -> Dict[str, str]:
+        """Content hash of each path (unreadable paths are left out)."""
+        def stat_and_hash(path):
+            try:
+                stat = os.stat(path)
+                cached = self.files.get(path)
+                if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+                    return path, stat, cached[2], False
+                return path, stat, hash_file(path), True
+            except OSError:
+                return path, None, None, False
+        
+        hashes = {}
+        with ThreadPoolExecutor(workers) as pool:
+            for path, stat, digest, new in pool.map(stat_and_hash, set(paths)):
+                if digest is None:
+                    continue
+                hashes[path] = digest
+                if new:
+                    self.files[path] = (stat.st_size, stat.st_mtime_ns, digest)
+                    self._append({
+                        'type': 'file', 'path': path,
+                        'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': digest,
+                    })
+        return hashes
+    
+    def get(self, baseline_hash: str, refined_hash: str) -> Optional[Dict]:
+        return self.metrics.get((baseline_hash, refined_hash))
+    
+    def put(self, baseline_hash: str, refined_hash: str, metrics: Dict) -> None:
+        self.metrics[(baseline_hash, refined_hash)] = metrics
+        self._append({
+            'type': 'metrics', 'baseline': baseline_hash, 'refined': refined_hash,
+            'version': METRICS_VERSION, 'metrics': metrics,
+        })
+    
+    def close(self) -> None:
+        self._file.close()
+
+
+def diff_results(
+    results_a: List['EvaluationResult'],
+    results_b: List['EvaluationResult']
+) -> Dict:
+    """
+    Per-metric deltas (b - a) for pairs present in both result lists,
+    matched by baseline path. For each metric: the means, the mean delta
+    and how many pairs got better or worse in b. Non-finite values (PSNR
+    of identical images) are left out of the means and per-pair deltas.
+    """
+    by_baseline = {r.baseline_path: r for r in results_a}
+    matched = [(by_baseline[r.baseline_path], r) for r in results_b if r.baseline_path in by_baseline]
+    
+    summary = {'num_pairs': len(matched), 'metrics': {}}
+    pairs = [{'image_name': b.image_name, 'baseline': b.baseline_path} for _, b in matched]
+    for metric, lower_is_better in DIFF_METRICS.items():
+        values = np.array([
+            (getattr(a.metrics, metric), getattr(b.metrics, metric)) for a, b in matched
+            if getattr(a.metrics, metric) is not None and getattr(b.metrics, metric) is not None
+        ], dtype=np.float64).reshape(-1, 2)
+        values = values[np.isfinite(values).all(axis=1)]
+        if not len(values):
+            continue
+        delta = values[:, 1] - values[:, 0]
+        better = delta < 0 if lower_is_better else delta > 0
+        summary['metrics'][metric] = {
+            'mean_a': float(values[:, 0].mean()),
+            'mean_b': float(values[:, 1].mean()),
+            'mean_delta': float(delta.mean()),
+            'improved': int(better.sum()),
+            'regressed': int(((delta != 0) & ~better).sum()),
+        }
+    
+    for pair, (a, b) in zip(pairs, matched):
+        for metric in DIFF_METRICS:
+            value_a, value_b = getattr(a.metrics, metric), getattr(b.metrics, metric)
+            if value_a is not None and value_b is not None and np.isfinite([value_a, value_b]).all():
+                pair[metric] = value_b - value_a
+    summary['pairs'] = pairs
+    return summary
+
+
 class TransferBenchmark:
     """Main benchmark class for evaluating transfer quality."""
     
-    def __init__(self, use_lpips: bool = True):
+    def __init__(
+        self,
+        use_lpips: bool = True,
+        workers: Optional[int] = None,
+        lpips_batch_size: int = 16,
+        prefetch: Optional[int] = None
+    ):
         self.use_lpips = use_lpips and TORCH_AVAILABLE
+        self.workers = workers or os.cpu_count() or 1
+        self.lpips_batch_size = lpips_batch_size
+        self.prefetch = prefetch or max(self.workers * 4, lpips_batch_size * 2)
         
         if self.use_lpips:
             try:
@@ -275,10 +500,147 @@ class TransferBenchmark:
             metrics=metrics,
         )
     
+    def evaluate_stream(
+        self,
+        pairs: Iterable[Dict],
+        store: Optional[ResultsStore] = None,
+        stream_path: Optional[str] = None
+    ) -> List[EvaluationResult]:
+        """
+        Evaluate ``pairs`` (dicts with ``baseline``, ``refined`` and
+        optionally ``name`` and ``demographic``), in input order. Pairs
+        that fail are left out of the returned list.
+        
+        A process pool decodes each pair and computes the pixel metrics.
+        LPIPS runs here on batches of up to ``lpips_batch_size`` same-size
+        pairs. At most ``prefetch`` pairs are in flight or waiting for
+        LPIPS. With a ``store``, pairs whose content hashes already have
+        results (with LPIPS, if enabled) are read back, and each new
+        result is written to it as soon as it is complete.
+        
+        Independently of the store, ``stream_path`` (rewritten per run)
+        gets one JSON line per pair, in completion order and flushed as
+        it is written: ``result_record`` fields, or ``error`` for a pair
+        that failed.
+        """
+        pairs = list(pairs)
+        results: Dict[int, EvaluationResult] = {}
+        stream = open(stream_path, 'w') if stream_path else None
+        
+        def emit(record: Dict) -> None:
+            if stream:
+                stream.write(json.dumps(record) + '\n')
+                stream.flush()
+        
+        def fail(index: int, error: str) -> None:
+            pair = pairs[index]
+            print(f"Error evaluating {pair['baseline']}: {error}")
+            emit({
+                'image_name': pair.get('name') or Path(pair['baseline']).stem,
+                'baseline': pair['baseline'],
+                'refined': pair['refined'],
+                'error': error,
+            })
+        
+        hashes = {}
+        if store is not None:
+            hashes = store.hashes([p['baseline'] for p in pairs] + [p['refined'] for p in pairs], self.workers)
+        
+        def key(pair: Dict) -> Optional[Tuple[str, str]]:
+            if pair['baseline'] in hashes and pair['refined'] in hashes:
+                return hashes[pair['baseline']], hashes[pair['refined']]
+            return None
+        
+        def finish(index: int, metrics: Dict, write: bool = True) -> None:
+            pair = pairs[index]
+            if not self.use_lpips:
+                metrics = {**metrics, 'lpips': None}
+            result = EvaluationResult(
+                image_name=pair.get('name') or Path(pair['baseline']).stem,
+                baseline_path=pair['baseline'],
+                refined_path=pair['refined'],
+                metrics=EvaluationMetrics(**metrics),
+                demographic_info=pair.get('demographic'),
+            )
+            results[index] = result
+            emit(result_record(result))
+            if write and key(pair) is not None:
+                store.put(*key(pair), metrics)
+        
+        groups: Dict[Tuple[int, ...], List] = {}
+        buffered = 0
+        
+        def flush(key) -> None:
+            nonlocal buffered
+            group = groups.pop(key)
+            buffered -= len(group)
+            try:
+                values = self.lpips_model.calculate_batch(
+                    np.stack([baseline for _, _, baseline, _ in group]),
+                    np.stack([refined for _, _, _, refined in group])
+                )
+            except Exception as e:
+                for index, _, _, _ in group:
+                    fail(index, str(e))
+                return
+            for (index, metrics, _, _), value in zip(group, values):
+                finish(index, {**metrics, 'lpips': value})
+        
+        def take(index: int, future) -> None:
+            nonlocal buffered
+            output = future.result()
+            if 'error' in output:
+                fail(index, output['error'])
+                return
+            if not self.use_lpips:
+                finish(index, output['metrics'])
+                return
+            # LPIPS batches need equal sizes; group by the baseline's shape
+            baseline, refined = output['pixels']
+            groups.setdefault(baseline.shape, []).append((index, output['metrics'], baseline, refined))
+            buffered += 1
+            if len(groups[baseline.shape]) >= self.lpips_batch_size:
+                flush(baseline.shape)
+            elif buffered >= self.prefetch:
+                flush(max(groups, key=lambda k: len(groups[k])))
+        
+        try:
+            todo = []
+            for index, pair in enumerate(pairs):
+                stored = store.get(*key(pair)) if key(pair) is not None else None
+                if stored is not None and (stored.get('lpips') is not None or not self.use_lpips):
+                    finish(index, stored, write=False)
+                else:
+                    todo.append(index)
+            
+            if todo:
+                context = multiprocessing.get_context('spawn')
+                with ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker) as pool:
+                    pending = deque()
+                    for index in todo:
+                        pair = pairs[index]
+                        future = pool.submit(
+                            compute_pair_metrics, pair['baseline'], pair['refined'], self.use_lpips
+                        )
+                        pending.append((index, future))
+                        while pending and len(pending) + buffered >= self.prefetch:
+                            take(*pending.popleft())
+                    while pending:
+                        take(*pending.popleft())
+                    for shape in list(groups):
+                        flush(shape)
+        finally:
+            if stream:
+                stream.close()
+        
+        return [results[index] for index in sorted(results)]
+    
     def evaluate_directory(
         self, 
         baseline_dir: str, 
-        refined_dir: str
+        refined_dir: str,
+        store: Optional[ResultsStore] = None,
+        stream_path: Optional[str] = None
     ) -> List[EvaluationResult]:
         """Evaluate all matching image pairs in directories."""
         baseline_path = Path(baseline_dir)
@@ -291,9 +653,9 @@ class TransferBenchmark:
             if f.suffix.lower() in extensions
         ]
         
-        results = []
+        pairs = []
         
-        for baseline_file in baseline_files:
+        for baseline_file in sorted(baseline_files):
             # Find matching file in refined directory
             relative_path = baseline_file.relative_to(baseline_path)
             refined_file = refined_path / relative_path
@@ -302,42 +664,25 @@ class TransferBenchmark:
                 print(f"Warning: No matching file for {baseline_file}")
                 continue
             
-            try:
-                result = self.evaluate_pair(
-                    str(baseline_file),
-                    str(refined_file),
-                    image_name=relative_path.stem
-                )
-                results.append(result)
-            except Exception as e:
-                print(f"Error evaluating {baseline_file}: {e}")
+            pairs.append({
+                'baseline': str(baseline_file),
+                'refined': str(refined_file),
+                'name': relative_path.stem,
+            })
         
-        return results
+        return self.evaluate_stream(pairs, store, stream_path)
     
-    def evaluate_from_pairs(self, pairs_file: str) -> List[EvaluationResult]:
+    def evaluate_from_pairs(
+        self,
+        pairs_file: str,
+        store: Optional[ResultsStore] = None,
+        stream_path: Optional[str] = None
+    ) -> List[EvaluationResult]:
         """Evaluate from a JSON file with pairs."""
         with open(pairs_file, 'r') as f:
             pairs = json.load(f)
         
-        results = []
-        
-        for pair in pairs:
-            try:
-                result = self.evaluate_pair(
-                    pair['baseline'],
-                    pair['refined'],
-                    image_name=pair.get('name', '')
-                )
-                
-                # Add demographic info if present
-                if 'demographic' in pair:
-                    result.demographic_info = pair['demographic']
-                
-                results.append(result)
-            except Exception as e:
-                print(f"Error evaluating pair: {e}")
-        
-        return results
+        return self.evaluate_stream(pairs, store, stream_path)
     
     def aggregate_results(
         self, 
@@ -460,6 +805,43 @@ def parse_args():
         action='store_true',
         help='Disable LPIPS calculation'
     )
+    parser.add_argument(
+        '--diff-dir',
+        type=str,
+        help='Second refined directory: report metric deltas against --refined-dir '
+             'over the same --baseline-dir'
+    )
+    parser.add_argument(
+        '--store',
+        type=str,
+        default=None,
+        help='Results store keyed by image content hash; only pairs missing from it are '
+             'computed (default: ~/.cache/closetai/benchmark_results.jsonl)'
+    )
+    parser.add_argument(
+        '--no-store',
+        action='store_true',
+        help='Compute every pair and do not record results (they still stream to --stream)'
+    )
+    parser.add_argument(
+        '--stream',
+        type=str,
+        default=None,
+        help='JSON-lines file each result or error is written to as it finishes '
+             '(default: the output path with a .jsonl suffix)'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Processes decoding images and computing SSIM/PSNR/Delta E/MSE (default: all CPUs)'
+    )
+    parser.add_argument(
+        '--lpips-batch-size',
+        type=int,
+        default=16,
+        help='Same-size pairs per LPIPS forward pass'
+    )
     
     return parser.parse_args()
 
@@ -469,16 +851,53 @@ def main():
     args = parse_args()
     
     # Initialize benchmark
-    benchmark = TransferBenchmark(use_lpips=not args.no_lpips)
+    benchmark = TransferBenchmark(
+        use_lpips=not args.no_lpips,
+        workers=args.workers,
+        lpips_batch_size=args.lpips_batch_size
+    )
+    store = None if args.no_store else ResultsStore(args.store or default_results_store())
+    stream_path = args.stream or str(Path(args.output).with_suffix('.jsonl'))
+    
+    # Diff mode: both refined directories against the same baselines
+    if args.diff_dir:
+        if not (args.baseline_dir and args.refined_dir):
+            print("--diff-dir needs --baseline-dir and --refined-dir")
+            return
+        stream = Path(stream_path)
+        results_a = benchmark.evaluate_directory(
+            args.baseline_dir, args.refined_dir, store, str(stream.with_name(f"{stream.stem}_a{stream.suffix}"))
+        )
+        results_b = benchmark.evaluate_directory(
+            args.baseline_dir, args.diff_dir, store, str(stream.with_name(f"{stream.stem}_b{stream.suffix}"))
+        )
+        if store is not None:
+            store.close()
+        diff = diff_results(results_a, results_b)
+        
+        print("\n" + "=" * 50)
+        print(f"METRIC DELTAS: {args.diff_dir} - {args.refined_dir}")
+        print("=" * 50)
+        print(f"Matched pairs: {diff['num_pairs']}")
+        for metric, stats in diff['metrics'].items():
+            print(f"  {metric:8s} {stats['mean_a']:10.4f} -> {stats['mean_b']:10.4f}  "
+                  f"(delta {stats['mean_delta']:+.4f}, {stats['improved']} better, {stats['regressed']} worse)")
+        
+        with open(args.output, 'w') as f:
+            json.dump(diff, f, indent=2)
+        print(f"\nDiff saved to {args.output}")
+        return
     
     # Run evaluation
     if args.pairs_file:
-        results = benchmark.evaluate_from_pairs(args.pairs_file)
+        results = benchmark.evaluate_from_pairs(args.pairs_file, store, stream_path)
     elif args.baseline_dir and args.refined_dir:
-        results = benchmark.evaluate_directory(args.baseline_dir, args.refined_dir)
+        results = benchmark.evaluate_directory(args.baseline_dir, args.refined_dir, store, stream_path)
     else:
         print("Please specify either --pairs-file or --baseline-dir and --refined-dir")
         return
+    if store is not None:
+        store.close()
     
     # Aggregate results
     aggregate = benchmark.aggregate_results(results)
@@ -503,14 +922,7 @@ def main():
     # Save results
     output = {
         'aggregate': asdict(aggregate),
-        'individual_results': [
-            {
-                'image_name': r.image_name,
-                'metrics': asdict(r.metrics),
-                'demographic': r.demographic_info,
-            }
-            for r in results
-        ]
+        'individual_results': [result_record(r) for r in results]
     }
     
     with open(args.output, 'w') as f:
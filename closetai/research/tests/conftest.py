@@ -0,0 +1,5 @@
+import os
+import sys
+
+# research scripts are standalone files rather than a package
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
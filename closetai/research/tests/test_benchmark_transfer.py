@@ -0,0 +1,219 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+torch = pytest.importorskip("torch")
+bt = pytest.importorskip("benchmark_transfer")
+
+# Two sizes, alternating, so LPIPS batches (grouped by size) complete out of input order
+SIZES = [(96, 72), (112, 112)]
+
+
+@pytest.fixture
+def pairs_dir(tmp_path):
+    rng = np.random.default_rng(0)
+    for name in ('baseline', 'refined'):
+        (tmp_path / name).mkdir()
+    for i in range(6):
+        width, height = SIZES[i % 2]
+        baseline = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+        refined = np.clip(baseline.astype(int) + rng.integers(-20, 20, baseline.shape), 0, 255).astype(np.uint8)
+        Image.fromarray(baseline).save(tmp_path / 'baseline' / f'{i:03d}.png')
+        Image.fromarray(refined).save(tmp_path / 'refined' / f'{i:03d}.png')
+    return tmp_path
+
+
+def _benchmark(lpips: bool = False, **kwargs):
+    """Benchmark with a randomly initialised LPIPS network (no download)."""
+    benchmark = bt.TransferBenchmark(use_lpips=False, workers=2, **kwargs)
+    if lpips:
+        torch.manual_seed(0)
+        benchmark.lpips_model = bt.LPIPSModel(pretrained=False)
+        benchmark.use_lpips = True
+    return benchmark
+
+
+def _lines(path):
+    return [json.loads(line) for line in Path(path).read_text().splitlines()]
+
+
+def test_batched_lpips_matches_per_pair():
+    torch.manual_seed(0)
+    model = bt.LPIPSModel(pretrained=False)
+    rng = np.random.default_rng(1)
+    images1 = rng.integers(0, 255, (3, 80, 96, 3), dtype=np.uint8)
+    images2 = rng.integers(0, 255, (3, 80, 96, 3), dtype=np.uint8)
+    batched = model.calculate_batch(images1, images2)
+    single = [model.calculate(Image.fromarray(a), Image.fromarray(b)) for a, b in zip(images1, images2)]
+    assert np.allclose(batched, single, rtol=1e-4, atol=1e-7)
+
+
+def test_results_keep_input_order_and_stream_incrementally(pairs_dir, monkeypatch):
+    benchmark = _benchmark(lpips=True, lpips_batch_size=2)
+    stream = pairs_dir / 'stream.jsonl'
+    on_disk = []
+    calculate_batch = benchmark.lpips_model.calculate_batch
+
+    def recording(images1, images2):
+        on_disk.append(len(stream.read_text().splitlines()))
+        return calculate_batch(images1, images2)
+
+    monkeypatch.setattr(benchmark.lpips_model, 'calculate_batch', recording)
+    results = benchmark.evaluate_directory(str(pairs_dir / 'baseline'), str(pairs_dir / 'refined'), stream_path=str(stream))
+
+    assert [r.image_name for r in results] == [f'{i:03d}' for i in range(6)]
+    streamed = _lines(stream)
+    # Same-size pairs complete together, so the stream is in completion order
+    assert [r['image_name'] for r in streamed] == ['000', '002', '001', '003', '004', '005']
+    # Each batch's results are flushed before the next batch is scored
+    assert on_disk == [0, 2, 4, 5]
+    by_name = {r['image_name']: r['metrics'] for r in streamed}
+    for result in results:
+        assert by_name[result.image_name] == json.loads(json.dumps(bt.asdict(result.metrics)))
+        reference = benchmark.evaluate_pair(result.baseline_path, result.refined_path)
+        for metric in ('lpips', 'ssim', 'psnr', 'delta_e', 'mse'):
+            assert getattr(result.metrics, metric) == pytest.approx(getattr(reference.metrics, metric), rel=1e-4)
+
+
+def test_failing_pair_is_recorded_without_stopping_the_run(pairs_dir):
+    (pairs_dir / 'baseline' / '002.png').write_bytes(b'not an image')
+    pairs = [
+        {'baseline': str(pairs_dir / 'baseline' / f'{i:03d}.png'), 'refined': str(pairs_dir / 'refined' / f'{i:03d}.png')}
+        for i in range(6)
+    ]
+    pairs.append({'baseline': str(pairs_dir / 'baseline' / '000.png'), 'refined': str(pairs_dir / 'missing.png'), 'name': 'gone'})
+    stream = pairs_dir / 'stream.jsonl'
+    results = _benchmark().evaluate_stream(pairs, stream_path=str(stream))
+
+    assert [r.image_name for r in results] == ['000', '001', '003', '004', '005']
+    errors = {r['image_name']: r['error'] for r in _lines(stream) if 'error' in r}
+    assert set(errors) == {'002', 'gone'}
+    assert len(_lines(stream)) == 7
+
+
+def _metric_lines(path):
+    """Metrics records in a store, skipping a line cut short by a crash."""
+    records = []
+    for line in Path(path).read_text().splitlines():
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return [r for r in records if r.get('type') == 'metrics']
+
+
+def _no_pool(*args, **kwargs):
+    raise AssertionError('every pair should have been read from the store')
+
+
+def test_store_reuses_results_for_the_same_bytes_under_new_paths(pairs_dir, tmp_path_factory, monkeypatch):
+    store_path = pairs_dir / 'store.jsonl'
+    store = bt.ResultsStore(str(store_path))
+    first = _benchmark().evaluate_directory(str(pairs_dir / 'baseline'), str(pairs_dir / 'refined'), store)
+    store.close()
+    assert len(_metric_lines(store_path)) == 6
+
+    moved = tmp_path_factory.mktemp('moved')
+    for name in ('baseline', 'refined'):
+        for path in (pairs_dir / name).iterdir():
+            (moved / name).mkdir(exist_ok=True)
+            (moved / name / f'copy_{path.name}').write_bytes(path.read_bytes())
+    monkeypatch.setattr(bt, 'ProcessPoolExecutor', _no_pool)
+    store = bt.ResultsStore(str(store_path))
+    second = _benchmark().evaluate_directory(str(moved / 'baseline'), str(moved / 'refined'), store)
+    store.close()
+
+    assert [r.metrics for r in second] == [r.metrics for r in first]
+    assert [r.image_name for r in second] == [f'copy_{i:03d}' for i in range(6)]
+    assert len(_metric_lines(store_path)) == 6
+
+
+def test_metrics_version_bump_invalidates_stored_results(pairs_dir, monkeypatch):
+    store_path = pairs_dir / 'store.jsonl'
+    store = bt.ResultsStore(str(store_path))
+    _benchmark().evaluate_directory(str(pairs_dir / 'baseline'), str(pairs_dir / 'refined'), store)
+    store.close()
+
+    monkeypatch.setattr(bt, 'METRICS_VERSION', bt.METRICS_VERSION + 1)
+    store = bt.ResultsStore(str(store_path))
+    assert store.metrics == {} and len(store.files) == 12
+    results = _benchmark().evaluate_directory(str(pairs_dir / 'baseline'), str(pairs_dir / 'refined'), store)
+    store.close()
+
+    assert len(results) == 6
+    assert [r['version'] for r in _metric_lines(store_path)] == [1] * 6 + [2] * 6
+
+
+def test_store_recovers_from_a_truncated_last_line(pairs_dir):
+    store_path = pairs_dir / 'store.jsonl'
+    store = bt.ResultsStore(str(store_path))
+    first = _benchmark().evaluate_directory(str(pairs_dir / 'baseline'), str(pairs_dir / 'refined'), store)
+    store.close()
+
+    # Crash while writing the last metrics record
+    text = store_path.read_text()
+    store_path.write_text(text[:text.rindex('"metrics": {') + 20])
+    store = bt.ResultsStore(str(store_path))
+    assert len(store.metrics) == 5
+    second = _benchmark().evaluate_directory(str(pairs_dir / 'baseline'), str(pairs_dir / 'refined'), store)
+    store.close()
+
+    assert [r.metrics for r in second] == [r.metrics for r in first]
+    lines = store_path.read_text().splitlines()
+    assert sum(1 for line in lines if line.endswith('}')) == len(lines) - 1
+    assert len({(r['baseline'], r['refined']) for r in _metric_lines(store_path)}) == 6
+    assert len(_metric_lines(store_path)) == 6
+
+
+def test_no_store_run_still_streams(pairs_dir, monkeypatch):
+    output = pairs_dir / 'out' / 'results.json'
+    output.parent.mkdir()
+    monkeypatch.setattr('sys.argv', [
+        'benchmark_transfer.py', '--baseline-dir', str(pairs_dir / 'baseline'),
+        '--refined-dir', str(pairs_dir / 'refined'), '--output', str(output),
+        '--no-store', '--no-lpips', '--workers', '1',
+    ])
+    monkeypatch.setattr(bt, 'ResultsStore', _no_pool)
+    bt.main()
+
+    assert [r['image_name'] for r in _lines(output.with_suffix('.jsonl'))] == [f'{i:03d}' for i in range(6)]
+    assert json.loads(output.read_text())['aggregate']['num_samples'] == 6
+
+
+def _result(name, **metrics):
+    return bt.EvaluationResult(name, f'base/{name}.png', f'ref/{name}.png', bt.EvaluationMetrics(**metrics))
+
+
+def test_diff_results_deltas_and_counts():
+    results_a = [
+        _result('a', ssim=0.8, psnr=30.0, mse=4.0),
+        _result('b', ssim=0.9, psnr=float('inf'), mse=0.0),
+        _result('c', ssim=0.7, psnr=25.0, mse=9.0),
+        _result('only_a', ssim=0.1, psnr=10.0, mse=99.0),
+    ]
+    results_b = [
+        _result('c', ssim=0.6, psnr=24.0, mse=10.0),
+        _result('a', ssim=0.9, psnr=32.0, mse=3.0),
+        _result('b', ssim=0.9, psnr=float('inf'), mse=0.0),
+    ]
+    diff = bt.diff_results(results_a, results_b)
+
+    assert diff['num_pairs'] == 3
+    assert 'lpips' not in diff['metrics']
+    ssim, psnr, mse = (diff['metrics'][m] for m in ('ssim', 'psnr', 'mse'))
+    assert ssim['mean_delta'] == pytest.approx(0.0)
+    assert (ssim['improved'], ssim['regressed']) == (1, 1)
+    # Identical images (infinite PSNR) are left out of the PSNR figures
+    assert psnr['mean_a'] == pytest.approx(27.5) and psnr['mean_b'] == pytest.approx(28.0)
+    assert (psnr['improved'], psnr['regressed']) == (1, 1)
+    # Lower MSE is better; an unchanged pair counts as neither
+    assert mse['mean_delta'] == pytest.approx(0.0)
+    assert (mse['improved'], mse['regressed']) == (1, 1)
+
+    pairs = {p['image_name']: p for p in diff['pairs']}
+    assert pairs['a']['mse'] == pytest.approx(-1.0) and pairs['c']['ssim'] == pytest.approx(-0.1)
+    assert 'psnr' not in pairs['b']
+    json.dumps(diff, allow_nan=False)